@@ -6,8 +6,7 @@ from slicer.i18n import translate
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin, setDataProbeVisible
 import qt
-from typing import Callable
-import SimpleITK as sitk
+from typing import Callable, Optional
 
 class ImageAugmenter(ScriptedLoadableModule):
     """Uses ScriptedLoadableModule base class, available at:
@@ -30,6 +29,7 @@ class ImageAugmenterWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.logic = None
         self._parameterNode = None
         self._parameterNodeGuiTag = None
+        self.job = None
 
     def checkDependencies(self):
         from importlib.util import find_spec
@@ -57,6 +57,7 @@ class ImageAugmenterWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         setDataProbeVisible(False)
 
         self.ui.deviceList.addItem("CPU")
+        self.ui.numWorkers.setMaximum(os.cpu_count() or 1)
 
         self.ui.hierarchicalTreeWidget.expandItem(self.ui.hierarchicalTreeWidget.topLevelItem(0))
 
@@ -70,6 +71,7 @@ class ImageAugmenterWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         # Buttons
         self.ui.applyButton.connect("clicked(bool)", self.onApplyButton)
         self.ui.previewButton.connect("clicked(bool)", self.onPreviewButton)
+        self.ui.refinePreviewButton.connect("clicked(bool)", self.onRefinePreviewButton)
         
         previewSettingsIconPath = os.path.join(os.path.dirname(slicer.util.modulePath(self.__module__)), 'Resources/Icons', 'cog.png')
         self.ui.previewSettingsButton.setIcon(qt.QIcon(previewSettingsIconPath))
@@ -83,6 +85,13 @@ class ImageAugmenterWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.ui.maskRegexButton.connect("clicked(bool)", self.onMaskRexegButton)
         
         
+        self.ui.pauseButton.connect("clicked(bool)", self.onPauseButton)
+        self.ui.cancelButton.connect("clicked(bool)", self.onCancelButton)
+        self.setJobButtonsVisible(False)
+
+        self.ui.saveRecipeButton.connect("clicked(bool)", self.onSaveRecipeButton)
+        self.ui.loadRecipeButton.connect("clicked(bool)", self.onLoadRecipeButton)
+
         self.ui.installRequirementsButton.connect("clicked(bool)", self.onInstallRequirements)
         self.previewSettingsDialog = PreviewCheckboxDialog()
         self.selectedPreviewOptions = []
@@ -113,9 +122,12 @@ class ImageAugmenterWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     def setButtonsEnabled(self, state: bool = True):
         self.ui.applyButton.setEnabled(state)
         self.ui.previewButton.setEnabled(state)
+        self.ui.refinePreviewButton.setEnabled(state)
         self.ui.previewSettingsButton.setEnabled(state)
         self.ui.imageRegexButton.setEnabled(state)
         self.ui.maskRegexButton.setEnabled(state)
+        self.ui.saveRecipeButton.setEnabled(state)
+        self.ui.loadRecipeButton.setEnabled(state)
 
     def resetAndDisable(self):
         self.ui.progressBar.reset()
@@ -139,50 +151,137 @@ class ImageAugmenterWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     def onApplyButton(self) -> None:
         """Run processing when user clicks "Apply" button."""
         with slicer.util.tryWithErrorDisplay(_("Failed to compute results."), waitCursor=True):
+            from ImageAugmenterLib.ImageAugmenterJob import ImageAugmenterJob
+            from ImageAugmenterLib.ImageAugmenterRecipe import compileRecipe, getRecipeHash
             from ImageAugmenterLib.ImageAugmenterTransformationParser import (
                 ImageAugmenterTransformationParser,
             )
-            from ImageAugmenterLib.ImageAugmenterUtils import getFilesStructure
+            from ImageAugmenterLib.ImageAugmenterUtils import getDtypePolicy, getFilesStructure, getProfileHook, getScanCachePath, getSeed
             from ImageAugmenterLib.ImageAugmenterValidator import validateForms
 
             validateForms(self.ui)
 
             self.transformationParser = ImageAugmenterTransformationParser(self.ui)
-            transformationList = self.transformationParser.mapTransformations()
+            recipe = self.transformationParser.getRecipe()
+            transformationList = compileRecipe(recipe)
             filesStructure = getFilesStructure(self.ui)
 
+            # the settings are read here, widgets and slicer.app can't be used by the job thread
+            settings = dict(imagesInputPath=self.ui.imagesInputPath.directory,
+                            imgPrefix=self.ui.imgPrefix.text.strip(),
+                            maskPrefix=self.ui.maskPrefix.text.strip(),
+                            isImgPrefixRegex=self.ui.imageRegexButton.isChecked(),
+                            isMaskPrefixRegex=self.ui.maskRegexButton.isChecked(),
+                            outputPath=self.ui.outputPath.directory,
+                            transformations=transformationList,
+                            filesStructure=filesStructure,
+                            device=self.ui.deviceList.currentText,
+                            numWorkers=self.ui.numWorkers.value,
+                            chainTransformations=self.ui.chainTransformations.isChecked(),
+                            samplesPerCase=self.ui.samplesPerCase.value,
+                            dtypePolicy=getDtypePolicy(self.ui),
+                            compactMasks=self.ui.compactMasks.isChecked(),
+                            reducedPrecision=self.ui.reducedPrecision.isChecked(),
+                            seed=getSeed(self.ui),
+                            recipeHash=getRecipeHash(recipe),
+                            skipCompletedCases=self.ui.skipCompletedCases.isChecked(),
+                            collectTimings=self.ui.collectTimings.isChecked(),
+                            exportTrace=self.ui.exportTrace.isChecked(),
+                            profileHook=getProfileHook(self.ui),
+                            outOfCore=self.ui.outOfCore.isChecked(),
+                            slabSize=self.ui.slabSize.value,
+                            validateInputsFirst=self.ui.validateInputsFirst.isChecked(),
+                            scanCachePath=getScanCachePath(self.ui.imagesInputPath.directory))
+
             self.resetAndDisable()
 
-            self.logic.process(imagesInputPath=self.ui.imagesInputPath.directory,
-                               imgPrefix=self.ui.imgPrefix.text.strip(),
-                               maskPrefix=self.ui.maskPrefix.text.strip(),
-                               isImgPrefixRegex=self.ui.imageRegexButton.isChecked(),
-                               isMaskPrefixRegex=self.ui.maskRegexButton.isChecked(),
-                               outputPath=self.ui.outputPath.directory,
-                               transformations=transformationList,
-                               filesStructure=filesStructure,
-                               progressBar=self.ui.progressBar,
-                               infoLabel=self.ui.infoLabel,
-                               setButtonsEnabled=self.setButtonsEnabled,
-                               device=self.ui.deviceList.currentText)
+            def runProcess(progressBar, infoLabel, setButtonsEnabled, jobControl):
+                self.logic.process(progressBar=progressBar, infoLabel=infoLabel, setButtonsEnabled=setButtonsEnabled,
+                                   jobControl=jobControl, **settings)
 
-            self.setButtonsEnabled(True)
-            self.ui.progressBar.reset()
+            self.job = ImageAugmenterJob(target=runProcess,
+                                         progressBar=self.ui.progressBar,
+                                         infoLabel=self.ui.infoLabel,
+                                         setButtonsEnabled=self.setButtonsEnabled,
+                                         onFinished=self.onProcessFinished)
+            self.setJobButtonsVisible(True)
+            self.job.start()
+
+    def onProcessFinished(self, error) -> None:
+        from ImageAugmenterLib.ImageAugmenterJob import ImageAugmenterCancelledError
 
+        self.job = None
+        self.setJobButtonsVisible(False)
+        self.setButtonsEnabled(True)
+        self.ui.progressBar.reset()
+        self.showTimings(self.logic.timingsSummary)
+
+        if isinstance(error, ImageAugmenterCancelledError):
+            self.ui.infoLabel.setText("Processing cancelled")
+        elif error is not None:
+            slicer.util.errorDisplay(_("Failed to compute results."), detailedText=str(error))
+
+    def showTimings(self, timingsSummary: list) -> None:
+        """Fills the timings table with the rows of ImageAugmenterProfiler.getSummary"""
+        self.ui.timingsTable.setRowCount(len(timingsSummary))
+        for rowIdx, row in enumerate(timingsSummary):
+            values = [row["stage"], row["name"], str(row["calls"]), f"{row['seconds']:.3f}", f"{row['meanMs']:.2f}", f"{row['share']:.1%}"]
+            for columnIdx, value in enumerate(values):
+                self.ui.timingsTable.setItem(rowIdx, columnIdx, qt.QTableWidgetItem(value))
+        self.ui.timingsTable.resizeColumnsToContents()
+
+    def setJobButtonsVisible(self, state: bool) -> None:
+        self.ui.pauseButton.setChecked(False)
+        self.ui.pauseButton.setText("Pause")
+        self.ui.pauseButton.setEnabled(True)
+        self.ui.pauseButton.setVisible(state)
+        self.ui.cancelButton.setEnabled(True)
+        self.ui.cancelButton.setVisible(state)
+
+    def onPauseButton(self) -> None:
+        if not self.job:
+            return
+
+        if self.ui.pauseButton.isChecked():
+            self.job.control.pause()
+            self.ui.pauseButton.setText("Resume")
+            self.ui.infoLabel.setText("Pausing, the cases already started will be completed...")
+        else:
+            self.job.control.resume()
+            self.ui.pauseButton.setText("Pause")
+            self.ui.infoLabel.setText("Processing resumed")
+
+    def onCancelButton(self) -> None:
+        if not self.job:
+            return
+
+        self.job.control.cancel()
+        self.ui.pauseButton.setEnabled(False)
+        self.ui.cancelButton.setEnabled(False)
+        self.ui.infoLabel.setText("Cancelling, the cases already started will be completed...")
 
     def onPreviewButton(self) -> None:
         """Run processing when user clicks "Preview" button."""
+        self.runPreview(downsampleFactor=self.ui.previewDownsample.value, shownSliceOnly=self.ui.previewShownSlice.isChecked())
+
+    def onRefinePreviewButton(self) -> None:
+        """Computes the preview again at full resolution, on the whole volume"""
+        self.runPreview(downsampleFactor=1, shownSliceOnly=False)
+
+    def runPreview(self, downsampleFactor: int, shownSliceOnly: bool) -> None:
         with slicer.util.tryWithErrorDisplay(_("Failed to compute results."), waitCursor=True):
+            from ImageAugmenterLib.ImageAugmenterRecipe import compileRecipe, getTransformationKeys
             from ImageAugmenterLib.ImageAugmenterTransformationParser import (
                 ImageAugmenterTransformationParser,
             )
-            from ImageAugmenterLib.ImageAugmenterUtils import getFilesStructure
+            from ImageAugmenterLib.ImageAugmenterUtils import getDtypePolicy, getFilesStructure, getSeed
             from ImageAugmenterLib.ImageAugmenterValidator import validateForms
 
             validateForms(self.ui)
 
             self.transformationParser = ImageAugmenterTransformationParser(self.ui)
-            transformationList = self.transformationParser.mapTransformations()
+            recipe = self.transformationParser.getRecipe()
+            transformationList = compileRecipe(recipe)
             filesStructure = getFilesStructure(self.ui)
 
             self.resetAndDisable()
@@ -198,7 +297,17 @@ class ImageAugmenterWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
                                infoLabel=self.ui.infoLabel,
                                setButtonsEnabled=self.setButtonsEnabled,
                                selectedPreviewOptions=self.selectedPreviewOptions,
-                               device=self.ui.deviceList.currentText)
+                               device=self.ui.deviceList.currentText,
+                               chainTransformations=self.ui.chainTransformations.isChecked(),
+                               samplesPerCase=self.ui.samplesPerCase.value,
+                               dtypePolicy=getDtypePolicy(self.ui),
+                               compactMasks=self.ui.compactMasks.isChecked(),
+                               reducedPrecision=self.ui.reducedPrecision.isChecked(),
+                               seed=getSeed(self.ui),
+                               downsampleFactor=downsampleFactor,
+                               shownSliceOnly=shownSliceOnly,
+                               transformationKeys=getTransformationKeys(recipe),
+                               cacheSize=self.ui.previewCacheSize.value)
 
             self.setButtonsEnabled(True)
             self.ui.progressBar.reset()
@@ -228,6 +337,32 @@ class ImageAugmenterWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             if self.previewSettingsDialog.exec_() == qt.QDialog.Accepted:
                 self.selectedPreviewOptions = self.previewSettingsDialog.getSelectedOptions()
     
+    def onSaveRecipeButton(self):
+        with slicer.util.tryWithErrorDisplay(_("Failed to save the recipe.")):
+            from ImageAugmenterLib.ImageAugmenterRecipe import saveRecipe
+            from ImageAugmenterLib.ImageAugmenterTransformationParser import ImageAugmenterTransformationParser
+
+            recipePath = qt.QFileDialog.getSaveFileName(None, "Save recipe", "", "ImageAugmenter recipe (*.json)")
+            if not recipePath:
+                return
+            if not recipePath.endswith(".json"):
+                recipePath += ".json"
+
+            saveRecipe(ImageAugmenterTransformationParser(self.ui).getRecipe(), recipePath)
+            self.ui.infoLabel.setText(f"Recipe saved to {recipePath}")
+
+    def onLoadRecipeButton(self):
+        with slicer.util.tryWithErrorDisplay(_("Failed to load the recipe.")):
+            from ImageAugmenterLib.ImageAugmenterRecipe import loadRecipe
+            from ImageAugmenterLib.ImageAugmenterTransformationParser import ImageAugmenterTransformationParser
+
+            recipePath = qt.QFileDialog.getOpenFileName(None, "Load recipe", "", "ImageAugmenter recipe (*.json)")
+            if not recipePath:
+                return
+
+            ImageAugmenterTransformationParser(self.ui).setTransformations(loadRecipe(recipePath)["transformations"])
+            self.ui.infoLabel.setText(f"Recipe loaded from {recipePath}")
+
     def onImageRexegButton(self):
         from ImageAugmenterLib.UI.ImageAugmenterUIUtils import updateButtonStyle
         updateButtonStyle(self.ui.imageRegexButton, "background-color: rgb(52, 206, 165);" if self.ui.imageRegexButton.isChecked() else "")
@@ -240,7 +375,12 @@ class ImageAugmenterLogic(ScriptedLoadableModuleLogic):
     def __init__(self) -> None:
         """Called when the logic class is instantiated. Can be used for initializing member variables."""
         ScriptedLoadableModuleLogic.__init__(self)
-        self.previewNodesList = []
+        # created with the first preview, torch may not be installed yet
+        self.previewCache = None
+        # preview node name -> (key of the shown output, image node, mask node)
+        self.previewNodes = {}
+        # rows of the stage timings of the last run, see ImageAugmenterProfiler.getSummary
+        self.timingsSummary = []
 
     def getParameterNode(self):
         return ImageAugmenterParameterNode(super().getParameterNode())
@@ -258,77 +398,186 @@ class ImageAugmenterLogic(ScriptedLoadableModuleLogic):
                 setButtonsEnabled: Callable[[bool], None],
                 transformations: list = [],
                 device: str = "CPU",
+                numWorkers: int = 1,
+                chainTransformations: bool = False,
+                samplesPerCase: int = 1,
+                dtypePolicy: str = "float",
+                compactMasks: bool = False,
+                reducedPrecision: bool = False,
+                seed: Optional[int] = None,
+                recipeHash: str = "",
+                skipCompletedCases: bool = False,
+                collectTimings: bool = False,
+                exportTrace: bool = False,
+                profileHook: str = "none",
+                outOfCore: bool = False,
+                slabSize: int = 256,
+                validateInputsFirst: bool = False,
+                scanCachePath: Optional[str] = None,
+                jobControl=None,
                 ) -> None:
+        """Augments the whole dataset. When run by an ImageAugmenterJob, jobControl pauses or cancels the run between cases.
+        The completed cases are recorded in a manifest in outputPath, with skipCompletedCases the cases already completed
+        with the same recipe (recipeHash) and settings, whose inputs haven't changed, are skipped.
+        With collectTimings the time of every stage of each case is logged and kept in timingsSummary, with exportTrace
+        it's also saved as a Chrome trace in outputPath. profileHook runs cProfile or torch.profiler around every case.
+        With outOfCore the raw NRRD cases are memory-mapped and streamed in slabs of about slabSize MB, see ImageAugmenterOutOfCore.
+        Cases are processed while the input tree is scanned, the files that can't be paired and the masks whose size differs from
+        the image are skipped and reported when the run ends. With validateInputsFirst the whole tree is paired and every header
+        is read before processing the first case, so invalid inputs stop the run before any output is written.
+        scanCachePath is the listing cache of the input tree (see getScanCachePath), the caller gets it on the main thread.
+        """
+        from ImageAugmenterLib.ImageAugmenterConversion import conversionStats, logConversionStats
         from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
-        from ImageAugmenterLib.ImageAugmenterUtils import (
-            collectImagesAndMasksList,
-            getOriginalCase,
-            makeDir,
-            splitFilenameAndExtension,
-            save,
-        )
+        from ImageAugmenterLib.ImageAugmenterManifest import ImageAugmenterManifest, getRunKey
+        from ImageAugmenterLib.ImageAugmenterProfiler import TRACE_FILENAME, profiler
+        from ImageAugmenterLib.ImageAugmenterRunner import ImageAugmenterCaseProcessor, runCases
+        from ImageAugmenterLib.ImageAugmenterScanner import getPairingIndex, scanImagesAndMasks
         from ImageAugmenterLib.ImageAugmenterValidator import (
             validateCollectedImagesAndMasks,
+            validateImagesAndMasksGeometry,
+            validateOutOfCoreSettings,
+            validateParallelSettings,
+            validateProcessedInputs,
         )
+        from ImageAugmenterLib.ImageAugmenterWriter import ImageAugmenterWriter
+        import os
 
         startTime = time.time()
+        conversionStats.reset()
         logging.info("Processing started")
         infoLabel.setText("Processing started, please wait...")
-        imgs, masks = collectImagesAndMasksList(imagesInputPath=imagesInputPath,
-                                                imgPrefix=imgPrefix,
-                                                maskPrefix=maskPrefix,
-                                                isImgPrefixRegex=isImgPrefixRegex,
-                                                isMaskPrefixRegex=isMaskPrefixRegex
-                                                )
 
-        validationResult = validateCollectedImagesAndMasks(imgs, masks)
+        validationResult = validateParallelSettings(numWorkers, device) or validateOutOfCoreSettings(outOfCore, transformations, chainTransformations)
         
         if isinstance(validationResult, ValueError):
             setButtonsEnabled(True)
             progressBar.reset()
-            infoLabel.setText(validationResult)
+            infoLabel.setText(str(validationResult))
             raise validationResult
 
-        dataset = ImageAugmenterDataset(imgPaths=imgs, maskPaths=masks, transformations=transformations, device=device)
-
-        progressBar.setMaximum(len(dataset))
+        # the paths are added while the input tree is scanned
+        dataset = ImageAugmenterDataset(imgPaths=[], maskPaths=[], transformations=transformations, device=device,
+                                        chainTransformations=chainTransformations, samplesPerCase=samplesPerCase,
+                                        dtypePolicy=dtypePolicy, compactMasks=compactMasks, reducedPrecision=reducedPrecision,
+                                        seed=seed)
+        profiler.configure(enabled=collectTimings or exportTrace, hook=profileHook, outputPath=outputPath, device=dataset.device)
+        self.timingsSummary = []
+        caseProcessor = ImageAugmenterCaseProcessor(dataset=dataset,
+                                                    outputPath=outputPath,
+                                                    imgPrefix=imgPrefix,
+                                                    maskPrefix=maskPrefix,
+                                                    isImgPrefixRegex=isImgPrefixRegex,
+                                                    isMaskPrefixRegex=isMaskPrefixRegex,
+                                                    filesStructure=filesStructure,
+                                                    outOfCore=outOfCore,
+                                                    slabSize=slabSize)
+
+        manifest = ImageAugmenterManifest(outputPath, getRunKey(recipeHash,
+                                                                chainTransformations=chainTransformations,
+                                                                samplesPerCase=samplesPerCase,
+                                                                dtypePolicy=dtypePolicy,
+                                                                compactMasks=compactMasks,
+                                                                reducedPrecision=reducedPrecision,
+                                                                seed=seed),
+                                          seed=seed)
+        completedCases = []
+        skippedCases = []
+
+        # files that can't be paired, left by the scan, and masks of a different size found by the workers
+        pairingIndex = getPairingIndex(imgPrefix, maskPrefix, isImgPrefixRegex, isMaskPrefixRegex)
+        sizeMismatches = []
+
+        def scannedCases():
+            """Cases are processed as soon as they're found, the total is known once the scan is over"""
+            pairs = scanImagesAndMasks(imagesInputPath=imagesInputPath,
+                                       imgPrefix=imgPrefix,
+                                       maskPrefix=maskPrefix,
+                                       isImgPrefixRegex=isImgPrefixRegex,
+                                       isMaskPrefixRegex=isMaskPrefixRegex,
+                                       cachePath=scanCachePath,
+                                       pairingIndex=None if validateInputsFirst else pairingIndex)
+            if validateInputsFirst:
+                # the pairing errors are raised once the whole tree is listed, then the headers of the cases to process are read
+                pairs = list(pairs)
+                pendingPairs = [(imgPath, maskPath) for imgPath, maskPath in pairs
+                                if maskPath and not (skipCompletedCases and manifest.isDone(imgPath, maskPath))]
+                validationResult = validateImagesAndMasksGeometry([imgPath for imgPath, maskPath in pendingPairs], [maskPath for imgPath, maskPath in pendingPairs])
+                if isinstance(validationResult, ValueError):
+                    raise validationResult
+
+            for imgPath, maskPath in pairs:
+                # one entry per case in both lists (None without a mask), so they stay aligned by position
+                dataset.imgPaths.append(imgPath)
+                dataset.maskPaths.append(maskPath)
+
+                if skipCompletedCases and manifest.isDone(imgPath, maskPath):
+                    skippedCases.append(imgPath)
+                    completedCases.append(imgPath)
+                    progressBar.setValue(len(completedCases))
+                    continue
+                manifest.invalidate(imgPath)
+                yield imgPath, maskPath
+
+            if not dataset.imgPaths and pairingIndex.hasErrors():
+                raise pairingIndex.getError()
+            validationResult = validateCollectedImagesAndMasks(dataset.imgPaths, [maskPath for maskPath in dataset.maskPaths if maskPath])
+            if isinstance(validationResult, ValueError):
+                raise validationResult
+            progressBar.setMaximum(len(dataset))
+
+        writer = ImageAugmenterWriter()
+        progressBar.setMaximum(0)
+
+        def onCaseDone(dirIdx: int, imgPath: str, maskPath: str, result) -> None:
+            if result.error:
+                sizeMismatches.append(result.error)
+            else:
+                manifest.recordWhenWritten(imgPath, maskPath, result)
+            completedCases.append(imgPath)
+            progressBar.setValue(len(completedCases))
+            infoLabel.setText(f"Processed {result.caseName} ({len(completedCases)}/{len(dataset)}), {writer.queueDepth} file(s) waiting to be written")
 
-        for dirIdx in range(len(dataset)):
-            transformedImages, transformedMasks = dataset[dirIdx]
+        try:
+            with writer:
+                runCases(caseProcessor, scannedCases(), writer=writer, numWorkers=numWorkers, onCaseDone=onCaseDone,
+                         checkpoint=jobControl.checkpoint if jobControl else None)
+                infoLabel.setText("Writing the remaining files, please wait...")
+        except Exception as e:
+            setButtonsEnabled(True)
+            progressBar.reset()
+            infoLabel.setText(f"{e}")
+            raise e
+        finally:
+            # the writer is closed here, every case whose files are on disk is recorded
+            manifest.commitWritten()
             try:
-                caseName, originalCaseImg = getOriginalCase(imgs[dirIdx], filesStructure)
-                originalCaseMask = sitk.ReadImage(masks[dirIdx]) if transformedMasks else None
-
-                for i in range(len(transformedImages)):
-                    imgPack = transformedImages[i]
-                    mskPack = transformedMasks[i] if i < len(transformedMasks) else None
-
-                    transformName, img = imgPack
-                    _, msk = mskPack if mskPack else (None, None)
-
-                    currentDir = makeDir(outputPath, caseName, transformName)
-                    
-                    imgName, imgExtension = splitFilenameAndExtension(imgs[dirIdx], imgPrefix, isImgPrefixRegex)
-                    save(img=img.detach().cpu(), path=currentDir,
-                         filename=imgName,
-                         originalCase=originalCaseImg,
-                         extension=imgExtension if imgExtension else "nrrd")
-
-                    if originalCaseMask and msk != None and msk.any():
-                        maskName, maskExtension = splitFilenameAndExtension(masks[dirIdx], maskPrefix, isMaskPrefixRegex)
-                        save(img=msk.detach().cpu(), path=currentDir,
-                             filename=maskName,
-                             originalCase=originalCaseMask,
-                             extension=maskExtension if maskExtension else "nrrd")
-
-
-                progressBar.setValue(dirIdx + 1)
-
-            except Exception as e:
-                setButtonsEnabled(True)
-                progressBar.reset()
-                infoLabel.setText(f"{e}")
-                raise e
+                manifest.compact()
+            except OSError as e:
+                logging.warning(f"The manifest could not be written, the journal is kept: {e}")
+            # the timings of a stopped run are reported too, they may tell why it was slow
+            if profiler.enabled:
+                self.timingsSummary = profiler.getSummary()
+                profiler.logSummary()
+                if exportTrace:
+                    try:
+                        profiler.exportTrace(os.path.join(outputPath, TRACE_FILENAME))
+                    except OSError as e:
+                        logging.warning(f"The trace could not be written: {e}")
+
+        if skippedCases:
+            logging.info(f"Skipped {len(skippedCases)} case(s) already completed with the same settings")
+
+        if writer.writtenFiles > 0:
+            logging.info(f"Written {writer.writtenFiles} files, {writer.throughput / 1e6:.2f} MB/s")
+        logConversionStats()
+
+        validationResult = validateProcessedInputs(len(completedCases) - len(sizeMismatches), pairingIndex, sizeMismatches)
+        if isinstance(validationResult, ValueError):
+            setButtonsEnabled(True)
+            progressBar.reset()
+            infoLabel.setText(str(validationResult))
+            raise validationResult
 
         stopTime = time.time()
         infoLabel.setText(f"Processing completed in {stopTime-startTime:.2f} seconds")
@@ -347,45 +596,77 @@ class ImageAugmenterLogic(ScriptedLoadableModuleLogic):
                 transformations: list = [],
                 filesStructure: str = "",
                 device: str = "CPU",
+                chainTransformations: bool = False,
+                samplesPerCase: int = 1,
+                dtypePolicy: str = "float",
+                compactMasks: bool = False,
+                reducedPrecision: bool = False,
+                seed: Optional[int] = None,
+                downsampleFactor: int = 1,
+                shownSliceOnly: bool = False,
+                transformationKeys: Optional[list] = None,
+                cacheSize: int = 0,
                 ) -> None:
-
-        import SimpleITK as sitk
-
+        """Shows the transformed cases in the scene. With downsampleFactor > 1 the transformations run on a downsampled copy of each case,
+        with shownSliceOnly only the slice shown in the red view is transformed, when all the transformations allow it (see SLICE_WISE_TRANSFORMS).
+        The outputs are cached up to cacheSize MB by case, transformation parameters (transformationKeys, see getTransformationKeys) and seed,
+        so only the transformations that changed are computed again. The nodes of the previous preview are updated in place.
+        """
+        from ImageAugmenterLib.ImageAugmenterConversion import conversionStats, logConversionStats
         from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
+        from ImageAugmenterLib.ImageAugmenterManifest import getInputState
+        from ImageAugmenterLib.ImageAugmenterPreviewCache import ImageAugmenterPreviewCache, getPreviewOutputKey
         from ImageAugmenterLib.ImageAugmenterUtils import (
+            SIZE_DEPENDENT_TRANSFORMS,
+            SLICE_WISE_TRANSFORMS,
             clearScene,
             collectImagesAndMasksList,
-            getOriginalCase,
+            getCaseId,
+            getCaseName,
+            getScanCachePath,
+            getShownSliceIndex,
+            getTransformName,
+            readImageMetadata,
             resetViews,
             showPreview,
         )
         from ImageAugmenterLib.ImageAugmenterValidator import (
             validateCollectedImagesAndMasks,
+            validateImagesAndMasksGeometry,
         )
 
         startTime = time.time()
+        conversionStats.reset()
         logging.info("Processing started")
         infoLabel.setText("Processing started, please wait...")
 
-        imgs, masks = collectImagesAndMasksList(imagesInputPath=imagesInputPath,
-                                                imgPrefix=imgPrefix,
-                                                maskPrefix=maskPrefix,
-                                                isImgPrefixRegex=isImgPrefixRegex,
-                                                isMaskPrefixRegex=isMaskPrefixRegex
-                                                )
-
-        validationResult = validateCollectedImagesAndMasks(imgs, masks)
+        try:
+            imgs, masks = collectImagesAndMasksList(imagesInputPath=imagesInputPath,
+                                                    imgPrefix=imgPrefix,
+                                                    maskPrefix=maskPrefix,
+                                                    isImgPrefixRegex=isImgPrefixRegex,
+                                                    isMaskPrefixRegex=isMaskPrefixRegex,
+                                                    cachePath=getScanCachePath(imagesInputPath)
+                                                    )
+            validationResult = validateCollectedImagesAndMasks(imgs, masks)
+        except ValueError as e:
+            validationResult = e
         
         if isinstance(validationResult, ValueError):
             setButtonsEnabled(True)
             progressBar.reset()
-            infoLabel.setText(validationResult)
+            infoLabel.setText(str(validationResult))
             raise validationResult
         
-        if(len(slicer.util.getNodes()) > 0):
-            clearScene(self.previewNodesList)
-            self.previewNodesList = []
-            
+        # nodes removed from the scene, e.g. closing it, are created again
+        for nodeName, (shownKey, imgNode, maskNode) in list(self.previewNodes.items()):
+            if not all(node is None or slicer.mrmlScene.IsNodePresent(node) for node in (imgNode, maskNode)):
+                clearScene([node for node in (imgNode, maskNode) if node is not None])
+                del self.previewNodes[nodeName]
+        if self.previewCache is None:
+            self.previewCache = ImageAugmenterPreviewCache()
+        self.previewCache.setMaxBytes(cacheSize * 1024 * 1024)
+
         previewIndices = [i for i, path in enumerate(imgs) if path in selectedPreviewOptions] if len(selectedPreviewOptions) > 0 else [0]
         previewImgs = []
         previewMasks = []
@@ -395,39 +676,89 @@ class ImageAugmenterLogic(ScriptedLoadableModuleLogic):
             
         if(len(masks)>0):
             previewMasks = [masks[i] for i in previewIndices]
+
+        validationResult = validateImagesAndMasksGeometry(previewImgs, previewMasks)
+
+        if isinstance(validationResult, ValueError):
+            setButtonsEnabled(True)
+            progressBar.reset()
+            infoLabel.setText(str(validationResult))
+            raise validationResult
         
-        dataset = ImageAugmenterDataset(imgPaths=previewImgs, maskPaths=previewMasks, transformations=transformations, device=device)
+        dataset = ImageAugmenterDataset(imgPaths=previewImgs, maskPaths=previewMasks, transformations=transformations, device=device,
+                                        chainTransformations=chainTransformations, samplesPerCase=samplesPerCase,
+                                        dtypePolicy=dtypePolicy, compactMasks=compactMasks, reducedPrecision=reducedPrecision,
+                                        seed=seed)
         progressBar.setMaximum(len(dataset))
 
+        transformNames = [getTransformName(transform) for transform in transformations]
+        if shownSliceOnly and not all(name in SLICE_WISE_TRANSFORMS for name in transformNames):
+            logging.info("Not all the transformations can be computed on a single slice, previewing the whole volume")
+            shownSliceOnly = False
+        if downsampleFactor > 1 and any(name in SIZE_DEPENDENT_TRANSFORMS for name in transformNames):
+            logging.info("Sizes and crops are in voxels, previewing at full resolution")
+            downsampleFactor = 1
+
+        # settings changing the outputs, besides the transformations
+        settings = {"chainTransformations": chainTransformations, "dtypePolicy": dtypePolicy, "compactMasks": compactMasks, "reducedPrecision": reducedPrecision}
+        shownNodeNames = set()
+        viewsToReset = False
+        cachedCount = 0
+
         for dirIdx in range(len(dataset)):
             try:
-                transformedImages, transformedMasks = dataset[dirIdx]
-                caseName, originalCaseImg = getOriginalCase(previewImgs[dirIdx], filesStructure)
-
-                if transformedMasks:
-                    originalCaseMask = sitk.ReadImage(masks[dirIdx])
-
-                    for i in range(len(transformedImages)):
-                        imgPack = transformedImages[i]
-                        mskPack = transformedMasks[i] if i < len(transformedMasks) else None
-
-                        transformName, img = imgPack
-                        _, msk = mskPack
-
-                        imgNodeName = f"{caseName}_{transformName}_img"
-                        maskNodeName = f"{caseName}_{transformName}_mask"
-                        imgNode, maskNode = showPreview(img=img, originalCaseImg=originalCaseImg, originalCaseMask=originalCaseMask, mask=msk,
-                                    imgNodeName=imgNodeName, maskNodeName=maskNodeName)
-                        self.previewNodesList.append(imgNode)
-                        self.previewNodesList.append(maskNode)
-                else:
-                    for imgPack in transformedImages:
-                        transformName, img = imgPack
-                        imgNodeName = f"{caseName}_{transformName}_img"
-                        imgNode = showPreview(img, originalCaseImg, imgNodeName=imgNodeName)
-                        self.previewNodesList.append(imgNode)
-
-                resetViews()
+                imgPath = previewImgs[dirIdx]
+                maskPath = previewMasks[dirIdx] if previewMasks else None
+                caseName = getCaseName(imgPath, filesStructure)
+
+                isSlicePreview = shownSliceOnly and readImageMetadata(imgPath).isVolume()
+                region = ["slice", getShownSliceIndex(readImageMetadata(imgPath))] if isSlicePreview else ["downsample", downsampleFactor]
+                caseState = [getInputState(imgPath), getInputState(maskPath)]
+
+                outputs = []
+                for outputName, transformIndices, sampleIdx in dataset.list_outputs():
+                    nodeName = f"{caseName}_{outputName}"
+                    shownNodeNames.add(nodeName)
+                    transformKeys = self.getPreviewTransformKeys(transformations, transformIndices, transformationKeys, seed)
+                    outputKey = getPreviewOutputKey(caseState, region, settings, transformKeys, sampleIdx) if transformKeys is not None else None
+                    if outputKey is not None and outputKey == self.previewNodes.get(nodeName, (None,))[0]:
+                        # already in the scene
+                        continue
+                    outputs.append((outputName, nodeName, outputKey, self.previewCache.get(outputKey)))
+
+                missingOutputs = {outputName for outputName, nodeName, outputKey, entry in outputs if entry is None}
+                computedOutputs = iter(())
+                if missingOutputs:
+                    img, mask, imgMetadata, maskMetadata = dataset.load_case(dirIdx)
+                    if isSlicePreview:
+                        img, imgMetadata = dataset.extract_slice(img, imgMetadata, region[1])
+                        mask, maskMetadata = dataset.extract_slice(mask, maskMetadata, region[1])
+                    else:
+                        img, imgMetadata = dataset.downsample(img, imgMetadata, downsampleFactor)
+                        mask, maskMetadata = dataset.downsample(mask, maskMetadata, downsampleFactor)
+                    computedOutputs = dataset.iter_transformed(img, mask, imgMetadata, maskMetadata, getCaseId(imgPath), output_names=missingOutputs)
+
+                for outputName, nodeName, outputKey, entry in outputs:
+                    if entry is None:
+                        # computed in the same order of list_outputs
+                        computedName, transformedImg, transformedMask = next(computedOutputs)
+                        self.previewCache.put(outputKey, transformedImg, transformedMask, imgMetadata, maskMetadata)
+                        outputImgMetadata, outputMaskMetadata = imgMetadata, maskMetadata
+                    else:
+                        transformedImg, transformedMask, outputImgMetadata, outputMaskMetadata = entry.img, entry.mask, entry.imgMetadata, entry.maskMetadata
+                        cachedCount += 1
+
+                    shownKey, imgNode, maskNode = self.previewNodes.get(nodeName, (None, None, None))
+                    viewsToReset = viewsToReset or imgNode is None
+                    imgNodeName = f"{nodeName}_img"
+                    if (transformedMask is not None):
+                        imgNode, maskNode = showPreview(img=transformedImg, imgMetadata=outputImgMetadata, maskMetadata=outputMaskMetadata, mask=transformedMask,
+                                    imgNodeName=imgNodeName, maskNodeName=f"{nodeName}_mask", imgNode=imgNode, maskNode=maskNode)
+                    else:
+                        imgNode = showPreview(transformedImg, outputImgMetadata, imgNodeName=imgNodeName, imgNode=imgNode)
+                    self.previewNodes[nodeName] = (outputKey, imgNode, maskNode)
+                    del transformedImg, transformedMask
+
                 progressBar.setValue(dirIdx + 1)
 
             except Exception as e:
@@ -436,10 +767,48 @@ class ImageAugmenterLogic(ScriptedLoadableModuleLogic):
                 infoLabel.setText(f"{e}")
                 raise e
 
+        # outputs of the previous preview that are not shown anymore
+        staleNodeNames = [nodeName for nodeName in self.previewNodes if nodeName not in shownNodeNames]
+        clearScene([node for nodeName in staleNodeNames for node in self.previewNodes.pop(nodeName)[1:] if node is not None])
+
+        # the views stay on the slice being previewed, and on the outputs updated in place
+        if viewsToReset and not shownSliceOnly:
+            resetViews()
+        logging.info(f"Preview: {cachedCount} outputs from the cache, {self.previewCache.nbytes / 1024 ** 2:.1f} MB cached")
+        logConversionStats()
+
         stopTime = time.time()
-        infoLabel.setText(f"Processing completed in {stopTime-startTime:.2f} seconds")
-        logging.info(f"Processing completed in {stopTime-startTime:.2f} seconds")
+        if shownSliceOnly:
+            previewMode = "Preview of the shown slice"
+        elif downsampleFactor > 1:
+            previewMode = f"Preview downsampled by {downsampleFactor} (refine for full resolution)"
+        else:
+            previewMode = "Preview"
+        infoLabel.setText(f"{previewMode} completed in {stopTime-startTime:.2f} seconds")
+        logging.info(f"{previewMode} completed in {stopTime-startTime:.2f} seconds")
         
+    def getPreviewTransformKeys(self, transformations: list, transformIndices: list, transformationKeys: Optional[list], seed: Optional[int]) -> Optional[list]:
+        """Keys of the transformations computing a preview output, None if the output can't be cached:
+        unknown parameters, or random transformations without a seed, which give a new output at every preview
+        """
+        from monai.transforms import Randomizable
+
+        transformKeys = []
+        for transformIdx in transformIndices:
+            transform = transformations[transformIdx]
+            # the keys are in the order of the transformations, see getTransformationKeys
+            transformKey = transformationKeys[transformIdx] if transformationKeys and transformIdx < len(transformationKeys) else None
+            if transformKey is None:
+                return None
+            if isinstance(transform, Randomizable):
+                if seed is None:
+                    return None
+                # the random state is derived from the seed and the position of the transformation, see seed_transform
+                transformKeys.append([transformKey, transformIdx, seed])
+            else:
+                transformKeys.append([transformKey])
+        return transformKeys
+
     def loadPreviewOptions(self, 
                            imagesInputPath,
                            imgPrefix,
@@ -447,17 +816,20 @@ class ImageAugmenterLogic(ScriptedLoadableModuleLogic):
                            isImgPrefixRegex: bool,
                            isMaskPrefixRegex: bool,
                            filesStructure) -> dict[str, str]:        
-        from ImageAugmenterLib.ImageAugmenterUtils import collectImagesAndMasksList, getCaseName
+        from ImageAugmenterLib.ImageAugmenterUtils import collectImagesAndMasksList, getOriginalCase, getScanCachePath
         
         imgs, masks = collectImagesAndMasksList(imagesInputPath=imagesInputPath,
                                                 imgPrefix=imgPrefix,
                                                 maskPrefix=maskPrefix,
                                                 isImgPrefixRegex=isImgPrefixRegex,
-                                                isMaskPrefixRegex=isMaskPrefixRegex
+                                                isMaskPrefixRegex=isMaskPrefixRegex,
+                                                cachePath=getScanCachePath(imagesInputPath)
                                                 )
         options = {}
         
         for case in imgs:
-            options[case] = getCaseName(case, filesStructure)
+            # header only, the volumes are not decoded just to list them
+            caseName, metadata = getOriginalCase(case, filesStructure)
+            options[case] = f"{caseName} ({' x '.join(str(dim) for dim in metadata.size)})"
 
         return options
\ No newline at end of file
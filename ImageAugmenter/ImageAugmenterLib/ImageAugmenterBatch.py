@@ -0,0 +1,146 @@
+"""Runs ImageAugmenter without the module widget, e.g. on machines without a display:
+
+    Slicer --no-main-window --python-script /path/to/ImageAugmenterLib/ImageAugmenterBatch.py config.json
+
+The config is a JSON file with the same settings of the module UI, see BATCH_CONFIG_DEFAULTS.
+"transformations" has the format returned by the controllers' getTransformations, e.g.
+{"rotate": {"enabled": true, "angle": 0.5, "interpolationMode": "bilinear"}}, missing transformations are disabled.
+A recipe saved from the module can be used instead, with "recipePath".
+"""
+import json
+import logging
+import sys
+from typing import Callable, Dict, Optional
+
+BATCH_CONFIG_DEFAULTS = {
+    "imagesInputPath": "",
+    "outputPath": "",
+    "imgPrefix": "",
+    "maskPrefix": "",
+    "isImgPrefixRegex": False,
+    "isMaskPrefixRegex": False,
+    "filesStructure": "hierarchical",
+    "device": "CPU",
+    "numWorkers": 1,
+    "chainTransformations": False,
+    "samplesPerCase": 1,
+    "dtypePolicy": "float",
+    "compactMasks": False,
+    "reducedPrecision": False,
+    "seed": None,
+    "transformations": {},
+    "recipePath": "",
+    "skipCompletedCases": False,
+    "collectTimings": False,
+    "exportTrace": False,
+    "profileHook": "none",
+    "outOfCore": False,
+    "slabSize": 256,
+    "validateInputsFirst": False,
+}
+
+
+class ImageAugmenterProgressCallback():
+    """Stands in for the progress bar of the UI, the progress is forwarded to onProgress(value, maximum)"""
+    def __init__(self, onProgress: Optional[Callable[[int, int], None]] = None) -> None:
+        self.onProgress: Optional[Callable[[int, int], None]] = onProgress
+        self.value: int = 0
+        self.maximum: int = 0
+
+    def setMaximum(self, maximum: int) -> None:
+        self.maximum = maximum
+
+    def setValue(self, value: int) -> None:
+        self.value = value
+        if self.onProgress:
+            self.onProgress(value, self.maximum)
+
+    def reset(self) -> None:
+        self.value = 0
+
+
+class ImageAugmenterInfoCallback():
+    """Stands in for the info label of the UI, the messages are forwarded to onInfo(text) or logged"""
+    def __init__(self, onInfo: Optional[Callable[[str], None]] = None) -> None:
+        self.onInfo: Callable[[str], None] = onInfo if onInfo else logging.info
+        self.text: str = ""
+
+    def setText(self, text) -> None:
+        self.text = str(text)
+        self.onInfo(self.text)
+
+
+def loadBatchConfig(configPath: str) -> Dict:
+    with open(configPath) as configFile:
+        config = json.load(configFile)
+
+    unknownKeys = set(config) - set(BATCH_CONFIG_DEFAULTS)
+    if unknownKeys:
+        raise ValueError(f"Unknown settings in {configPath}: {', '.join(sorted(unknownKeys))}")
+
+    return {**BATCH_CONFIG_DEFAULTS, **config}
+
+
+def runBatch(config: Dict,
+             onProgress: Optional[Callable[[int, int], None]] = None,
+             onInfo: Optional[Callable[[str], None]] = None) -> None:
+    """Runs the same pipeline of the Apply button with the given config, reporting through callbacks instead of widgets"""
+    from ImageAugmenter import ImageAugmenterLogic
+    from ImageAugmenterLib.ImageAugmenterRecipe import compileRecipe, createRecipe, getRecipeHash, loadRecipe
+    from ImageAugmenterLib.ImageAugmenterUtils import getScanCachePath
+    from ImageAugmenterLib.ImageAugmenterValidator import validateBatchConfig
+
+    config = {**BATCH_CONFIG_DEFAULTS, **config}
+    validateBatchConfig(config)
+    recipe = loadRecipe(config["recipePath"]) if config["recipePath"] else createRecipe(config["transformations"])
+    transformationList = compileRecipe(recipe)
+
+    ImageAugmenterLogic().process(imagesInputPath=config["imagesInputPath"],
+                                  imgPrefix=config["imgPrefix"].strip(),
+                                  maskPrefix=config["maskPrefix"].strip(),
+                                  isImgPrefixRegex=config["isImgPrefixRegex"],
+                                  isMaskPrefixRegex=config["isMaskPrefixRegex"],
+                                  outputPath=config["outputPath"],
+                                  transformations=transformationList,
+                                  filesStructure=config["filesStructure"],
+                                  progressBar=ImageAugmenterProgressCallback(onProgress),
+                                  infoLabel=ImageAugmenterInfoCallback(onInfo),
+                                  setButtonsEnabled=lambda state: None,
+                                  device=config["device"],
+                                  numWorkers=config["numWorkers"],
+                                  chainTransformations=config["chainTransformations"],
+                                  samplesPerCase=config["samplesPerCase"],
+                                  dtypePolicy=config["dtypePolicy"],
+                                  compactMasks=config["compactMasks"],
+                                  reducedPrecision=config["reducedPrecision"],
+                                  seed=config["seed"],
+                                  recipeHash=getRecipeHash(recipe),
+                                  skipCompletedCases=config["skipCompletedCases"],
+                                  collectTimings=config["collectTimings"],
+                                  exportTrace=config["exportTrace"],
+                                  profileHook=config["profileHook"],
+                                  outOfCore=config["outOfCore"],
+                                  slabSize=config["slabSize"],
+                                  validateInputsFirst=config["validateInputsFirst"],
+                                  scanCachePath=getScanCachePath(config["imagesInputPath"]))
+
+
+def main(argv) -> int:
+    if len(argv) != 1:
+        print("Usage: Slicer --no-main-window --python-script ImageAugmenterBatch.py config.json", file=sys.stderr)
+        return 2
+
+    def onProgress(value: int, maximum: int) -> None:
+        print(f"ImageAugmenter - {value}/{maximum if maximum else '?'} cases", flush=True)
+
+    try:
+        runBatch(loadBatchConfig(argv[0]), onProgress=onProgress, onInfo=lambda text: print(f"ImageAugmenter - {text}", flush=True))
+    except Exception as e:
+        print(f"ImageAugmenter - {e}", file=sys.stderr, flush=True)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    import slicer
+    slicer.app.exit(main(sys.argv[1:]))
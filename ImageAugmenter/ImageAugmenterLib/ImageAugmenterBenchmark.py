@@ -0,0 +1,428 @@
+"""Measures the ImageAugmenter pipeline on synthetic cohorts, e.g. to catch performance regressions in CI on CPU-only machines:
+
+    Slicer --no-main-window --python-script /path/to/ImageAugmenterLib/ImageAugmenterBenchmark.py --output results.json
+
+Cohorts are generated for every combination of --formats, --layouts and --masks, and every case goes through the stages
+of a run: scan, decode, each transformation of the recipe, conversion to SimpleITK and write.
+Each stage reports its time, throughput in voxels per second and peak resident memory (RSS).
+With --baseline the results are compared to a previous run, the exit code is 1 if a stage is slower than the tolerance.
+With --load only the loading of a large volume is measured, comparing the copying and the zero-copy conversions to torch.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+# representative transformations of the controllers, used when no recipe is given
+BENCHMARK_TRANSFORMATIONS = {
+    "rotate": {"enabled": True, "angle": 0.3, "interpolationMode": "bilinear"},
+    "flip": {"enabled": True, "axis": 0},
+    "zoom": {"enabled": True, "factor": 1.2, "interpolationMode": "trilinear", "paddingMode": "constant", "alignCorners": False},
+    "shiftIntensity": {"enabled": True, "offset": 10},
+    "randomGaussianNoise": {"enabled": True, "mean": 0.0, "std": 0.1},
+    "gaussianSmooth": {"enabled": True, "sigma": 1.0, "kernel": "erf"},
+}
+BENCHMARK_FORMATS = ["nrrd", "nii.gz"]
+BENCHMARK_LAYOUTS = ["hierarchical", "flat"]
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_LOAD_SIZE = [256, 512, 512]
+
+
+def resetPeakRSS() -> bool:
+    """Resets the peak resident memory of the process (Linux only), False if it can't be reset"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clearRefs:
+            clearRefs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def getPeakRSS() -> int:
+    """Peak resident memory of the process in bytes, since the last resetPeakRSS when supported"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    import resource
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxRSS if sys.platform == "darwin" else maxRSS * 1024
+
+
+def getRSS() -> int:
+    """Current resident memory of the process in bytes, 0 if unknown"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class ImageAugmenterBenchmarkStage():
+    """Time, voxels and peak resident memory of a stage, accumulated over all the cases of a cohort"""
+    def __init__(self, device: str = "cpu") -> None:
+        self.device: str = str(device)
+        self.seconds: float = 0.0
+        self.voxels: int = 0
+        self.bytes: int = 0
+        self.calls: int = 0
+        self.peakRSS: int = 0
+
+    def start(self) -> float:
+        resetPeakRSS()
+        return time.perf_counter()
+
+    def stop(self, startTime: float, voxels: int = 0, nbytes: int = 0) -> None:
+        if self.device.startswith("cuda"):
+            import torch
+            torch.cuda.synchronize()
+        self.seconds += time.perf_counter() - startTime
+        self.voxels += voxels
+        self.bytes += nbytes
+        self.calls += 1
+        self.peakRSS = max(self.peakRSS, getPeakRSS())
+
+    def toDict(self) -> Dict:
+        return {
+            "seconds": self.seconds,
+            "calls": self.calls,
+            "voxels": self.voxels,
+            "voxelsPerSecond": self.voxels / self.seconds if self.seconds > 0 else 0.0,
+            "bytesPerSecond": self.bytes / self.seconds if self.seconds > 0 else 0.0,
+            "peakRSSBytes": self.peakRSS,
+        }
+
+
+def generateCohort(cohortPath: str, numCases: int, size: List[int], fileFormat: str, filesStructure: str, withMasks: bool, seed: int = 0) -> None:
+    """Writes numCases synthetic int16 volumes of size (D, H, W), a bright ellipsoid over noise, with a uint8 label of the ellipsoid.
+    Hierarchical cohorts have case000/img.<format>, case000/mask.<format>, flat ones img_000.<format>, mask_000.<format>.
+    """
+    import numpy as np
+    import SimpleITK as sitk
+
+    random = np.random.default_rng(seed)
+    grid = np.ogrid[tuple(slice(0, dim) for dim in size)]
+    ellipsoid = sum(((axis - dim / 2) / (dim / 4)) ** 2 for axis, dim in zip(grid, size)) <= 1
+
+    for caseIdx in range(numCases):
+        volume = random.normal(100, 20, size) + ellipsoid * 400
+        img = sitk.GetImageFromArray(volume.astype(np.int16))
+        img.SetSpacing((0.8, 0.8, 2.0))
+        mask = sitk.GetImageFromArray(ellipsoid.astype(np.uint8))
+        mask.CopyInformation(img)
+
+        if filesStructure == "hierarchical":
+            caseDir = os.path.join(cohortPath, f"case{caseIdx:03d}")
+            imgPath, maskPath = os.path.join(caseDir, f"img.{fileFormat}"), os.path.join(caseDir, f"mask.{fileFormat}")
+        else:
+            caseDir = cohortPath
+            imgPath, maskPath = os.path.join(caseDir, f"img_{caseIdx:03d}.{fileFormat}"), os.path.join(caseDir, f"mask_{caseIdx:03d}.{fileFormat}")
+
+        os.makedirs(caseDir, exist_ok=True)
+        sitk.WriteImage(img, imgPath)
+        if withMasks:
+            sitk.WriteImage(mask, maskPath)
+
+
+def benchmarkCohort(cohortPath: str, outputPath: str, transformations: List[object], device: str = "CPU", seed: int = 0) -> Dict:
+    """Runs every case of the cohort through the stages of a run, one stage at a time so each one is timed on its own"""
+    import SimpleITK as sitk
+    from ImageAugmenterLib.ImageAugmenterConversion import arrayToImage, tensorToArray
+    from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
+    from ImageAugmenterLib.ImageAugmenterUtils import collectImagesAndMasksList, getCaseId
+
+    scan = ImageAugmenterBenchmarkStage()
+    startTime = scan.start()
+    imgs, masks = collectImagesAndMasksList(imagesInputPath=cohortPath, imgPrefix="img", maskPrefix="mask",
+                                            isImgPrefixRegex=False, isMaskPrefixRegex=False)
+    scan.stop(startTime)
+
+    dataset = ImageAugmenterDataset(imgPaths=imgs, maskPaths=masks, transformations=transformations, device=device, seed=seed)
+    decode = ImageAugmenterBenchmarkStage(dataset.device)
+    conversion = ImageAugmenterBenchmarkStage(dataset.device)
+    write = ImageAugmenterBenchmarkStage(dataset.device)
+    transformStages: Dict[str, ImageAugmenterBenchmarkStage] = {}
+    os.makedirs(outputPath, exist_ok=True)
+
+    for caseIdx in range(len(dataset)):
+        startTime = decode.start()
+        img, mask, imgMetadata, maskMetadata = dataset.load_case(caseIdx)
+        decode.stop(startTime, voxels=sum(volume.numel() for volume in (img, mask) if volume is not None))
+
+        outputs = dataset.iter_transformed(img, mask, imgMetadata, maskMetadata, getCaseId(imgs[caseIdx]))
+        for outputName, transformIndices, sampleIdx in dataset.list_outputs():
+            # the generator computes each output when it's requested
+            transformStage = transformStages.setdefault(outputName, ImageAugmenterBenchmarkStage(dataset.device))
+            startTime = transformStage.start()
+            transformName, transformedImg, transformedMask = next(outputs)
+            volumes = [(volume, metadata, suffix) for volume, metadata, suffix in ((transformedImg, imgMetadata, "img"), (transformedMask, maskMetadata, "mask"))
+                       if volume is not None]
+            voxels = sum(volume.numel() for volume, metadata, suffix in volumes)
+            transformStage.stop(startTime, voxels=voxels)
+
+            startTime = conversion.start()
+            images = [(arrayToImage(tensorToArray(volume), metadata), suffix) for volume, metadata, suffix in volumes]
+            conversion.stop(startTime, voxels=voxels)
+
+            startTime = write.start()
+            for image, suffix in images:
+                filePath = os.path.join(outputPath, f"case{caseIdx:03d}_{transformName}_{suffix}.nrrd")
+                sitk.WriteImage(image, filePath)
+                write.bytes += os.path.getsize(filePath)
+            write.stop(startTime, voxels=voxels)
+            del transformedImg, transformedMask, volumes, images
+
+    return {
+        "cases": len(imgs),
+        "masks": len(masks),
+        "stages": {
+            "scan": {**scan.toDict(), "casesPerSecond": len(imgs) / scan.seconds if scan.seconds > 0 else 0.0},
+            "decode": decode.toDict(),
+            "transforms": {name: transformStage.toDict() for name, transformStage in transformStages.items()},
+            "conversion": conversion.toDict(),
+            "write": write.toDict(),
+        },
+    }
+
+
+def benchmarkLoad(size: Optional[List[int]] = None, repeats: int = 3, workPath: Optional[str] = None) -> Dict:
+    """Loads a synthetic int16 volume of size (D, H, W) from an uncompressed NRRD file with every loading path:
+    the copying one of the previous releases (sitk.GetArrayFromImage, then torch.tensor), the zero-copy one of
+    ImageAugmenterDataset.load (imageToTensor) and, when CUDA is available, the pinned one followed by the copy to the GPU.
+    Reports the best time of the repeats for the whole load and for the conversion alone, and the memory used on top of
+    the resident memory before the load: the decoded image and every copy made of it.
+    The memory can only be measured where the peak resident memory can be reset (Linux), otherwise the peak would be the one
+    of the whole process: "peakRSSAvailable" is False and the memory figures are left out.
+    """
+    import gc
+
+    import numpy as np
+    import SimpleITK as sitk
+    import torch
+    from ImageAugmenterLib.ImageAugmenterConversion import imageToTensor
+
+    size = size or DEFAULT_LOAD_SIZE
+    loaders = {
+        "copy": lambda image: torch.tensor(sitk.GetArrayFromImage(image)),
+        "view": lambda image: imageToTensor(image),
+    }
+    if torch.cuda.is_available():
+        loaders["pinned"] = lambda image: imageToTensor(image, pinMemory=True).to("cuda", non_blocking=True)
+
+    removeWorkPath = workPath is None
+    workPath = workPath or tempfile.mkdtemp(prefix="ImageAugmenterBenchmark_")
+    volumePath = os.path.join(workPath, "load.nrrd")
+    try:
+        os.makedirs(workPath, exist_ok=True)
+        sitk.WriteImage(sitk.GetImageFromArray(np.random.default_rng(0).integers(-1000, 3000, size, dtype=np.int16)), volumePath)
+        volumeBytes = int(np.prod(size)) * 2
+
+        results = {"size": size, "volumeBytes": volumeBytes, "peakRSSAvailable": True, "loaders": {}}
+        for name, loader in loaders.items():
+            seconds, conversionSeconds, extraRSS = [], [], []
+            for _ in range(repeats):
+                gc.collect()
+                results["peakRSSAvailable"] = resetPeakRSS() and results["peakRSSAvailable"]
+                rssBefore = getRSS()
+                startTime = time.perf_counter()
+                image = sitk.ReadImage(volumePath)
+                conversionStart = time.perf_counter()
+                tensor = loader(image)
+                if tensor.is_cuda:
+                    torch.cuda.synchronize()
+                endTime = time.perf_counter()
+                # the image is released here: the view keeps its buffer alive, the copies don't need it
+                del image
+                extraRSS.append(max(getPeakRSS() - rssBefore, 0))
+                seconds.append(endTime - startTime)
+                conversionSeconds.append(endTime - conversionStart)
+                del tensor
+
+            results["loaders"][name] = {
+                "seconds": min(seconds),
+                "conversionSeconds": min(conversionSeconds),
+                "peakExtraRSSBytes": min(extraRSS),
+                # the decoded image counts as one copy
+                "copiesOfVolume": min(extraRSS) / volumeBytes,
+            }
+
+        if not results["peakRSSAvailable"]:
+            for loaderResults in results["loaders"].values():
+                del loaderResults["peakExtraRSSBytes"], loaderResults["copiesOfVolume"]
+        return results
+    finally:
+        if removeWorkPath:
+            shutil.rmtree(workPath, ignore_errors=True)
+        else:
+            os.remove(volumePath)
+
+
+def getEnvironment() -> Dict:
+    import monai
+    import SimpleITK as sitk
+    import torch
+
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpuCount": os.cpu_count(),
+        "torch": torch.__version__,
+        "monai": monai.__version__,
+        "simpleitk": sitk.Version_VersionString(),
+        "cuda": torch.cuda.is_available(),
+    }
+
+
+def runBenchmark(numCases: int = 4,
+                 size: Optional[List[int]] = None,
+                 formats: Optional[List[str]] = None,
+                 layouts: Optional[List[str]] = None,
+                 masks: Optional[List[bool]] = None,
+                 transformations: Optional[Dict[str, Dict]] = None,
+                 device: str = "CPU",
+                 seed: int = 0,
+                 workPath: Optional[str] = None) -> Dict:
+    """Generates a cohort for every format, layout and mask option in workPath (a temporary folder by default, removed at the end)
+    and benchmarks it with the given transformations (see BENCHMARK_TRANSFORMATIONS)
+    """
+    from ImageAugmenterLib.ImageAugmenterRecipe import compileRecipe, createRecipe, getRecipeHash
+
+    size = size or [64, 128, 128]
+    recipe = createRecipe(transformations or BENCHMARK_TRANSFORMATIONS)
+    transformationList = compileRecipe(recipe)
+
+    results = {
+        "config": {"cases": numCases, "size": size, "device": device, "seed": seed, "recipeHash": getRecipeHash(recipe)},
+        "environment": getEnvironment(),
+        "cohorts": {},
+    }
+
+    removeWorkPath = workPath is None
+    workPath = workPath or tempfile.mkdtemp(prefix="ImageAugmenterBenchmark_")
+    try:
+        for fileFormat in formats or BENCHMARK_FORMATS:
+            for filesStructure in layouts or BENCHMARK_LAYOUTS:
+                for withMasks in (masks if masks is not None else [True, False]):
+                    cohortName = f"{fileFormat}_{filesStructure}_{'masks' if withMasks else 'images'}"
+                    cohortPath = os.path.join(workPath, cohortName, "input")
+                    generateCohort(cohortPath, numCases, size, fileFormat, filesStructure, withMasks, seed)
+                    results["cohorts"][cohortName] = benchmarkCohort(cohortPath, os.path.join(workPath, cohortName, "output"),
+                                                                     transformationList, device=device, seed=seed)
+                    shutil.rmtree(os.path.join(workPath, cohortName), ignore_errors=True)
+    finally:
+        if removeWorkPath:
+            shutil.rmtree(workPath, ignore_errors=True)
+
+    return results
+
+
+def compareResults(baseline: Dict, results: Dict, tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Returns a message for every stage whose throughput dropped by more than tolerance (a fraction) from the baseline"""
+    regressions = []
+    for cohortName, cohort in results.get("cohorts", {}).items():
+        baselineCohort = baseline.get("cohorts", {}).get(cohortName)
+        if baselineCohort is None:
+            continue
+
+        stages = {name: stage for name, stage in cohort["stages"].items() if name != "transforms"}
+        stages.update({f"transforms.{name}": stage for name, stage in cohort["stages"]["transforms"].items()})
+        baselineStages = {name: stage for name, stage in baselineCohort["stages"].items() if name != "transforms"}
+        baselineStages.update({f"transforms.{name}": stage for name, stage in baselineCohort["stages"]["transforms"].items()})
+
+        for stageName, stage in stages.items():
+            baselineStage = baselineStages.get(stageName)
+            # the scan has no voxels, its throughput is in cases
+            metric = "casesPerSecond" if stageName == "scan" else "voxelsPerSecond"
+            if baselineStage is None or not baselineStage.get(metric):
+                continue
+            ratio = stage[metric] / baselineStage[metric]
+            if ratio < 1 - tolerance:
+                regressions.append(f"{cohortName} {stageName}: {stage[metric]:.3g} {metric}, {ratio:.0%} of the baseline")
+
+    return regressions
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(prog="ImageAugmenterBenchmark.py", description="Benchmarks ImageAugmenter on synthetic cohorts")
+    parser.add_argument("--output", required=True, help="JSON file of the results")
+    parser.add_argument("--cases", type=int, default=4, help="cases per cohort")
+    parser.add_argument("--size", default="64,128,128", help="size of the volumes, D,H,W")
+    parser.add_argument("--formats", default=",".join(BENCHMARK_FORMATS))
+    parser.add_argument("--layouts", default=",".join(BENCHMARK_LAYOUTS))
+    parser.add_argument("--masks", choices=["both", "with", "without"], default="both")
+    parser.add_argument("--recipe", default="", help="recipe saved from the module, instead of BENCHMARK_TRANSFORMATIONS")
+    parser.add_argument("--device", default="CPU")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="folder of the generated cohorts, a temporary one by default")
+    parser.add_argument("--baseline", default="", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed throughput drop from the baseline, e.g. 0.2")
+    parser.add_argument("--load", action="store_true", help="only measure the loading of a large volume, see benchmarkLoad")
+    parser.add_argument("--load-size", default=",".join(str(dim) for dim in DEFAULT_LOAD_SIZE), help="size of the loaded volume, D,H,W")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.load:
+            results = {"environment": getEnvironment(),
+                       "load": benchmarkLoad(size=[int(dim) for dim in args.load_size.split(",")], workPath=args.workdir)}
+            with open(args.output, "w") as resultsFile:
+                json.dump(results, resultsFile, indent=2)
+
+            for name, loader in results["load"]["loaders"].items():
+                memory = (f"peak {loader['peakExtraRSSBytes'] / 1e6:.0f} MB, {loader['copiesOfVolume']:.1f} copies of the volume"
+                          if results["load"]["peakRSSAvailable"] else "peak memory unavailable, the peak resident memory can't be reset on this platform")
+                print(f"ImageAugmenter - load {name}: {loader['seconds'] * 1e3:.1f} ms (conversion {loader['conversionSeconds'] * 1e3:.1f} ms), "
+                      f"{memory}", flush=True)
+            return 0
+
+        transformations = None
+        if args.recipe:
+            from ImageAugmenterLib.ImageAugmenterRecipe import loadRecipe
+            transformations = loadRecipe(args.recipe)["transformations"]
+
+        results = runBenchmark(numCases=args.cases,
+                               size=[int(dim) for dim in args.size.split(",")],
+                               formats=args.formats.split(","),
+                               layouts=args.layouts.split(","),
+                               masks={"both": [True, False], "with": [True], "without": [False]}[args.masks],
+                               transformations=transformations,
+                               device=args.device,
+                               seed=args.seed,
+                               workPath=args.workdir)
+        with open(args.output, "w") as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+
+        for cohortName, cohort in results["cohorts"].items():
+            stages = cohort["stages"]
+            transformsSummary = ", ".join(f"{name} {stage['voxelsPerSecond'] / 1e6:.1f}" for name, stage in stages["transforms"].items())
+            print(f"ImageAugmenter - {cohortName}: decode {stages['decode']['voxelsPerSecond'] / 1e6:.1f}, {transformsSummary}, "
+                  f"conversion {stages['conversion']['voxelsPerSecond'] / 1e6:.1f}, write {stages['write']['voxelsPerSecond'] / 1e6:.1f} Mvoxels/s", flush=True)
+
+        if args.baseline:
+            with open(args.baseline) as baselineFile:
+                regressions = compareResults(json.load(baselineFile), results, args.tolerance)
+            for regression in regressions:
+                print(f"ImageAugmenter - regression: {regression}", file=sys.stderr, flush=True)
+            if regressions:
+                return 1
+    except Exception as e:
+        print(f"ImageAugmenter - {e}", file=sys.stderr, flush=True)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    import slicer
+    slicer.app.exit(main(sys.argv[1:]))
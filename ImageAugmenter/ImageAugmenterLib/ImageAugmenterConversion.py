@@ -0,0 +1,158 @@
+import logging
+import threading
+from typing import Dict, Optional, Union
+
+import numpy as np
+import SimpleITK as sitk
+import torch
+
+from ImageAugmenterLib.ImageAugmenterUtils import VolumeMetadata, copyInfo
+
+class ImageAugmenterConversionStats():
+    """Counts the hand-offs between torch, NumPy, SimpleITK and VTK of this process:
+    shared ones reuse the memory of the source (the copies avoided), copied ones duplicate it.
+    """
+    def __init__(self) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.sharedConversions: int = 0
+            self.sharedBytes: int = 0
+            self.copiedConversions: int = 0
+            self.copiedBytes: int = 0
+
+    def addShared(self, nbytes: int) -> None:
+        with self.lock:
+            self.sharedConversions += 1
+            self.sharedBytes += nbytes
+
+    def addCopied(self, nbytes: int) -> None:
+        with self.lock:
+            self.copiedConversions += 1
+            self.copiedBytes += nbytes
+
+    def getStats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "sharedConversions": self.sharedConversions,
+                "sharedBytes": self.sharedBytes,
+                "copiedConversions": self.copiedConversions,
+                "copiedBytes": self.copiedBytes,
+            }
+
+
+conversionStats = ImageAugmenterConversionStats()
+
+
+def logConversionStats() -> None:
+    stats = conversionStats.getStats()
+    logging.info(f"Conversions: {stats['sharedConversions']} without copy ({stats['sharedBytes'] / 1e6:.1f} MB), "
+                 f"{stats['copiedConversions']} copies ({stats['copiedBytes'] / 1e6:.1f} MB)")
+
+
+class ImageAugmenterImageBuffer():
+    """Exposes the buffer of a SimpleITK image to NumPy (array interface) without copying it.
+    The arrays and tensors created from it reference this object, so the image stays alive as long as they use its memory.
+    The image is private to the loader: the buffer is exposed as writable, unlike sitk.GetArrayViewFromImage.
+    """
+    def __init__(self, image: sitk.Image) -> None:
+        self.image: sitk.Image = image
+        arrayInterface = dict(sitk.GetArrayViewFromImage(image).__array_interface__)
+        arrayInterface["data"] = (arrayInterface["data"][0], False)
+        self.__array_interface__: Dict = arrayInterface
+
+
+def imageToTensor(image: sitk.Image, pinMemory: bool = False) -> torch.Tensor:
+    """Returns a CPU tensor sharing the buffer of the image, instead of copying it to NumPy and again to torch.
+    With pinMemory the voxels are copied once into page-locked memory, so they can be moved to the GPU asynchronously.
+    """
+    tensor = torch.from_numpy(np.asarray(ImageAugmenterImageBuffer(image)))
+    nbytes = tensor.element_size() * tensor.nelement()
+    if pinMemory:
+        conversionStats.addCopied(nbytes)
+        return tensor.pin_memory()
+
+    conversionStats.addShared(nbytes)
+    return tensor
+
+
+def tensorToArray(tensor: Union[torch.Tensor, np.ndarray]) -> np.ndarray:
+    """Returns a C-contiguous NumPy array sharing the memory of a CPU tensor.
+    The data is copied only when it has to: tensors on the GPU, in a type NumPy doesn't have (bfloat16) or not contiguous,
+    which SimpleITK and VTK can't read in place.
+    """
+    if isinstance(tensor, np.ndarray):
+        array = tensor
+    else:
+        tensor = tensor.detach()
+        if tensor.device.type != "cpu" or tensor.dtype == torch.bfloat16 or not tensor.is_contiguous():
+            nbytes = tensor.element_size() * tensor.nelement()
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.float()
+            conversionStats.addCopied(nbytes)
+            return tensor.contiguous().cpu().numpy()
+        array = tensor.numpy()
+
+    if not array.flags.c_contiguous:
+        conversionStats.addCopied(array.nbytes)
+        return np.ascontiguousarray(array)
+
+    conversionStats.addShared(array.nbytes)
+    return array
+
+
+def arrayToImage(array: np.ndarray, metadata: Optional[VolumeMetadata] = None) -> sitk.Image:
+    """Copies the array into a new SimpleITK image, this is the only copy made on the way to the disk and it's counted as such.
+    SimpleITK has no zero-copy path: its images always own their buffer and sitk.GetImageFromArray copies even a contiguous
+    array of the output type, it can only expose an image buffer to NumPy (see ImageAugmenterImageBuffer), not the other way around.
+    """
+    image = sitk.GetImageFromArray(array)
+    conversionStats.addCopied(array.nbytes)
+
+    if (metadata is not None and metadata.isVolume()):
+        copyInfo(metadata, image)
+    return image
+
+
+def arrayToVolumeNode(array: np.ndarray,
+                      metadata: Optional[VolumeMetadata] = None,
+                      node=None,
+                      name: str = "",
+                      className: str = "vtkMRMLScalarVolumeNode"):
+    """Sets the array as the image data of a volume node, without copying it: the vtkImageData scalars point to the array memory.
+    A new node is created when node is None, otherwise its image data is replaced in place.
+    The array must not be modified afterwards. The VTK array keeps a reference to it (numpy_to_vtk with deep=False),
+    so it stays alive as long as the node data uses it.
+    """
+    import slicer
+    import vtk
+    from vtk.util import numpy_support
+
+    if node is None:
+        node = slicer.mrmlScene.AddNewNodeByClass(className, name)
+        node.CreateDefaultDisplayNodes()
+
+    if array.ndim == 2:
+        array = array[np.newaxis]
+
+    # ravel of a C-contiguous array is a view
+    scalars = numpy_support.numpy_to_vtk(array.ravel(), deep=False)
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(array.shape[2], array.shape[1], array.shape[0])
+    imageData.GetPointData().SetScalars(scalars)
+    conversionStats.addShared(array.nbytes)
+
+    if (metadata is not None and metadata.isVolume()):
+        # sitk geometry is in LPS, MRML in RAS
+        node.SetSpacing(metadata.spacing)
+        node.SetOrigin(-metadata.origin[0], -metadata.origin[1], metadata.origin[2])
+        directions = vtk.vtkMatrix4x4()
+        for i, sign in enumerate((-1, -1, 1)):
+            for j in range(3):
+                directions.SetElement(i, j, sign * metadata.direction[i * 3 + j])
+        node.SetIJKToRASDirectionMatrix(directions)
+
+    node.SetAndObserveImageData(imageData)
+    return node
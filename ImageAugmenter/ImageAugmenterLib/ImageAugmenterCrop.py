@@ -1,37 +1,39 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from ImageAugmenterLib.ImageAugmenterTransformControllerInterface import ImageAugmenterTransformControllerInterface
 
 class ImageAugmenterCropController(ImageAugmenterTransformControllerInterface):
-    def __init__(self, ui, mappedTransformations: List[object], dictKeys: Dict[str, str]) -> None:
-        from munch import Munch, munchify
+    def __init__(self, ui, mappedTransformations: List[object], dictKeys: Dict[str, str], transformations: Optional[Dict[str, Dict]] = None) -> None:
+        from munch import Munch
         self.ui = ui
-        self.transformations: Munch = munchify(self.getTransformations())
+        self.transformations: Munch = self.loadTransformations(transformations)
         self.mappedTransformations: List[object] = mappedTransformations
+        # recipe name (e.g. "rotate") of each mapped transformation, see addTransformation
+        self.mappedTransformationNames: List[str] = []
         self.dictKeys: Dict[str, str] = dictKeys
 
-    def getTransformations(self) -> Dict[str, Dict]:
+    def getTransformationWidgets(self) -> Dict[str, Dict]:
         return {
             "spatialPad": {
-                "enabled": self.ui.spatialPadEnabled.isChecked(),
-                "spatialSize": (self.ui.spatialPadC.text, self.ui.spatialPadW.text, self.ui.spatialPadH.text),
-                "method": self.ui.spatialPadMethod.currentText,
-                "mode": self.ui.spatialPadMode.currentText,
-                "fillValue": self.ui.spatialPadFillValue.text
+                "enabled": self.ui.spatialPadEnabled,
+                "spatialSize": (self.ui.spatialPadC, self.ui.spatialPadW, self.ui.spatialPadH),
+                "method": self.ui.spatialPadMethod,
+                "mode": self.ui.spatialPadMode,
+                "fillValue": self.ui.spatialPadFillValue
             },
             "borderPad": {
-                "enabled": self.ui.borderPadEnabled.isChecked(),
-                "spatialBorder": self.ui.borderPadSpatialBorder.text,
-                "mode": self.ui.borderPadMode.currentText,
-                "fillValue": self.ui.borderPadFillValue.text
+                "enabled": self.ui.borderPadEnabled,
+                "spatialBorder": self.ui.borderPadSpatialBorder,
+                "mode": self.ui.borderPadMode,
+                "fillValue": self.ui.borderPadFillValue
             },
             "spatialCrop": {
-                "enabled": self.ui.spatialCropEnabled.isChecked(),
-                "roiCenter": (self.ui.spatialCropCenterH.text, self.ui.spatialCropCenterW.text, self.ui.spatialCropCenterC.text),
-                "roiSize": ( self.ui.spatialCropSizeC.text, self.ui.spatialCropSizeW.text, self.ui.spatialCropSizeH.text),
+                "enabled": self.ui.spatialCropEnabled,
+                "roiCenter": (self.ui.spatialCropCenterH, self.ui.spatialCropCenterW, self.ui.spatialCropCenterC),
+                "roiSize": ( self.ui.spatialCropSizeC, self.ui.spatialCropSizeW, self.ui.spatialCropSizeH),
             },
             "centerSpatialCrop": {
-                "enabled": self.ui.centerSpatialCropEnabled.isChecked(),
-                "roiSize": (self.ui.centerSpatialCropSizeC.text, self.ui.centerSpatialCropSizeW.text, self.ui.centerSpatialCropSizeH.text),
+                "enabled": self.ui.centerSpatialCropEnabled,
+                "roiSize": (self.ui.centerSpatialCropSizeC, self.ui.centerSpatialCropSizeW, self.ui.centerSpatialCropSizeH),
             },
         }
 
@@ -45,7 +47,7 @@ class ImageAugmenterCropController(ImageAugmenterTransformControllerInterface):
             if (not all(params.spatialSize) or params.fillValue == None or params.fillValue == ""): 
                 raise ValueError("The 'Spatial Pad' transformation is enabled but parameters are not valid. Please check all the parameters.")
 
-            self.mappedTransformations.append(
+            self.addTransformation("spatialPad",
                 SpatialPad(spatial_size=(int(params.spatialSize[0]), int(params.spatialSize[1]), int(params.spatialSize[2])),    
                             mode=params.mode,
                             method=params.method,
@@ -57,7 +59,7 @@ class ImageAugmenterCropController(ImageAugmenterTransformControllerInterface):
             if (params.spatialBorder == "" or params.spatialBorder == None or params.fillValue == None or params.fillValue == ""):
                      raise ValueError("The 'Border Pad' transformation is enabled but parameters are not valid. Please check all the parameters.")
 
-            self.mappedTransformations.append(BorderPad(spatial_border=int(params.spatialBorder), mode=params.mode, value=params.fillValue))
+            self.addTransformation("borderPad", BorderPad(spatial_border=int(params.spatialBorder), mode=params.mode, value=params.fillValue))
 
         if (self.transformations.spatialCrop.enabled):
             params = self.transformations.spatialCrop
@@ -65,7 +67,7 @@ class ImageAugmenterCropController(ImageAugmenterTransformControllerInterface):
             if (not all(params.roiSize) or not all(params.roiCenter) ):
                     raise ValueError("The 'Spatial Crop' transformation is enabled but ROI size or ROI center is not valid")
             
-            self.mappedTransformations.append(SpatialCrop(
+            self.addTransformation("spatialCrop", SpatialCrop(
                 roi_center=(int(params.roiCenter[0]),int(params.roiCenter[1]), int(params.roiCenter[2])),
                 roi_size=(int(params.roiSize[0]),int(params.roiSize[1]), int(params.roiSize[2]))))
             
@@ -74,6 +76,6 @@ class ImageAugmenterCropController(ImageAugmenterTransformControllerInterface):
             if (not all(params.roiSize)):
                     raise ValueError("The 'Center Spatial Crop' transformation is enabled but ROI size is not valid")
             
-            self.mappedTransformations.append(CenterSpatialCrop(roi_size=(int(params.roiSize[0]), int(params.roiSize[1]), int(params.roiSize[2]))))
+            self.addTransformation("centerSpatialCrop", CenterSpatialCrop(roi_size=(int(params.roiSize[0]), int(params.roiSize[1]), int(params.roiSize[2]))))
 
         return self.mappedTransformations
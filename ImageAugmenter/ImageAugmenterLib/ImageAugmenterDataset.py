@@ -1,51 +1,153 @@
-from typing import Any, Dict, List, Optional, Tuple, Union
+import functools
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 import SimpleITK as sitk
 import torch
-from monai.transforms import RandomizableTransform
+from monai.transforms import Randomizable, RandomizableTransform
 from torch.utils.data import Dataset
 
 from ImageAugmenterLib.ImageAugmenterUtils import (
+    VolumeMetadata,
+    deriveSeed,
     extractDeviceNumber,
+    getCaseId,
+    getLabelTransform,
     getTransformName,
-    CHANNEL_FIRST_REQUIRED
+    getVolumeMetadata,
+    CHANNEL_FIRST_REQUIRED,
+    DTYPE_FLOAT,
+    DTYPE_KEEP,
+    DTYPE_RESTORE,
+    INTENSITY_TRANSFORMS,
 )
+from ImageAugmenterLib.ImageAugmenterConversion import imageToTensor
+from ImageAugmenterLib.ImageAugmenterFusion import (
+    ImageAugmenterFusedIntensity,
+    ImageAugmenterFusedSpatial,
+    fuseTransformations,
+    getFusedRunStart,
+    getFusedTransforms,
+)
+from ImageAugmenterLib.ImageAugmenterProfiler import STAGE_HOST_TO_DEVICE, STAGE_READ, STAGE_TRANSFORM, profiler
+
+# sitk pixel types (VolumeMetadata.pixelType) that can be restored after computing in float
+PIXEL_TYPES_TO_TORCH = {
+    "8-bit unsigned integer": torch.uint8,
+    "8-bit signed integer": torch.int8,
+    "16-bit unsigned integer": getattr(torch, "uint16", None),
+    "16-bit signed integer": torch.int16,
+    "32-bit unsigned integer": getattr(torch, "uint32", None),
+    "32-bit signed integer": torch.int32,
+    "64-bit signed integer": torch.int64,
+    "32-bit float": torch.float32,
+    "64-bit float": torch.float64,
+}
+REDUCED_PRECISION_DTYPES = [torch.float16, torch.bfloat16]
+# masks read in one of these types are label maps kept in their integer type, instead of float32 (4 times smaller for uint8)
+LABEL_DTYPES = [torch.uint8, torch.int8, torch.int16, torch.int32, torch.int64]
+# transformations keeping every voxel of a mask (the intensity ones leave it unchanged), its labels are all still present after them
+LABEL_PRESERVING_TRANSFORMS = ["Flip", "RandAxisFlipd", "SpatialPad", "BorderPad"]
 
 
 class ImageAugmenterDataset(Dataset):
     def __init__(
         self,
         imgPaths: List[str],
-        maskPaths: Optional[List[str]] = None,
+        maskPaths: Optional[List[Optional[str]]] = None,
         transformations: List[object] = [],
         device: Union[str, int] = "CPU",
+        chainTransformations: bool = False,
+        samplesPerCase: int = 1,
+        dtypePolicy: str = DTYPE_FLOAT,
+        compactMasks: bool = False,
+        reducedPrecision: bool = False,
+        seed: Optional[int] = None,
     ):
         self.imgPaths: List[str] = imgPaths
-        self.maskPaths: Optional[List[str]] = maskPaths
+        # aligned with imgPaths, None for the cases without a mask. Empty or None when no masks are used
+        self.maskPaths: Optional[List[Optional[str]]] = maskPaths
         self.transformations: List[object] = transformations
         self.device: Union[str, int] = extractDeviceNumber(device) if device.lower() != "cpu" else device.lower()
+        # when True the transformations are composed into a single pipeline with one output per case
+        self.chainTransformations: bool = chainTransformations
+        # number of randomized variants generated from each loaded case by the random transformations
+        self.samplesPerCase: int = samplesPerCase
+        # DTYPE_FLOAT: compute and save in float32, DTYPE_RESTORE: compute in float32 and save in the input type,
+        # DTYPE_KEEP: transformations receive the input type as it is
+        self.dtypePolicy: str = dtypePolicy
+        # masks saved as uint8 (or uint16 with more than 255 labels) instead of the computation type
+        self.compactMasks: bool = compactMasks
+        # intensity transformations of the image computed in float16 (GPU) or bfloat16 (CPU)
+        self.reducedPrecision: bool = reducedPrecision
+        # global seed of the random transformations, None to draw a different random stream at every run
+        self.seed: Optional[int] = seed
 
     def __len__(self) -> int:
         return len(self.imgPaths)
 
-    def load(self, path: str) -> Optional[torch.Tensor]:
+    def load(self, path: str) -> Tuple[Optional[torch.Tensor], Optional[VolumeMetadata]]:
+        """Decodes the file once, returning both the voxels and the geometry needed to save the outputs.
+        The tensor shares the buffer of the decoded image (see imageToTensor), for a GPU device it's read into pinned memory.
+        """
         try:
             if (path):
-                img = sitk.ReadImage(path)
-                img_array = sitk.GetArrayFromImage(img)
-                data = torch.tensor(img_array)
-                return data
-            return None
+                with profiler.stage(STAGE_READ):
+                    img = sitk.ReadImage(path)
+                    data = imageToTensor(img, pinMemory=self.device != "cpu" and torch.cuda.is_available())
+                return data, getVolumeMetadata(img)
+            return None, None
         except:
-            return None
+            return None, None
+
+    def get_mask_dtype(self, mask: torch.Tensor) -> torch.dtype:
+        """Type the mask is transformed in: integer label maps keep their type, other masks are converted to float"""
+        if self.dtypePolicy == DTYPE_KEEP or mask.dtype in LABEL_DTYPES:
+            return mask.dtype
+        return torch.float32
+
+    def is_intensity_transform(self, transform: object) -> bool:
+        return isinstance(transform, ImageAugmenterFusedIntensity) or getTransformName(transform) in INTENSITY_TRANSFORMS
+
+    def preserves_labels(self, transformations: List[object]) -> bool:
+        return all(self.is_intensity_transform(transform) or getTransformName(transform) in LABEL_PRESERVING_TRANSFORMS for transform in transformations)
+
+    def get_label_transform(self, transform: object) -> Callable:
+        """The transformation as applied to a mask, resampling it with the nearest neighbour (see getLabelTransform)"""
+        if isinstance(transform, ImageAugmenterFusedSpatial):
+            return functools.partial(transform, labels=True)
+        return getLabelTransform(transform)
+
+    def get_compute_dtype(self, transform_name: str, img: torch.Tensor, is_mask: bool = False) -> torch.dtype:
+        if self.dtypePolicy == DTYPE_KEEP or (is_mask and img.dtype in LABEL_DTYPES):
+            return img.dtype
+
+        if self.reducedPrecision and not is_mask and transform_name in INTENSITY_TRANSFORMS:
+            return torch.float16 if img.device.type == "cuda" else torch.bfloat16
+
+        return torch.float32
 
-    def apply_transform(self, transform: object, img: torch.Tensor, transformedList: List[List[Any]]) -> List[List[Any]]:
+    def apply_transform(self, transform: object, img: torch.Tensor, transformedList: List[List[Any]], is_mask: bool = False) -> List[List[Any]]:
+        """With is_mask img is a label map: intensity transformations leave it unchanged, the others resample it with the nearest neighbour
+        and keep its type
+        """
         transform_name = getTransformName(transform)
+        if (is_mask and self.is_intensity_transform(transform)):
+            transformedList.append([transform_name, img])
+            return transformedList
+
         channel_first_required = transform_name in CHANNEL_FIRST_REQUIRED
+        compute_dtype = self.get_compute_dtype(transform_name, img, is_mask)
     
         if(channel_first_required):
             img = img.unsqueeze(dim=0)
 
-        transformedImg = transform(img.float())
+        with profiler.stage(STAGE_TRANSFORM, transform_name):
+            transformedImg = (self.get_label_transform(transform) if is_mask else transform)(img.to(compute_dtype))
+
+            if (compute_dtype in REDUCED_PRECISION_DTYPES):
+                transformedImg = transformedImg.float()
+            elif (is_mask and transformedImg.dtype != compute_dtype):
+                # nearest neighbour values are labels of the input, the conversion is exact
+                transformedImg = transformedImg.to(compute_dtype)
         
         if(channel_first_required):
             transformedImg = transformedImg.squeeze(dim=0)
@@ -64,9 +166,29 @@ class ImageAugmenterDataset(Dataset):
     ) -> List[List[Any]]:  # Generic return for flexibility
         
         transform_name = getTransformName(transform)
+        with profiler.stage(STAGE_TRANSFORM, transform_name):
+            return self._apply_dict_transform(transform, transform_name, data_dict, transformedImages, transformedMasks)
+
+    def _apply_dict_transform(
+        self,
+        transform: object,
+        transform_name: str,
+        data_dict: Dict[str, torch.Tensor],
+        transformedImages: List[List[Any]],
+        transformedMasks: Optional[List[List[Any]]] = None,
+    ) -> List[List[Any]]:
         channel_first_required = transform_name in CHANNEL_FIRST_REQUIRED
+        compute_dtype = self.get_compute_dtype(transform_name, data_dict["img"])
+        data_dict["img"] = data_dict["img"].to(compute_dtype)
+
+        if(transformedMasks != None and self.is_intensity_transform(transform)):
+            mask = data_dict.pop("mask")
+            transformedImages, _ = self._apply_dict_transform(transform, transform_name, data_dict, transformedImages)
+            transformedMasks.append([transform_name, mask])
+            return transformedImages, transformedMasks
 
         if(transformedMasks != None):
+            mask_dtype = data_dict["mask"].dtype
             if(channel_first_required):
                 data_dict["img"] = data_dict["img"].unsqueeze(dim=0)
                 data_dict["mask"] = data_dict["mask"].unsqueeze(dim=0)
@@ -76,17 +198,267 @@ class ImageAugmenterDataset(Dataset):
             if(channel_first_required):
                 transformedImg =transformedImg.squeeze(dim=0)
                 transformedMask = transformedMask.squeeze(dim=0)
+
+            if (compute_dtype in REDUCED_PRECISION_DTYPES):
+                transformedImg = transformedImg.float()
+            if (transformedMask.dtype != mask_dtype):
+                transformedMask = transformedMask.to(mask_dtype)
                 
             # adding ["rotate", torch.Tensor[[...]] ]
             transformedImages.append([transform_name, transformedImg])
             transformedMasks.append([transform_name, transformedMask])
             return transformedImages, transformedMasks
 
-        transformedImg = transform(data_dict)
-        transformedImages.append([transform_name, transformedImg["img"]])
+        transformedImg = transform(data_dict)["img"]
+        if (compute_dtype in REDUCED_PRECISION_DTYPES):
+            transformedImg = transformedImg.float()
+        transformedImages.append([transform_name, transformedImg])
         return transformedImages, []
 
-    def __getitem__(self, idx: int) -> Tuple[List[List[Any]], Optional[List[List[Any]]]]:
+    def apply_transformations(
+        self,
+        transform: object,
+        img: Optional[torch.Tensor],
+        mask: Optional[torch.Tensor],
+        transformedImages: List[List[Any]],
+        transformedMasks: List[List[Any]],
+    ) -> Tuple[List[List[Any]], List[List[Any]]]:
+        """Applies a single transformation to the image and, if any, to the mask, appending the results to the lists"""
+        if (img != None and mask != None and isinstance(transform, RandomizableTransform)):
+            transformedImages, transformedMasks = self.apply_dict_transform(transform, {"img": img, "mask": mask}, transformedImages, transformedMasks)
+
+        if (img != None and mask == None and isinstance(transform, RandomizableTransform)):
+            transformedImages, transformedMasks = self.apply_dict_transform(transform, {"img": img}, transformedImages, None)
+
+        if (img != None and not isinstance(transform, RandomizableTransform)):
+            transformedImages = self.apply_transform(transform, img, transformedImages)
+
+        if (mask != None and not isinstance(transform, RandomizableTransform)):
+            transformedMasks = self.apply_transform(transform, mask, transformedMasks, is_mask=True)
+
+        return transformedImages, transformedMasks
+
+    def seed_transform(self, transform: object, case_id: str, transform_idx: int, sample_idx: int) -> None:
+        """Gives a random transformation its own random state for this case, transformation and sample, independent
+        of the order in which the cases are processed, so the outputs can be reproduced with any number of workers or after a restart
+        """
+        if (self.seed is not None and isinstance(transform, Randomizable)):
+            transform.set_random_state(seed=deriveSeed(self.seed, case_id, transform_idx, sample_idx))
+
+    def apply_chain(
+        self,
+        transformations: List[object],
+        img: Optional[torch.Tensor],
+        mask: Optional[torch.Tensor],
+        case_id: str = "",
+        sample_idx: int = 0,
+        start_idx: int = 0,
+    ) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor]]:
+        """Feeds the output of every transformation to the next one, only the result of the last one is returned.
+        Intermediate results are never kept. start_idx is the index of the first transformation in self.transformations, used for seeding.
+        Runs of point-wise intensity transformations are computed in a single pass and runs of affine transformations
+        with a single resampling, see fuseTransformations.
+        """
+        for transform_idx, transform in fuseTransformations(transformations, start_idx):
+            if (img is None):
+                break
+            for fused_idx, fused_transform in enumerate(getFusedTransforms(transform), transform_idx):
+                self.seed_transform(fused_transform, case_id, fused_idx, sample_idx)
+            transformedImages, transformedMasks = self.apply_transformations(transform, img, mask, [], [])
+            img = transformedImages[-1][1]
+            mask = transformedMasks[-1][1] if transformedMasks else None
+
+        return img, mask
+
+    def iter_sampled_chain(
+        self,
+        img: torch.Tensor,
+        mask: Optional[torch.Tensor],
+        case_id: str = "",
+        output_names: Optional[Set[str]] = None,
+    ) -> Iterator[Tuple[str, torch.Tensor, Optional[torch.Tensor]]]:
+        """Runs the whole chain once per sample, named after its transformations, e.g. "Rotate_RandGaussianNoised_0".
+        The deterministic transformations before the first random one are computed only once and shared by all the samples,
+        except the ones resampled together with it (see getFusedRunStart): the fused resampling costs the same with them.
+        """
+        samplesCount = self.get_samples_count(self.transformations)
+        sampleNames = [self.get_sample_name(self.get_chain_name(), sampleIdx, samplesCount) for sampleIdx in range(samplesCount)]
+        if output_names is not None and not output_names.intersection(sampleNames):
+            return
+
+        firstRandomIdx = next((i for i, transform in enumerate(self.transformations) if isinstance(transform, RandomizableTransform)), len(self.transformations))
+        firstRandomIdx = getFusedRunStart(self.transformations, firstRandomIdx)
+        img, mask = self.apply_chain(self.transformations[:firstRandomIdx], img, mask)
+
+        for sampleIdx, sampleName in enumerate(sampleNames):
+            if output_names is not None and sampleName not in output_names:
+                continue
+            sampleImg, sampleMask = self.apply_chain(self.transformations[firstRandomIdx:], img, mask,
+                                                     case_id=case_id, sample_idx=sampleIdx, start_idx=firstRandomIdx)
+            yield sampleName, sampleImg, sampleMask
+            del sampleImg, sampleMask
+
+    def get_chain_name(self) -> str:
+        return "_".join(getTransformName(transform) for transform in self.transformations)
+
+    def list_outputs(self) -> List[Tuple[str, List[int], int]]:
+        """Returns (output name, indices of the transformations computing it, sample index) for every output of a case,
+        in the order of iter_outputs, without computing anything
+        """
+        if self.chainTransformations:
+            samplesCount = self.get_samples_count(self.transformations)
+            transformIndices = list(range(len(self.transformations)))
+            return [(self.get_sample_name(self.get_chain_name(), sampleIdx, samplesCount), transformIndices, sampleIdx) for sampleIdx in range(samplesCount)]
+
+        outputs = []
+        for transformIdx, transform in enumerate(self.transformations):
+            samplesCount = self.get_samples_count([transform])
+            outputs += [(self.get_sample_name(getTransformName(transform), sampleIdx, samplesCount), [transformIdx], sampleIdx) for sampleIdx in range(samplesCount)]
+        return outputs
+
+    def get_samples_count(self, transformations: List[object]) -> int:
+        """Deterministic transformations always give the same output, only random ones are sampled more than once"""
+        isRandom = any(isinstance(transform, RandomizableTransform) for transform in transformations)
+        return self.samplesPerCase if isRandom else 1
+
+    def get_sample_name(self, transformName: str, sampleIdx: int, samplesCount: int) -> str:
+        """Names each variant after its index, e.g. "RandRotated_3", so every sample gets its own output directory"""
+        return f"{transformName}_{sampleIdx}" if samplesCount > 1 else transformName
+
+    def load_case(self, idx: int) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor], Optional[VolumeMetadata], Optional[VolumeMetadata]]:
+        maskPath = self.maskPaths[idx] if self.maskPaths and idx < len(self.maskPaths) else None
+        return self.load_case_paths(self.imgPaths[idx], maskPath)
+
+    def load_case_paths(self, imgPath: str, maskPath: Optional[str]) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor], Optional[VolumeMetadata], Optional[VolumeMetadata]]:
+        """Loads the image and the mask of a case. Both are converted to float (unless the input type is kept, or the mask is an integer
+        label map) and moved to the device here, once, and every transformation of the case reuses them.
+        """
+        mask, maskMetadata = None, None
+
+        img, imgMetadata = self.load(imgPath)
+        if maskPath:
+            mask, maskMetadata = self.load(maskPath)
+
+        # pinned tensors are copied to the GPU asynchronously
+        with profiler.stage(STAGE_HOST_TO_DEVICE):
+            if (img is not None):
+                img = img.to(device=self.device, dtype=img.dtype if self.dtypePolicy == DTYPE_KEEP else torch.float32, non_blocking=img.is_pinned())
+            if (mask is not None):
+                mask = mask.to(device=self.device, dtype=self.get_mask_dtype(mask), non_blocking=mask.is_pinned())
+
+        return img, mask, imgMetadata, maskMetadata
+
+    def downsample(self, volume: Optional[torch.Tensor], metadata: Optional[VolumeMetadata], factor: int) -> Tuple[Optional[torch.Tensor], Optional[VolumeMetadata]]:
+        """Keeps one voxel every factor along each axis of a (D,H,W) volume, for a quick preview.
+        The first voxel is kept, so the origin doesn't change and the result overlaps the original with a larger spacing.
+        """
+        if volume is None or factor <= 1 or volume.dim() != 3:
+            return volume, metadata
+
+        volume = volume[::factor, ::factor, ::factor].contiguous()
+        return volume, metadata._replace(size=tuple(reversed(volume.shape)), spacing=tuple(spacing * factor for spacing in metadata.spacing))
+
+    def extract_slice(self, volume: Optional[torch.Tensor], metadata: Optional[VolumeMetadata], slice_idx: int) -> Tuple[Optional[torch.Tensor], Optional[VolumeMetadata]]:
+        """Returns the (1,H,W) slice of a (D,H,W) volume, with the origin moved to the slice so it's shown in place"""
+        if volume is None or volume.dim() != 3:
+            return volume, metadata
+
+        volume = volume[slice_idx:slice_idx + 1]
+        offset = slice_idx * metadata.spacing[2]
+        # third column of the row-major direction matrix
+        origin = tuple(metadata.origin[i] + metadata.direction[i * 3 + 2] * offset for i in range(3))
+        return volume, metadata._replace(size=tuple(reversed(volume.shape)), origin=origin)
+
+    def cast_output(self, transformed: torch.Tensor, metadata: Optional[VolumeMetadata], is_mask: bool = False, max_label: Optional[float] = None) -> torch.Tensor:
+        """Converts an output to the type it will be saved with, according to the dtype policy.
+        max_label is the maximum of a mask when it's already known, it saves a pass to choose the compact type
+        """
+        if is_mask and self.compactMasks:
+            if transformed.dtype == torch.uint8:
+                return transformed
+            labels = transformed if transformed.dtype in LABEL_DTYPES else transformed.round()
+            labels = labels.clamp(min=0)
+            uint16 = PIXEL_TYPES_TO_TORCH["16-bit unsigned integer"] or torch.int32
+            max_label = labels.max() if max_label is None else round(max_label)
+            return labels.to(torch.uint8 if max_label <= 255 else uint16)
+
+        if is_mask and self.dtypePolicy == DTYPE_FLOAT and not transformed.is_floating_point():
+            # label maps are transformed in their integer type, saved in float32 like the images
+            return transformed.float()
+
+        if self.dtypePolicy == DTYPE_RESTORE and metadata is not None:
+            dtype = PIXEL_TYPES_TO_TORCH.get(metadata.pixelType)
+            if dtype is None or transformed.dtype == dtype:
+                return transformed
+            if not dtype.is_floating_point:
+                dtypeInfo = torch.iinfo(dtype)
+                transformed = transformed.round().clamp(dtypeInfo.min, dtypeInfo.max)
+            return transformed.to(dtype)
+
+        return transformed
+
+    def iter_transformed(
+        self,
+        img: Optional[torch.Tensor],
+        mask: Optional[torch.Tensor],
+        imgMetadata: Optional[VolumeMetadata] = None,
+        maskMetadata: Optional[VolumeMetadata] = None,
+        case_id: str = "",
+        output_names: Optional[Set[str]] = None,
+    ) -> Iterator[Tuple[str, torch.Tensor, Optional[torch.Tensor]]]:
+        """Yields (transformName, transformedImg, transformedMask) as soon as each output is computed, already in the type it will be saved with.
+        The caller can save it and drop it before the next one is computed. case_id (see getCaseId) identifies the case when seeding.
+        When output_names is given only those outputs (see list_outputs) are computed.
+        transformedMask is None when the mask has no labels. The input mask is checked once: masks of a case without labels stay empty
+        (resampling and pads fill them with the background) and the transformations keeping every voxel keep its labels
+        (see preserves_labels). The resampled and cropped masks may have lost all of them, the minimum and maximum of those
+        are computed in a single pass on their label type, and the maximum also chooses the compact type.
+        """
+        mask_has_labels = mask is not None and bool(mask.any())
+        preserving_outputs = {name for name, transform_indices, sample_idx in self.list_outputs()
+                              if self.preserves_labels([self.transformations[idx] for idx in transform_indices])}
+        for transformName, transformedImg, transformedMask in self.iter_outputs(img, mask, case_id, output_names):
+            transformedImg = self.cast_output(transformedImg, imgMetadata)
+            if (transformedMask is not None):
+                max_label = None
+                if (mask_has_labels and transformName not in preserving_outputs):
+                    min_label, max_label = (value.item() for value in torch.aminmax(transformedMask))
+                    has_labels = min_label != 0 or max_label != 0
+                else:
+                    has_labels = mask_has_labels
+                transformedMask = self.cast_output(transformedMask, maskMetadata, is_mask=True, max_label=max_label) if has_labels else None
+            yield transformName, transformedImg, transformedMask
+            del transformedImg, transformedMask
+
+    def iter_outputs(
+        self,
+        img: Optional[torch.Tensor],
+        mask: Optional[torch.Tensor],
+        case_id: str = "",
+        output_names: Optional[Set[str]] = None,
+    ) -> Iterator[Tuple[str, torch.Tensor, Optional[torch.Tensor]]]:
+        if (img is None):
+            return
+
+        if self.chainTransformations:
+            yield from self.iter_sampled_chain(img, mask, case_id, output_names)
+            return
+
+        for transformIdx, transform in enumerate(self.transformations):
+            samplesCount = self.get_samples_count([transform])
+            for sampleIdx in range(samplesCount):
+                sampleName = self.get_sample_name(getTransformName(transform), sampleIdx, samplesCount)
+                if output_names is not None and sampleName not in output_names:
+                    continue
+                self.seed_transform(transform, case_id, transformIdx, sampleIdx)
+                sampleImages, sampleMasks = self.apply_transformations(transform, img, mask, [], [])
+                sampleImg = sampleImages[-1][1]
+                sampleMask = sampleMasks[-1][1] if sampleMasks else None
+                del sampleImages, sampleMasks
+                yield sampleName, sampleImg, sampleMask
+                del sampleImg, sampleMask
+
+    def __getitem__(self, idx: int) -> Tuple[List[List[Any]], Optional[List[List[Any]]], Optional[VolumeMetadata], Optional[VolumeMetadata]]:
         """Returns
         transformedImgs | transformedMasks  =  [
             ["rotate", torch.Tensor[[...]] ],
@@ -95,27 +467,25 @@ class ImageAugmenterDataset(Dataset):
             ["flip", torch.Tensor[[...]] ],
             ...
         ]
+        imgMetadata | maskMetadata = geometry of the original image and mask (VolumeMetadata)
 
+        All the outputs of the case are kept in memory, use load_case and iter_transformed to process them one at a time.
+        The opt-in profiler hook (see ImageAugmenterProfiler.profileCall) runs around the whole case.
         """
+        caseId = getCaseId(self.imgPaths[idx])
+        profiler.setCase(caseId)
+        return profiler.profileCall(caseId, self.get_item, idx, caseId)
+
+    def get_item(self, idx: int, case_id: str) -> Tuple[List[List[Any]], Optional[List[List[Any]]], Optional[VolumeMetadata], Optional[VolumeMetadata]]:
         transformedImages = []
         transformedMasks = []
-        mask = None
 
-        img = self.load(self.imgPaths[idx])
-        if self.maskPaths is not None and len(self.maskPaths) > 0:
-            mask = self.load(self.maskPaths[idx])
+        img, mask, imgMetadata, maskMetadata = self.load_case(idx)
 
-        for transform in self.transformations:
-            if (img != None and mask != None and isinstance(transform, RandomizableTransform)):
-                transformedImages, transformedMasks = self.apply_dict_transform(transform, {"img": img.to(self.device), "mask": mask.to(self.device)}, transformedImages, transformedMasks)
+        for transformName, transformedImg, transformedMask in self.iter_transformed(img, mask, imgMetadata, maskMetadata, case_id):
+            transformedImages.append([transformName, transformedImg])
+            # masks without labels are None, so both lists stay aligned by position
+            if (mask is not None):
+                transformedMasks.append([transformName, transformedMask])
 
-            if (img != None and mask == None and isinstance(transform, RandomizableTransform)):
-                transformedImages, transformedMasks = self.apply_dict_transform(transform, {"img": img.to(self.device)}, transformedImages, None)
-
-            if (img != None and not isinstance(transform, RandomizableTransform)):
-                transformedImages = self.apply_transform(transform, img.to(self.device), transformedImages)
-
-            if (mask != None and not isinstance(transform, RandomizableTransform)):
-                transformedMasks = self.apply_transform(transform, mask.to(self.device), transformedMasks)
-
-        return transformedImages, transformedMasks
+        return transformedImages, transformedMasks, imgMetadata, maskMetadata
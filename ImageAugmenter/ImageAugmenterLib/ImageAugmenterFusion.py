@@ -0,0 +1,325 @@
+import functools
+import inspect
+import itertools
+from typing import Dict, List, Optional, Tuple, Union
+
+import torch
+from monai.transforms import RandomizableTransform
+
+from ImageAugmenterLib.ImageAugmenterUtils import getLabelTransform, getTransformName
+
+# deterministic intensity transformations computing every voxel from its own value, so a run of them can be fused in a single pass.
+# ScaleIntensity (minimum and maximum of the volume) and AdjustContrast (retained mean and std) need statistics of their input:
+# they end a run, like any other transformation
+POINTWISE_TRANSFORMS = ["ShiftIntensity", "NormalizeIntensity", "ThresholdIntensity", "ScaleIntensityRange"]
+# every block of the volume goes through all the steps while it's in the CPU cache
+FUSED_BLOCK_BYTES = 1 << 20
+
+STEP_AFFINE = "affine" # (x + shift) / divisor
+STEP_NONZERO = "nonzero" # (x - subtrahend) / divisor of the non-zero voxels
+STEP_THRESHOLD = "threshold" # voxels not above (or below) the threshold set to cval
+
+# affine transformations of the slices (the first axis is the channel, see CHANNEL_FIRST_REQUIRED), composed into a single resampling.
+# Resize joins them when it keeps the number of slices
+SPATIAL_FUSION_TRANSFORMS = ["Rotate", "RandRotated", "Zoom", "RandZoomd", "Flip", "RandAxisFlipd", "Resize"]
+# interpolation and padding of the resampling (torch grid_sample) that reproduce the transformations
+FUSED_INTERPOLATION_MODES = ["nearest", "bilinear"]
+FUSED_PADDING_MODES = ["zeros", "border", "reflection"]
+# np.pad modes of Zoom when it zooms out, with the grid_sample mode extending the image the same way
+ZOOM_PADDING_MODES = {"constant": "zeros", "edge": "border"}
+
+
+def isPointwise(transform: object) -> bool:
+    """Whether the transformation can be part of a fused run, only with parameters fixed in advance"""
+    transformName = getTransformName(transform)
+    if transformName not in POINTWISE_TRANSFORMS:
+        return False
+
+    if transformName == "NormalizeIntensity":
+        return not transform.channel_wise and isinstance(transform.subtrahend, (int, float)) and isinstance(transform.divisor, (int, float))
+    if transformName == "ScaleIntensityRange":
+        return (not transform.clip and transform.b_min is not None and transform.b_max is not None
+                and transform.a_max != transform.a_min and transform.b_max != transform.b_min)
+    return True
+
+
+class ImageAugmenterFusedIntensity():
+    """Applies a run of point-wise intensity transformations (see POINTWISE_TRANSFORMS) with a single pass over the volume:
+    the input is copied once and every block of FUSED_BLOCK_BYTES goes through all the steps in place, instead of every
+    transformation reading the whole volume and allocating its own output. Consecutive shifts and normalizations are folded into one step.
+    The results match the MONAI transformations up to float rounding. Integer volumes (Output type "keep") go through the
+    transformations one by one, as they round after every step.
+    """
+    def __init__(self, transforms: List[object]) -> None:
+        self.transforms: List[object] = transforms
+        self.name: str = "+".join(getTransformName(transform) for transform in transforms)
+        # NormalizeIntensity and ScaleIntensityRange return float32
+        self.toFloat32: bool = any(getTransformName(transform) in ("NormalizeIntensity", "ScaleIntensityRange") for transform in transforms)
+        self.steps: List[Tuple] = self.compileSteps(transforms)
+
+    def get_transform_info(self) -> Dict[str, str]:
+        # used by getTransformName, e.g. to time the run in the profiler
+        return {"class": self.name}
+
+    @staticmethod
+    def compileSteps(transforms: List[object]) -> List[Tuple]:
+        steps = []
+        for transform in transforms:
+            transformName = getTransformName(transform)
+            if transformName == "ThresholdIntensity":
+                steps.append((STEP_THRESHOLD, float(transform.threshold), transform.above, float(transform.cval)))
+                continue
+
+            if transformName == "ShiftIntensity":
+                subtrahend, divisor = -float(transform.offset), 1.0
+            elif transformName == "ScaleIntensityRange":
+                # (x - a_min) / (a_max - a_min) * (b_max - b_min) + b_min: a normalization, then a shift by b_min
+                subtrahend, divisor = float(transform.a_min), (transform.a_max - transform.a_min) / (transform.b_max - transform.b_min)
+            else:
+                # like MONAI, a divisor of 0 leaves the values unscaled
+                subtrahend, divisor = float(transform.subtrahend), float(transform.divisor) or 1.0
+                if transform.nonzero:
+                    steps.append((STEP_NONZERO, subtrahend, divisor))
+                    continue
+
+            # ((x + shift) / previousDivisor - subtrahend) / divisor = (x + shift - subtrahend * previousDivisor) / (previousDivisor * divisor)
+            if steps and steps[-1][0] == STEP_AFFINE:
+                shift, previousDivisor = steps.pop()[1:]
+                steps.append((STEP_AFFINE, shift - subtrahend * previousDivisor, previousDivisor * divisor))
+            else:
+                steps.append((STEP_AFFINE, -subtrahend, divisor))
+
+            if transformName == "ScaleIntensityRange":
+                shift, divisor = steps.pop()[1:]
+                steps.append((STEP_AFFINE, shift + float(transform.b_min) * divisor, divisor))
+
+        return steps
+
+    def applySteps(self, block: torch.Tensor) -> None:
+        for step in self.steps:
+            if step[0] == STEP_AFFINE:
+                shift, divisor = step[1:]
+                if shift != 0:
+                    block.add_(shift)
+                if divisor != 1:
+                    block.div_(divisor)
+            elif step[0] == STEP_NONZERO:
+                subtrahend, divisor = step[1:]
+                block.copy_(torch.where(block != 0, (block - subtrahend) / divisor, block))
+            else:
+                threshold, above, cval = step[1:]
+                # a NaN is neither above nor below, it's replaced like in MONAI
+                block.masked_fill_(~(block > threshold if above else block < threshold), cval)
+
+    def __call__(self, img: torch.Tensor) -> torch.Tensor:
+        if not img.is_floating_point():
+            for transform in self.transforms:
+                img = transform(img)
+            return img
+
+        # MONAI outputs are MetaTensors, the steps run on the plain tensor to avoid their overhead on every block
+        if hasattr(img, "as_tensor"):
+            img = img.as_tensor()
+        dtype = torch.float32 if self.toFloat32 or img.dtype in (torch.float16, torch.bfloat16) else img.dtype
+        # the input isn't modified, it can be shared with other outputs of the case
+        out = img.to(dtype=dtype, memory_format=torch.contiguous_format, copy=True)
+
+        voxels = out.view(-1)
+        # GPU kernels already stream the whole volume at full bandwidth
+        blockSize = voxels.numel() if out.device.type != "cpu" else max(1, FUSED_BLOCK_BYTES // out.element_size())
+        for block in voxels.split(blockSize):
+            self.applySteps(block)
+        return out
+
+
+def getFirstSetting(value):
+    # dictionary transformations have a setting per key
+    return value[0] if isinstance(value, (list, tuple)) else value
+
+
+def getResampleSettings(transform: object) -> Optional[Tuple[Optional[str], Optional[str], bool]]:
+    """(interpolation mode, padding mode, align corners) of the resampling computing the transformation, None when it
+    can't be part of a fused resampling. The modes are None when the transformation doesn't interpolate (flips) or doesn't pad
+    """
+    transformName = getTransformName(transform)
+    if transformName not in SPATIAL_FUSION_TRANSFORMS:
+        return None
+    if transformName in ("Flip", "RandAxisFlipd"):
+        return None, None, None
+
+    mode = getFirstSetting(transform.mode)
+    alignCorners = bool(getFirstSetting(transform.align_corners))
+    if transformName in ("Rotate", "RandRotated"):
+        paddingMode = getFirstSetting(transform.padding_mode)
+        if mode not in FUSED_INTERPOLATION_MODES or paddingMode not in FUSED_PADDING_MODES:
+            return None
+        return mode, paddingMode, alignCorners
+
+    # Zoom and Resize interpolate with torch.nn.functional.interpolate, whose nearest mode picks other voxels than grid_sample,
+    # and their affine is only exact without align_corners
+    if mode != "bilinear" or alignCorners:
+        return None
+    if transformName == "Resize":
+        return None if transform.anti_aliasing or transform.size_mode != "all" else (mode, None, False)
+
+    zoom = transform.rand_zoom if transformName == "RandZoomd" else transform
+    minZoom = min(zoom.min_zoom) if transformName == "RandZoomd" else min(torch.as_tensor(zoom.zoom).reshape(-1).tolist())
+    if not zoom.keep_size:
+        return None
+    if minZoom >= 1:
+        return mode, None, False
+    paddingMode = ZOOM_PADDING_MODES.get(getFirstSetting(transform.padding_mode))
+    return None if paddingMode is None else (mode, paddingMode, False)
+
+
+def areSettingsCompatible(settings: Tuple, otherSettings: Tuple) -> bool:
+    return all(setting is None or otherSetting is None or setting == otherSetting for setting, otherSetting in zip(settings, otherSettings))
+
+
+def mergeSettings(settings: Tuple, otherSettings: Tuple) -> Tuple:
+    return tuple(otherSetting if setting is None else setting for setting, otherSetting in zip(settings, otherSettings))
+
+
+class ImageAugmenterFusedSpatial():
+    """Computes a run of affine transformations of the slices (see SPATIAL_FUSION_TRANSFORMS) with a single resampling of
+    the image and of the mask, instead of interpolating the volume again at every step, which blurs it and costs a full pass each time.
+    Every transformation, random ones included, is sampled without computing it (MONAI lazy mode), the affines are composed and
+    applied by one grid_sample with the interpolation and padding of the run.
+    Inside the volume the result is the one of the chain without the intermediate interpolations, on the borders the areas
+    an intermediate transformation would have cropped or padded (e.g. corners of a rotation before a zoom out) are filled from the input.
+    Transformations with other interpolation or padding than the ones before (see getResampleSettings) resample what's
+    pending first, a Resize changing the number of slices is computed on its own, like the transformations not fused.
+    """
+    def __init__(self, transforms: List[object]) -> None:
+        self.transforms: List[object] = transforms
+        self.name: str = "+".join(getTransformName(transform) for transform in transforms)
+
+    def get_transform_info(self) -> Dict[str, str]:
+        return {"class": self.name}
+
+    def getKeySettings(self, key: str, settings: Tuple, labels: bool = False) -> Dict:
+        """Arguments of the resampling of a volume of the dictionary, the mask is a label map resampled with the nearest neighbour"""
+        mode, paddingMode, alignCorners = settings
+        if key == "mask" or labels:
+            mode = "nearest"
+        return {"mode": mode or "bilinear", "padding_mode": paddingMode or "border", "align_corners": bool(alignCorners), "dtype": torch.float32}
+
+    def resamplePending(self, data: Dict, settings: Tuple, labels: bool = False) -> Dict:
+        from monai.transforms.lazy.functional import apply_pending
+
+        return {key: apply_pending(volume, overrides=self.getKeySettings(key, settings, labels))[0] for key, volume in data.items()}
+
+    def applyTransform(self, transform: object, data: Dict, lazy: bool) -> Dict:
+        if isinstance(transform, RandomizableTransform):
+            # all the keys share the random parameters
+            return transform(data, lazy=lazy)
+        return {key: transform(volume, lazy=lazy) for key, volume in data.items()}
+
+    def getSliceTransform(self, transform: object, slices: int) -> Optional[object]:
+        """The transformation computed on the slices, None for a Resize changing their number (computed in 3D, as not fused)"""
+        if getTransformName(transform) != "Resize":
+            return transform
+        if transform.spatial_size[0] not in (-1, slices):
+            return None
+
+        from monai.transforms import Resize
+        return Resize(spatial_size=tuple(transform.spatial_size[1:]), mode=transform.mode, align_corners=transform.align_corners, dtype=transform.dtype)
+
+    def __call__(self, data: Union[torch.Tensor, Dict[str, torch.Tensor]], labels: bool = False) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
+        """data is a volume, or a dictionary with the image and the mask. With labels the volume is a mask"""
+        from monai.data import MetaTensor
+
+        isDict = isinstance(data, dict)
+        data = {key: volume if isinstance(volume, MetaTensor) else MetaTensor(volume) for key, volume in (data.items() if isDict else {"img": data}.items())}
+
+        settings = (None, None, None)
+        for transform in self.transforms:
+            sliceTransform = self.getSliceTransform(transform, data["img"].shape[0])
+            transformSettings = getResampleSettings(transform)
+            if sliceTransform is None:
+                data = self.resamplePending(data, settings, labels)
+                data = {key: (getLabelTransform(transform) if key == "mask" or labels else transform)(volume.unsqueeze(dim=0)).squeeze(dim=0)
+                        for key, volume in data.items()}
+                settings = (None, None, None)
+                continue
+
+            if not areSettingsCompatible(settings, transformSettings):
+                data = self.resamplePending(data, settings, labels)
+                settings = (None, None, None)
+            settings = mergeSettings(settings, transformSettings)
+            data = self.applyTransform(sliceTransform, data, lazy=True)
+
+        data = self.resamplePending(data, settings, labels)
+        return data if isDict else data["img"]
+
+
+class ImageAugmenterFusedRandSpatial(ImageAugmenterFusedSpatial, RandomizableTransform):
+    """A fused run with random transformations, computed on the image and the mask together so they share the random parameters.
+    The transformations of the run are seeded on their own (see ImageAugmenterDataset.apply_chain)
+    """
+    def __init__(self, transforms: List[object]) -> None:
+        RandomizableTransform.__init__(self, prob=1.0)
+        ImageAugmenterFusedSpatial.__init__(self, transforms)
+
+    def randomize(self, data) -> None:
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def isLazyResamplingAvailable() -> bool:
+    """Whether the installed MONAI has the lazy resampling ImageAugmenterFusedSpatial is built on (MONAI 1.2 and later):
+    the lazy argument of the transformations and apply_pending with overrides. Otherwise the spatial transformations are applied one by one
+    """
+    try:
+        from monai.transforms import Flip, RandAxisFlipd, RandRotated, RandZoomd, Resize, Rotate, Zoom
+        from monai.transforms.lazy.functional import apply_pending
+    except ImportError:
+        return False
+
+    return ("overrides" in inspect.signature(apply_pending).parameters
+            and all("lazy" in inspect.signature(transform.__call__).parameters for transform in (Rotate, RandRotated, Zoom, RandZoomd, Flip, RandAxisFlipd, Resize)))
+
+
+def getFusionKind(transform: object) -> Optional[str]:
+    if isPointwise(transform):
+        return "intensity"
+    if isLazyResamplingAvailable() and getResampleSettings(transform) is not None:
+        return "spatial"
+    return None
+
+
+def createFusedTransform(kind: str, transforms: List[object]) -> object:
+    if kind == "intensity":
+        return ImageAugmenterFusedIntensity(transforms)
+    if any(isinstance(transform, RandomizableTransform) for transform in transforms):
+        return ImageAugmenterFusedRandSpatial(transforms)
+    return ImageAugmenterFusedSpatial(transforms)
+
+
+def getFusedTransforms(transform: object) -> List[object]:
+    """The transformations of the chain computed by a transformation returned by fuseTransformations"""
+    return transform.transforms if isinstance(transform, (ImageAugmenterFusedIntensity, ImageAugmenterFusedSpatial)) else [transform]
+
+
+def getFusedRunStart(transformations: List[object], idx: int) -> int:
+    """Index of the first transformation of the run fused with transformations[idx]"""
+    kind = getFusionKind(transformations[idx]) if idx < len(transformations) else None
+    while kind is not None and idx > 0 and getFusionKind(transformations[idx - 1]) == kind:
+        idx -= 1
+    return idx
+
+
+def fuseTransformations(transformations: List[object], start_idx: int = 0) -> List[Tuple[int, object]]:
+    """Replaces every run of two or more point-wise intensity transformations of a chain with an ImageAugmenterFusedIntensity,
+    and every run of two or more affine transformations of the slices with an ImageAugmenterFusedSpatial.
+    Returns (index of the first transformation in the chain, transformation) pairs, the indices are used to seed the random ones.
+    """
+    fused = []
+    for kind, run in itertools.groupby(enumerate(transformations, start_idx), key=lambda item: getFusionKind(item[1])):
+        run = list(run)
+        if kind is None or len(run) < 2:
+            fused += run
+        else:
+            fused.append((run[0][0], createFusedTransform(kind, [transform for transform_idx, transform in run])))
+
+    return fused
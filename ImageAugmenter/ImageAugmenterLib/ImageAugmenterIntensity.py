@@ -1,81 +1,83 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from ImageAugmenterLib.ImageAugmenterTransformControllerInterface import ImageAugmenterTransformControllerInterface
 
 class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterface):
-    def __init__(self, ui, mappedTransformations: List[object], dictKeys: Dict[str, str]) -> None:
-        from munch import Munch, munchify
+    def __init__(self, ui, mappedTransformations: List[object], dictKeys: Dict[str, str], transformations: Optional[Dict[str, Dict]] = None) -> None:
+        from munch import Munch
 
         self.ui = ui
-        self.transformations: Munch = munchify(self.getTransformations())
+        self.transformations: Munch = self.loadTransformations(transformations)
         self.mappedTransformations: List[object] = mappedTransformations
+        # recipe name (e.g. "rotate") of each mapped transformation, see addTransformation
+        self.mappedTransformationNames: List[str] = []
         self.dictKeys: Dict[str, str] = dictKeys
 
-    def getTransformations(self) -> Dict[str, Dict]:
+    def getTransformationWidgets(self) -> Dict[str, Dict]:
         return {
             "scaleIntensity": {
-                "enabled": self.ui.scaleIntensityEnabled.isChecked(),
-                "factor": self.ui.scaleIntensityFactor.text,
+                "enabled": self.ui.scaleIntensityEnabled,
+                "factor": self.ui.scaleIntensityFactor,
             },
             "randomScaleIntensity": {
-                "enabled": self.ui.randomScaleIntensityEnabled.isChecked(),
-                "factorFrom": self.ui.randomScaleIntensityFactorFrom.text,
-                "factorTo": self.ui.randomScaleIntensityFactorTo.text,
+                "enabled": self.ui.randomScaleIntensityEnabled,
+                "factorFrom": self.ui.randomScaleIntensityFactorFrom,
+                "factorTo": self.ui.randomScaleIntensityFactorTo,
             },
             "adjustContrast": {
-                "enabled": self.ui.adjustContrastEnabled.isChecked(),
-                "gamma": self.ui.adjustContrastGamma.text,
-                "invertImage": self.ui.adjustContrastInvertImage.isChecked(),
+                "enabled": self.ui.adjustContrastEnabled,
+                "gamma": self.ui.adjustContrastGamma,
+                "invertImage": self.ui.adjustContrastInvertImage,
             },
             "randomAdjustContrast": {
-                "enabled": self.ui.randomAdjustContrastEnabled.isChecked(),
-                "gammaFrom": self.ui.randomAdjustContrastGammaFrom.text,
-                "gammaTo": self.ui.randomAdjustContrastGammaTo.text,
-                "invertImage": self.ui.randomAdjustContrastInvertImage.isChecked(),
+                "enabled": self.ui.randomAdjustContrastEnabled,
+                "gammaFrom": self.ui.randomAdjustContrastGammaFrom,
+                "gammaTo": self.ui.randomAdjustContrastGammaTo,
+                "invertImage": self.ui.randomAdjustContrastInvertImage,
             },
             "randomGaussianNoise": {
-                "enabled": self.ui.randomGaussianNoiseEnabled.isChecked(),
-                "mean": self.ui.randomGaussianNoiseMean.text,
-                "std": self.ui.randomGaussianNoiseStd.text,
+                "enabled": self.ui.randomGaussianNoiseEnabled,
+                "mean": self.ui.randomGaussianNoiseMean,
+                "std": self.ui.randomGaussianNoiseStd,
             },
             "shiftIntensity": {
-                "enabled": self.ui.shiftIntensityEnabled.isChecked(),
-                "offset": self.ui.shiftIntensityOffset.text,
+                "enabled": self.ui.shiftIntensityEnabled,
+                "offset": self.ui.shiftIntensityOffset,
             },
             "randomShiftIntensity": {
-                "enabled": self.ui.randomShiftIntensityEnabled.isChecked(),
-                "offsetFrom": self.ui.randomShiftIntensityFrom.text,
-                "offsetTo": self.ui.randomShiftIntensityTo.text,
+                "enabled": self.ui.randomShiftIntensityEnabled,
+                "offsetFrom": self.ui.randomShiftIntensityFrom,
+                "offsetTo": self.ui.randomShiftIntensityTo,
             },
             "normalizeIntensity": {
-                "enabled": self.ui.normalizeIntensityEnabled.isChecked(),
-                "subtrahend": self.ui.normalizeIntensitySubtrahend.text,
-                "divisor": self.ui.normalizeIntensityDivisor.text,
-                "nonZero": self.ui.normalizeIntensityNonZero.isChecked(),
+                "enabled": self.ui.normalizeIntensityEnabled,
+                "subtrahend": self.ui.normalizeIntensitySubtrahend,
+                "divisor": self.ui.normalizeIntensityDivisor,
+                "nonZero": self.ui.normalizeIntensityNonZero,
             },
             "thresholdIntensity": {
-                "enabled": self.ui.thresholdIntensityEnabled.isChecked(),
-                "thresholdValue": self.ui.thresholdIntensityValue.text,
-                "cVal": self.ui.thresholdIntensityCVal.text,
-                "above": self.ui.thresholdIntensityAbove.isChecked(),
+                "enabled": self.ui.thresholdIntensityEnabled,
+                "thresholdValue": self.ui.thresholdIntensityValue,
+                "cVal": self.ui.thresholdIntensityCVal,
+                "above": self.ui.thresholdIntensityAbove,
             },
             "medianSmooth": {
-                "enabled": self.ui.medianSmoothEnabled.isChecked(),
-                "radius": self.ui.medianSmoothRadius.text,
+                "enabled": self.ui.medianSmoothEnabled,
+                "radius": self.ui.medianSmoothRadius,
             },
             "gaussianSmooth": {
-                "enabled": self.ui.gaussianSmoothEnabled.isChecked(),
-                "sigma": self.ui.gaussianSmoothSigma.text,
-                "kernel": self.ui.gaussianSmoothKernelType.currentText,
+                "enabled": self.ui.gaussianSmoothEnabled,
+                "sigma": self.ui.gaussianSmoothSigma,
+                "kernel": self.ui.gaussianSmoothKernelType,
             },
             "randGaussianSmooth": {
-                "enabled": self.ui.randGaussianSmoothEnabled.isChecked(),
-                "sigmaFromX": self.ui.randGaussianSmoothSigmaXFrom.text,
-                "sigmaToX": self.ui.randGaussianSmoothSigmaXTo.text,
-                "sigmaFromY": self.ui.randGaussianSmoothSigmaYFrom.text,
-                "sigmaToY": self.ui.randGaussianSmoothSigmaYTo.text,
-                "sigmaFromZ": self.ui.randGaussianSmoothSigmaZFrom.text,
-                "sigmaToZ": self.ui.randGaussianSmoothSigmaZTo.text,
-                "kernel": self.ui.randGaussianSmoothKernelType.currentText,
+                "enabled": self.ui.randGaussianSmoothEnabled,
+                "sigmaFromX": self.ui.randGaussianSmoothSigmaXFrom,
+                "sigmaToX": self.ui.randGaussianSmoothSigmaXTo,
+                "sigmaFromY": self.ui.randGaussianSmoothSigmaYFrom,
+                "sigmaToY": self.ui.randGaussianSmoothSigmaYTo,
+                "sigmaFromZ": self.ui.randGaussianSmoothSigmaZFrom,
+                "sigmaToZ": self.ui.randGaussianSmoothSigmaZTo,
+                "kernel": self.ui.randGaussianSmoothKernelType,
             },
         }
 
@@ -87,7 +89,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                 raise ValueError(
                     "The 'Scale Intensity' transformation is enabled but factor is not specified")
 
-            self.mappedTransformations.append(ScaleIntensity(
+            self.addTransformation("scaleIntensity", ScaleIntensity(
                 factor=(float(self.transformations.scaleIntensity.factor))))
 
         if (self.transformations.randomScaleIntensity.enabled):
@@ -95,7 +97,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                 raise ValueError(
                     "The 'Randomd Scale Intensity' transformation is enabled but factors are not specified")
 
-            self.mappedTransformations.append(RandScaleIntensityd(prob=1,
+            self.addTransformation("randomScaleIntensity", RandScaleIntensityd(prob=1,
                                                                   factors=(float(self.transformations.randomScaleIntensity.factorFrom),
                                                                            float(self.transformations.randomScaleIntensity.factorTo)),
                                                                   keys=self.dictKeys,
@@ -107,7 +109,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                 raise ValueError(
                     "The 'Adjust Contrast' transformation is enabled but gamma value is not specified")
 
-            self.mappedTransformations.append(AdjustContrast(gamma=(float(self.transformations.adjustContrast.gamma)),
+            self.addTransformation("adjustContrast", AdjustContrast(gamma=(float(self.transformations.adjustContrast.gamma)),
                                                              invert_image=self.transformations.adjustContrast.invertImage,
                                                              retain_stats=True
                                                              )
@@ -118,7 +120,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                 raise ValueError(
                     "The 'Random Adjust Contrast' transformation is enabled but gamma values are not specified")
 
-            self.mappedTransformations.append(RandAdjustContrastd(prob=1,
+            self.addTransformation("randomAdjustContrast", RandAdjustContrastd(prob=1,
                                                                   gamma=(float(self.transformations.randomAdjustContrast.gammaFrom), float(
                                                                       self.transformations.randomAdjustContrast.gammaTo)),
                                                                   invert_image=self.transformations.randomAdjustContrast.invertImage,
@@ -132,7 +134,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                 self.transformations.randomGaussianNoise.mean != "") else 0.0
             std = float(self.transformations.randomGaussianNoise.std) if (
                 self.transformations.randomGaussianNoise.std != "") else 0.1
-            self.mappedTransformations.append(RandGaussianNoised(prob=1,
+            self.addTransformation("randomGaussianNoise", RandGaussianNoised(prob=1,
                                                                  mean=mean,
                                                                  std=std,
                                                                  keys=self.dictKeys,
@@ -143,7 +145,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                 raise ValueError(
                     "The 'Shift Intensity' transformation is enabled but offset value is not specified")
 
-            self.mappedTransformations.append(ShiftIntensity(
+            self.addTransformation("shiftIntensity", ShiftIntensity(
                 offset=float(self.transformations.shiftIntensity.offset)))
 
         if (self.transformations.randomShiftIntensity.enabled):
@@ -151,7 +153,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                 raise ValueError(
                     "The 'Random Shift Intensity' transformation is enabled but offsets values are not specified")
 
-            self.mappedTransformations.append(RandShiftIntensityd(prob=1,
+            self.addTransformation("randomShiftIntensity", RandShiftIntensityd(prob=1,
                                                                   offsets=(float(
                                                                       self.transformations.randomShiftIntensity.offsetFrom, self.transformations.randomShiftIntensity.offsetTo)),
                                                                   keys=self.dictKeys,
@@ -162,7 +164,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                 raise ValueError(
                     "The 'Normalize Intensity' transformation is enabled but values are not specified")
 
-            self.mappedTransformations.append(NormalizeIntensity(subtrahend=float(self.transformations.normalizeIntensity.subtrahend),
+            self.addTransformation("normalizeIntensity", NormalizeIntensity(subtrahend=float(self.transformations.normalizeIntensity.subtrahend),
                                                                  divisor=float(
                                                                      self.transformations.normalizeIntensity.divisor),
                                                                  nonzero=self.transformations.normalizeIntensity.nonZero))
@@ -174,18 +176,18 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
 
             cVal = float(
                 self.transformations.thresholdIntensity.cVal) if self.transformations.thresholdIntensity.cVal else 0.0
-            self.mappedTransformations.append(ThresholdIntensity(threshold=float(
+            self.addTransformation("thresholdIntensity", ThresholdIntensity(threshold=float(
                 self.transformations.thresholdIntensity.thresholdValue), cval=cVal, above=self.transformations.thresholdIntensity.above))
 
         if (self.transformations.medianSmooth.enabled):
             radius = float(
                 self.transformations.medianSmooth.radius) if self.transformations.medianSmooth.radius else 1
-            self.mappedTransformations.append(MedianSmooth(radius=radius))
+            self.addTransformation("medianSmooth", MedianSmooth(radius=radius))
 
         if (self.transformations.gaussianSmooth.enabled):
             sigma = float(
                 self.transformations.gaussianSmooth.sigma) if self.transformations.gaussianSmooth.sigma else 1
-            self.mappedTransformations.append(GaussianSmooth(
+            self.addTransformation("gaussianSmooth", GaussianSmooth(
                 sigma=sigma, approx=self.transformations.gaussianSmooth.kernel))
 
         if (self.transformations.randGaussianSmooth.enabled):
@@ -202,7 +204,7 @@ class ImageAugmenterIntensityController(ImageAugmenterTransformControllerInterfa
                     sigmaZ = [float(self.transformations.randGaussianSmooth.sigmaFromZ), float(
                         self.transformations.randGaussianSmooth.sigmaToZ)]
 
-                self.mappedTransformations.append(RandGaussianSmoothd(prob=1,
+                self.addTransformation("randGaussianSmooth", RandGaussianSmoothd(prob=1,
                                                                       sigma_x=sigmaX,
                                                                       sigma_y=sigmaY,
                                                                       sigma_z=sigmaZ,
@@ -0,0 +1,117 @@
+import logging
+import queue
+import threading
+from typing import Callable, Optional
+
+JOB_POLL_INTERVAL_MS = 100
+
+
+class ImageAugmenterCancelledError(Exception):
+    """Raised inside a job at its next checkpoint once it has been cancelled"""
+    pass
+
+
+class ImageAugmenterJobControl():
+    """Cooperative pause and cancel, the job calls checkpoint() between cases"""
+    def __init__(self) -> None:
+        self.cancelEvent: threading.Event = threading.Event()
+        self.resumeEvent: threading.Event = threading.Event()
+        self.resumeEvent.set()
+
+    @property
+    def isPaused(self) -> bool:
+        return not self.resumeEvent.is_set()
+
+    @property
+    def isCancelled(self) -> bool:
+        return self.cancelEvent.is_set()
+
+    def pause(self) -> None:
+        self.resumeEvent.clear()
+
+    def resume(self) -> None:
+        self.resumeEvent.set()
+
+    def cancel(self) -> None:
+        self.cancelEvent.set()
+        # a paused job must wake up to stop
+        self.resumeEvent.set()
+
+    def checkpoint(self) -> None:
+        """Blocks while the job is paused, raises ImageAugmenterCancelledError if it has been cancelled"""
+        self.resumeEvent.wait()
+        if self.cancelEvent.is_set():
+            raise ImageAugmenterCancelledError("Processing cancelled")
+
+
+class ImageAugmenterMainThreadProxy():
+    """Forwards the method calls on a widget to the main thread, where they are applied by ImageAugmenterJob.poll"""
+    def __init__(self, target, updates: queue.Queue) -> None:
+        self._target = target
+        self._updates: queue.Queue = updates
+
+    def __getattr__(self, name: str):
+        method = getattr(self._target, name)
+        return lambda *args: self._updates.put((method, args))
+
+
+class ImageAugmenterJob():
+    """Runs target(progressBar, infoLabel, setButtonsEnabled, jobControl) in a background thread, so the UI stays responsive.
+    Qt widgets can't be used outside the main thread: the target receives proxies of progressBar, infoLabel and setButtonsEnabled,
+    and their calls are applied by a timer on the main thread. onFinished(error) is called there too, error is None on success.
+    """
+    def __init__(self,
+                 target: Callable,
+                 progressBar,
+                 infoLabel,
+                 setButtonsEnabled: Callable[[bool], None],
+                 onFinished: Callable[[Optional[BaseException]], None]) -> None:
+        self.target: Callable = target
+        self.onFinished: Callable[[Optional[BaseException]], None] = onFinished
+        self.control: ImageAugmenterJobControl = ImageAugmenterJobControl()
+        self.updates: queue.Queue = queue.Queue()
+        self.progressBar = ImageAugmenterMainThreadProxy(progressBar, self.updates)
+        self.infoLabel = ImageAugmenterMainThreadProxy(infoLabel, self.updates)
+        self.setButtonsEnabled = lambda state: self.updates.put((setButtonsEnabled, (state,)))
+        self.error: Optional[BaseException] = None
+        self.thread: threading.Thread = threading.Thread(target=self._run, name="ImageAugmenterJob", daemon=True)
+        self.timer = None
+
+    @property
+    def isRunning(self) -> bool:
+        return self.thread.is_alive()
+
+    def start(self) -> None:
+        import qt
+
+        self.timer = qt.QTimer()
+        self.timer.setInterval(JOB_POLL_INTERVAL_MS)
+        self.timer.connect("timeout()", self.poll)
+        self.thread.start()
+        self.timer.start()
+
+    def _run(self) -> None:
+        try:
+            self.target(self.progressBar, self.infoLabel, self.setButtonsEnabled, self.control)
+        except BaseException as e:
+            self.error = e
+        finally:
+            # end of the job, after all its updates
+            self.updates.put(None)
+
+    def poll(self) -> None:
+        while True:
+            try:
+                update = self.updates.get_nowait()
+            except queue.Empty:
+                return
+
+            if update is None:
+                self.timer.stop()
+                if self.error is not None and not isinstance(self.error, ImageAugmenterCancelledError):
+                    logging.error(f"Processing failed: {self.error!r}")
+                self.onFinished(self.error)
+                return
+
+            method, args = update
+            method(*args)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = ".imageaugmenter_manifest.json"
+JOURNAL_FILENAME = ".imageaugmenter_manifest.jsonl"
+
+
+def getRunKey(recipeHash: str, **settings) -> Optional[str]:
+    """Identifies what a run produces from a case: the recipe and the settings changing the outputs.
+    Without a recipe hash the outputs can't be compared, and nothing is ever skipped.
+    """
+    if not recipeHash:
+        return None
+    runSettings = json.dumps({"recipe": recipeHash, **settings}, sort_keys=True)
+    return hashlib.sha256(runSettings.encode()).hexdigest()
+
+
+def getInputState(path: Optional[str]) -> Optional[Dict]:
+    if not path:
+        return None
+    fileStat = os.stat(path)
+    return {"path": os.path.abspath(path), "mtime": fileStat.st_mtime_ns, "size": fileStat.st_size}
+
+
+class ImageAugmenterManifest():
+    """Records the completed cases of the runs in an output folder: the input path, mtime and size of image and mask,
+    the run key (see getRunKey), the seed of the random transformations and the output files of every transformation.
+    A case is recorded only when all its outputs are on disk, appending a line to a journal that is fsync'd, so after a crash
+    a case without a complete line is processed again. The journal is compacted in the manifest when the run ends,
+    with an atomic replace.
+    """
+    def __init__(self, outputPath: str, runKey: Optional[str], seed: Optional[int] = None) -> None:
+        self.manifestPath: str = os.path.join(outputPath, MANIFEST_FILENAME)
+        self.journalPath: str = os.path.join(outputPath, JOURNAL_FILENAME)
+        self.runKey: Optional[str] = runKey
+        self.seed: Optional[int] = seed
+        self.cases: Dict[str, Dict] = {}
+        self.pendingCases: List[tuple] = []
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.manifestPath) as manifestFile:
+                manifest = json.load(manifestFile)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.cases = manifest["cases"]
+        except (OSError, ValueError, KeyError):
+            self.cases = {}
+
+        try:
+            with open(self.journalPath) as journalFile:
+                for line in journalFile:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # line cut by a crash, its case is processed again
+                        logging.warning(f"Ignoring an incomplete entry of {self.journalPath}")
+                        continue
+                    if "removed" in entry:
+                        self.cases.pop(entry["removed"], None)
+                    else:
+                        self.cases[entry["img"]["path"]] = entry
+        except OSError:
+            pass
+
+    def isDone(self, imgPath: str, maskPath: Optional[str]) -> bool:
+        """True if the case has been completed by a run with the same run key, inputs unchanged and outputs still on disk"""
+        entry = self.cases.get(os.path.abspath(imgPath))
+        if self.runKey is None or entry is None or entry["runKey"] != self.runKey:
+            return False
+
+        if entry["img"] != getInputState(imgPath) or entry["mask"] != getInputState(maskPath):
+            return False
+
+        return all(os.path.exists(outputPath) for outputPaths in entry["outputs"].values() for outputPath in outputPaths)
+
+    def appendToJournal(self, entry: Dict) -> None:
+        os.makedirs(os.path.dirname(self.journalPath), exist_ok=True)
+        with open(self.journalPath, "a") as journalFile:
+            journalFile.write(json.dumps(entry) + "\n")
+            journalFile.flush()
+            os.fsync(journalFile.fileno())
+
+    def record(self, imgPath: str, maskPath: Optional[str], outputs: Dict[str, List[str]]) -> None:
+        entry = {"img": getInputState(imgPath), "mask": getInputState(maskPath), "runKey": self.runKey, "seed": self.seed, "outputs": outputs}
+        self.appendToJournal(entry)
+        self.cases[entry["img"]["path"]] = entry
+
+    def invalidate(self, imgPath: str) -> None:
+        """Called before a recorded case is processed again, its outputs are going to be overwritten"""
+        casePath = os.path.abspath(imgPath)
+        if self.cases.pop(casePath, None) is not None:
+            self.appendToJournal({"removed": casePath})
+
+    def recordWhenWritten(self, imgPath: str, maskPath: Optional[str], result) -> None:
+        """Records the case once the writes of its outputs (result.futures) have completed, see commitWritten"""
+        self.pendingCases.append((imgPath, maskPath, result))
+        self.commitWritten()
+
+    def commitWritten(self) -> None:
+        stillPending = []
+        for imgPath, maskPath, result in self.pendingCases:
+            if not all(future.done() for future in result.futures):
+                stillPending.append((imgPath, maskPath, result))
+            elif all(future.exception() is None for future in result.futures):
+                self.record(imgPath, maskPath, result.outputs)
+        self.pendingCases = stillPending
+
+    def compact(self) -> None:
+        """Writes every recorded case to the manifest, atomically, then empties the journal"""
+        os.makedirs(os.path.dirname(self.manifestPath), exist_ok=True)
+
+        tmpPath = f"{self.manifestPath}.tmp"
+        with open(tmpPath, "w") as manifestFile:
+            json.dump({"version": MANIFEST_VERSION, "cases": self.cases}, manifestFile)
+            manifestFile.flush()
+            os.fsync(manifestFile.fileno())
+        os.replace(tmpPath, self.manifestPath)
+
+        if os.path.exists(self.journalPath):
+            os.remove(self.journalPath)
@@ -0,0 +1,320 @@
+"""Out-of-core processing of volumes larger than the memory: the input is memory-mapped and streamed in slabs of slices
+along the first axis of the (D,H,W) array, every slab is transformed and appended to the output file before the next one is read.
+
+Only the transformations in OUT_OF_CORE_TRANSFORMS are supported. The first axis is taken as channel by MONAI, so all of them
+compute every slice on its own (voxel-wise operations, in-plane kernels, in-plane flips, crops and pads): slabs don't need to overlap
+and the result is the same of the whole volume. CenterSpatialCrop and SpatialPad also crop or pad along the slices,
+that part is applied by choosing which input slice goes to each output slice (see getSliceSources).
+ScaleIntensity rescales with the minimum and maximum of the whole volume, they are computed by a first pass over the slabs.
+"""
+import itertools
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from ImageAugmenterLib.ImageAugmenterFusion import fuseTransformations
+from ImageAugmenterLib.ImageAugmenterProfiler import STAGE_DEVICE_TO_HOST, STAGE_HOST_TO_DEVICE, STAGE_READ, STAGE_WRITE, profiler
+from ImageAugmenterLib.ImageAugmenterUtils import VolumeMetadata, getTransformName, DTYPE_KEEP
+
+OUT_OF_CORE_TRANSFORMS = ["ScaleIntensity", "ShiftIntensity", "NormalizeIntensity", "ThresholdIntensity", "MedianSmooth", "GaussianSmooth",
+                          "Flip", "SpatialPad", "BorderPad", "SpatialCrop", "CenterSpatialCrop"]
+# transformations changing the number of slices
+SLICE_AXIS_TRANSFORMS = ["SpatialPad", "CenterSpatialCrop"]
+# pad modes that copy input slices, the others (mean, median, linear_ramp...) need the statistics of the whole volume
+SLICE_PAD_MODES = ["constant", "edge", "reflect", "symmetric", "wrap"]
+DEFAULT_SLAB_SIZE_MB = 256
+
+NRRD_TYPES = {
+    "int8": ["signed char", "int8", "int8_t"],
+    "uint8": ["uchar", "unsigned char", "uint8", "uint8_t"],
+    "int16": ["short", "short int", "signed short", "signed short int", "int16", "int16_t"],
+    "uint16": ["ushort", "unsigned short", "unsigned short int", "uint16", "uint16_t"],
+    "int32": ["int", "signed int", "int32", "int32_t"],
+    "uint32": ["uint", "unsigned int", "uint32", "uint32_t"],
+    "int64": ["longlong", "long long", "long long int", "signed long long", "signed long long int", "int64", "int64_t"],
+    "uint64": ["ulonglong", "unsigned long long", "unsigned long long int", "uint64", "uint64_t"],
+    "float32": ["float"],
+    "float64": ["double"],
+}
+NRRD_TYPE_NAMES = {"float32": "float", "float64": "double"}
+
+
+def readNrrdHeader(path: str) -> Optional[dict]:
+    """Fields of the header of a NRRD file (lower case keys), with "header size" in bytes. None if it's not a NRRD file"""
+    with open(path, "rb") as nrrdFile:
+        if not nrrdFile.readline().startswith(b"NRRD"):
+            return None
+
+        fields = {}
+        while True:
+            line = nrrdFile.readline()
+            # the header ends with an empty line, or with the end of a detached header
+            if not line or not line.strip():
+                break
+            line = line.decode("latin-1").strip()
+            if line.startswith("#"):
+                continue
+            key, separator, value = line.partition(": ")
+            if separator:
+                fields[key.lower()] = value.strip()
+        fields["header size"] = nrrdFile.tell()
+
+    return fields
+
+
+def openRawVolume(path: str) -> Optional[np.memmap]:
+    """Memory-maps the voxels of a 3D NRRD file with raw encoding (attached or detached data) as a read-only (D,H,W) array.
+    None when the file can't be mapped, e.g. compressed data or other formats, the case must then be read in memory.
+    """
+    if not path.lower().endswith((".nrrd", ".nhdr")):
+        return None
+
+    fields = readNrrdHeader(path)
+    if fields is None or fields.get("encoding") != "raw" or fields.get("dimension") != "3" or int(fields.get("line skip", 0)) != 0:
+        return None
+
+    dtypeName = next((name for name, nrrdTypes in NRRD_TYPES.items() if fields.get("type") in nrrdTypes), None)
+    if dtypeName is None:
+        return None
+    dtype = np.dtype(dtypeName).newbyteorder(">" if fields.get("endian") == "big" else "<")
+    width, height, depth = [int(size) for size in fields["sizes"].split()]
+    nbytes = width * height * depth * dtype.itemsize
+
+    dataFile = fields.get("data file", fields.get("datafile"))
+    if dataFile is None:
+        dataPath, offset = path, fields["header size"]
+    elif dataFile.startswith("LIST") or " " in dataFile:
+        # data split in several files
+        return None
+    else:
+        dataPath, offset = os.path.join(os.path.dirname(path), dataFile), 0
+
+    byteSkip = int(fields.get("byte skip", 0))
+    # -1: the data is at the end of the file
+    offset = os.path.getsize(dataPath) - nbytes if byteSkip == -1 else offset + byteSkip
+    return np.memmap(dataPath, dtype=dtype, mode="r", offset=offset, shape=(depth, height, width))
+
+
+class ImageAugmenterSlabWriter():
+    """Writes a 3D NRRD file slab by slab: the header is written first, each slab of slices is appended to the data.
+    The file is written with a temporary name and renamed once complete, an interrupted output is removed.
+    """
+    def __init__(self, filePath: str, shape: tuple, dtype: np.dtype, metadata: VolumeMetadata) -> None:
+        self.filePath: str = filePath
+        self.tmpPath: str = f"{filePath}.tmp"
+        self.shape: tuple = shape
+        self.dtype: np.dtype = np.dtype(dtype).newbyteorder("<")
+        self.writtenSlices: int = 0
+        self.discarded: bool = False
+        self.file = open(self.tmpPath, "wb")
+        self.file.write(self.getHeader(metadata).encode("latin-1"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> None:
+        if excType is None:
+            self.close()
+        else:
+            self.discard()
+
+    def getHeader(self, metadata: VolumeMetadata) -> str:
+        depth, height, width = self.shape
+        # sitk geometry is in LPS, like the NRRD space, the directions are the columns of the direction matrix scaled by the spacing
+        directions = " ".join("(" + ",".join(f"{metadata.direction[row * 3 + column] * metadata.spacing[column]:.17g}" for row in range(3)) + ")"
+                              for column in range(3))
+        origin = ",".join(f"{value:.17g}" for value in metadata.origin)
+        return ("NRRD0004\n"
+                f"type: {NRRD_TYPE_NAMES.get(self.dtype.name, self.dtype.name)}\n"
+                "dimension: 3\n"
+                "space: left-posterior-superior\n"
+                f"sizes: {width} {height} {depth}\n"
+                f"space directions: {directions}\n"
+                "kinds: domain domain domain\n"
+                "endian: little\n"
+                "encoding: raw\n"
+                f"space origin: ({origin})\n"
+                "\n")
+
+    def write(self, slab: np.ndarray) -> None:
+        if slab.shape[1:] != self.shape[1:] or self.writtenSlices + slab.shape[0] > self.shape[0]:
+            raise ValueError(f"Slab of shape {slab.shape} doesn't fit the volume of shape {self.shape} written to {self.filePath}")
+        np.ascontiguousarray(slab, dtype=self.dtype).tofile(self.file)
+        self.writtenSlices += slab.shape[0]
+
+    def close(self) -> None:
+        if self.discarded:
+            return
+        self.file.close()
+        if self.writtenSlices != self.shape[0]:
+            os.remove(self.tmpPath)
+            raise ValueError(f"Only {self.writtenSlices} of {self.shape[0]} slices have been written to {self.filePath}")
+        os.replace(self.tmpPath, self.filePath)
+
+    def discard(self) -> None:
+        self.discarded = True
+        self.file.close()
+        if os.path.exists(self.tmpPath):
+            os.remove(self.tmpPath)
+
+
+def getSliceSources(transform: object, depth: int) -> np.ndarray:
+    """Index of the input slice of every output slice, -1 for slices filled with the pad value.
+    Only CenterSpatialCrop and SpatialPad work along the slices, with the same bounds computed by MONAI.
+    """
+    sources = np.arange(depth)
+    transformName = getTransformName(transform)
+
+    if transformName == "CenterSpatialCrop":
+        size = transform.roi_size[0] if transform.roi_size[0] > 0 else depth
+        start = max(depth // 2 - size // 2, 0)
+        return sources[start:start + size]
+
+    if transformName == "SpatialPad":
+        size = transform.spatial_size[0] if transform.spatial_size[0] > 0 else depth
+        padding = max(size - depth, 0)
+        before = padding // 2 if transform.method == "symmetric" else 0
+        if padding == 0:
+            return sources
+        if transform.mode == "constant":
+            return np.concatenate([np.full(before, -1), sources, np.full(padding - before, -1)])
+        if transform.mode not in SLICE_PAD_MODES:
+            raise ValueError(f"Padding the slices in '{transform.mode}' mode needs the whole volume, "
+                             f"choose one of {', '.join(SLICE_PAD_MODES)} to process it in slabs")
+        return np.pad(sources, (before, padding - before), mode=transform.mode)
+
+    return sources
+
+
+def getSlabTransforms(dataset, transforms: List[object], volume: np.ndarray, slabSlices: int, is_mask: bool = False) -> List[object]:
+    """The transformations applied to every slab: without their effect along the slices (see getSliceSources)
+    and with the statistics of the whole volume, when they use them, computed by a first pass over the slabs.
+    The point-wise ones are fused (see fuseTransformations), ScaleIntensity included once its range is known.
+    """
+    from monai.transforms import CenterSpatialCrop, ScaleIntensityRange, SpatialPad
+
+    slabTransforms = []
+    for transform in transforms:
+        transformName = getTransformName(transform)
+        # a size of 0 keeps the size of the slab (fall back to the input size)
+        if transformName == "CenterSpatialCrop":
+            transform = CenterSpatialCrop(roi_size=(0, *transform.roi_size[1:]))
+        elif transformName == "SpatialPad":
+            transform = SpatialPad(spatial_size=(0, *transform.spatial_size[1:]), method=transform.method, mode=transform.mode, **transform.kwargs)
+        # masks are left unchanged by the intensity transformations, their range isn't needed
+        elif transformName == "ScaleIntensity" and not is_mask and not transform.channel_wise and (transform.minv is not None or transform.maxv is not None):
+            minValue, maxValue = getVolumeRange(dataset, slabTransforms, volume, slabSlices, is_mask)
+            transform = ScaleIntensityRange(a_min=minValue, a_max=maxValue, b_min=transform.minv, b_max=transform.maxv, dtype=transform.dtype)
+        slabTransforms.append(transform)
+
+    return [transform for transform_idx, transform in fuseTransformations(slabTransforms)]
+
+
+def getVolumeRange(dataset, transforms: List[object], volume: np.ndarray, slabSlices: int, is_mask: bool = False) -> Tuple[float, float]:
+    """Minimum and maximum of the whole volume after the transformations"""
+    transforms = [transform for transform_idx, transform in fuseTransformations(transforms)]
+    minValue, maxValue = float("inf"), float("-inf")
+    for start in range(0, volume.shape[0], slabSlices):
+        slab = transformSlab(dataset, transforms, readSlab(dataset, volume, np.arange(start, min(start + slabSlices, volume.shape[0])), is_mask), is_mask)
+        minValue, maxValue = min(minValue, slab.min().item()), max(maxValue, slab.max().item())
+    return minValue, maxValue
+
+
+def getSlabSlices(volume: np.ndarray, slabSizeMB: int) -> int:
+    """Slices per slab, so a slab is about slabSizeMB once converted to float"""
+    sliceBytes = volume.shape[1] * volume.shape[2] * max(volume.dtype.itemsize, 4)
+    return max(1, slabSizeMB * 1024 * 1024 // sliceBytes)
+
+
+def getMaskDtype(volume: np.ndarray, slabSlices: int) -> np.dtype:
+    """Type of a compact mask (see ImageAugmenterDataset.cast_output), chosen before writing from the labels of the whole input"""
+    maxLabel = max(int(volume[start:start + slabSlices].max()) for start in range(0, volume.shape[0], slabSlices))
+    return np.dtype(np.uint8 if maxLabel <= 255 else np.uint16)
+
+
+def toDtype(array: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    if array.dtype == dtype:
+        return array
+    if np.issubdtype(dtype, np.integer):
+        dtypeInfo = np.iinfo(dtype)
+        array = np.clip(np.rint(array), dtypeInfo.min, dtypeInfo.max)
+    return array.astype(dtype)
+
+
+def iterSourceRuns(sources: np.ndarray, slabSlices: int):
+    """Yields the output slices in slabs of at most slabSlices, split in runs of input slices and of pad slices (None)"""
+    for start in range(0, len(sources), slabSlices):
+        for isPad, run in itertools.groupby(sources[start:start + slabSlices], key=lambda source: source < 0):
+            run = np.fromiter(run, dtype=np.int64)
+            yield None if isPad else run, len(run)
+
+
+def transformSlab(dataset, transforms: List[object], slab: torch.Tensor, is_mask: bool = False) -> torch.Tensor:
+    for transform in transforms:
+        transformedList = dataset.apply_transform(transform, slab, [], is_mask=is_mask)
+        slab = transformedList[-1][1]
+    return slab
+
+
+def readSlab(dataset, volume: np.ndarray, sources: np.ndarray, is_mask: bool = False) -> torch.Tensor:
+    with profiler.stage(STAGE_READ):
+        # consecutive slices are read as a single block of the file
+        if len(sources) > 1 and np.all(np.diff(sources) == 1):
+            slab = np.array(volume[sources[0]:sources[-1] + 1])
+        else:
+            slab = np.array(volume[sources])
+        slab = slab.astype(slab.dtype.newbyteorder("="), copy=False)
+    with profiler.stage(STAGE_HOST_TO_DEVICE):
+        slab = torch.from_numpy(slab)
+        return slab.to(device=dataset.device, dtype=dataset.get_mask_dtype(slab) if is_mask else slab.dtype if dataset.dtypePolicy == DTYPE_KEEP else torch.float32)
+
+
+def writeVolumeInSlabs(dataset,
+                       transforms: List[object],
+                       volume: np.ndarray,
+                       metadata: VolumeMetadata,
+                       filePath: str,
+                       slabSizeMB: int = DEFAULT_SLAB_SIZE_MB,
+                       is_mask: bool = False) -> bool:
+    """Applies the transformations (a chain when more than one) to the memory-mapped volume slab by slab, writing every slab to filePath.
+    The outputs have the types of the in-memory processing (see ImageAugmenterDataset.cast_output).
+    A mask is written only when it's not empty, like in memory, returns whether the file has been written.
+    """
+    from ImageAugmenterLib.ImageAugmenterConversion import tensorToArray
+
+    if len(transforms) > 1 and any(getTransformName(transform) in SLICE_AXIS_TRANSFORMS for transform in transforms):
+        raise ValueError("Chained transformations can't crop or pad the slices when processed in slabs")
+
+    sources = getSliceSources(transforms[0], volume.shape[0]) if len(transforms) == 1 else np.arange(volume.shape[0])
+    slabSlices = getSlabSlices(volume, slabSizeMB)
+    slabTransforms = getSlabTransforms(dataset, transforms, volume, slabSlices, is_mask)
+
+    # a single slice gives the in-plane size and the type of the output
+    sample = dataset.cast_output(transformSlab(dataset, slabTransforms, readSlab(dataset, volume, np.arange(1), is_mask), is_mask), metadata, is_mask)
+    dtype = getMaskDtype(volume, slabSlices) if is_mask and dataset.compactMasks else np.dtype(str(sample.dtype).replace("torch.", ""))
+    # masks are padded with the background (see getLabelTransform)
+    padValue = transforms[0].kwargs.get("value", 0) if getTransformName(transforms[0]) == "SpatialPad" and not is_mask else 0
+
+    isEmpty = True
+    with ImageAugmenterSlabWriter(filePath, (len(sources), *sample.shape[1:]), dtype, metadata) as writer:
+        for runSources, runSlices in iterSourceRuns(sources, slabSlices):
+            if runSources is None:
+                slab = torch.full((runSlices, *sample.shape[1:]), float(padValue), device=sample.device)
+            else:
+                slab = transformSlab(dataset, slabTransforms, readSlab(dataset, volume, runSources, is_mask), is_mask)
+            slab = dataset.cast_output(slab, metadata, is_mask)
+            isEmpty = isEmpty and not slab.any()
+
+            with profiler.stage(STAGE_DEVICE_TO_HOST):
+                array = toDtype(tensorToArray(slab), dtype)
+            with profiler.stage(STAGE_WRITE, os.path.basename(filePath)):
+                writer.write(array)
+            del slab, array
+
+        if is_mask and isEmpty:
+            writer.discard()
+            return False
+
+    return True
@@ -0,0 +1,82 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+
+import torch
+
+from ImageAugmenterLib.ImageAugmenterUtils import VolumeMetadata
+
+
+class ImageAugmenterPreviewEntry(NamedTuple):
+    img: torch.Tensor
+    mask: Optional[torch.Tensor]
+    imgMetadata: VolumeMetadata
+    maskMetadata: Optional[VolumeMetadata]
+    nbytes: int
+
+
+def getPreviewOutputKey(caseState: List[Optional[Dict]], region: List, settings: Dict, transformKeys: List[List], sampleIdx: int) -> str:
+    """Identifies a preview output: the state of the image and mask files (see getInputState), the previewed region
+    (downsampling factor or slice), the settings changing the outputs and the key of every transformation computing it.
+    """
+    outputKey = json.dumps({"case": caseState, "region": region, "settings": settings, "transformations": transformKeys, "sample": sampleIdx},
+                           sort_keys=True)
+    return hashlib.sha256(outputKey.encode()).hexdigest()
+
+
+class ImageAugmenterPreviewCache():
+    """LRU cache of the preview outputs, kept on the CPU within maxBytes, the least recently used outputs are dropped first.
+    With maxBytes 0 nothing is cached.
+    The cache owns its tensors: put stores a copy and get returns a copy, because the preview nodes share the memory of the tensors
+    they show (see arrayToVolumeNode) and an edit of the node data in Slicer would otherwise change the cached output.
+    """
+    def __init__(self, maxBytes: int = 0) -> None:
+        self.maxBytes: int = maxBytes
+        self.nbytes: int = 0
+        self.entries: "OrderedDict[str, ImageAugmenterPreviewEntry]" = OrderedDict()
+
+    def setMaxBytes(self, maxBytes: int) -> None:
+        self.maxBytes = maxBytes
+        self.evict()
+
+    def get(self, key: Optional[str]) -> Optional[ImageAugmenterPreviewEntry]:
+        if key is None or key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        entry = self.entries[key]
+        return entry._replace(img=entry.img.clone(), mask=entry.mask.clone() if entry.mask is not None else None)
+
+    def put(self,
+            key: Optional[str],
+            img: torch.Tensor,
+            mask: Optional[torch.Tensor],
+            imgMetadata: VolumeMetadata,
+            maskMetadata: Optional[VolumeMetadata]) -> None:
+        if key is None:
+            return
+
+        nbytes = sum(tensor.element_size() * tensor.nelement() for tensor in (img, mask) if tensor is not None)
+        if nbytes > self.maxBytes:
+            return
+
+        self.pop(key)
+        # copy=True copies CPU tensors too, cpu() would return them as they are
+        self.entries[key] = ImageAugmenterPreviewEntry(img.to(device="cpu", copy=True), mask.to(device="cpu", copy=True) if mask is not None else None,
+                                                       imgMetadata, maskMetadata, nbytes)
+        self.nbytes += nbytes
+        self.evict()
+
+    def pop(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def evict(self) -> None:
+        while self.entries and self.nbytes > self.maxBytes:
+            _, entry = self.entries.popitem(last=False)
+            self.nbytes -= entry.nbytes
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.nbytes = 0
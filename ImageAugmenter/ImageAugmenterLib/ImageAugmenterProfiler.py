@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+STAGE_READ = "read"
+STAGE_HOST_TO_DEVICE = "hostToDevice"
+STAGE_TRANSFORM = "transform"
+STAGE_DEVICE_TO_HOST = "deviceToHost"
+STAGE_CONVERSION = "conversion"
+STAGE_WRITE = "write"
+PROFILE_STAGES = [STAGE_READ, STAGE_HOST_TO_DEVICE, STAGE_TRANSFORM, STAGE_DEVICE_TO_HOST, STAGE_CONVERSION, STAGE_WRITE]
+
+PROFILE_HOOK_NONE = "none"
+PROFILE_HOOK_CPROFILE = "cProfile"
+PROFILE_HOOK_TORCH = "torch"
+PROFILE_HOOKS = [PROFILE_HOOK_NONE, PROFILE_HOOK_CPROFILE, PROFILE_HOOK_TORCH]
+
+TRACE_FILENAME = "imageaugmenter_trace.json"
+# functions of the cProfile statistics written to the log at the end of a run
+PROFILE_LOG_ROWS = 20
+
+# returned by stage() when the timings are off, it's reused so a disabled timer costs a single call
+_NULL_TIMER = nullcontext()
+
+
+class ImageAugmenterTimingEvent(NamedTuple):
+    stage: str # one of PROFILE_STAGES
+    name: str # transformation name for the transform stage, file name for the write stage
+    case: str
+    start: int # perf_counter_ns, the same clock in every process of the machine
+    duration: int # nanoseconds
+    pid: int
+    threadId: int
+
+
+class ImageAugmenterStageTimer():
+    """Times a block of code as a stage of the current case, see ImageAugmenterProfiler.stage"""
+    __slots__ = ("profiler", "stage", "name", "case", "start", "recordFunction")
+
+    def __init__(self, profiler: "ImageAugmenterProfiler", stage: str, name: str, case: str) -> None:
+        self.profiler = profiler
+        self.stage = stage
+        self.name = name
+        self.case = case
+        self.start = 0
+        self.recordFunction = None
+
+    def __enter__(self):
+        if self.profiler.hook == PROFILE_HOOK_TORCH:
+            # labels the block in the torch.profiler trace, to tell the transformations apart
+            import torch
+            self.recordFunction = torch.profiler.record_function(f"{self.stage} {self.name}".strip())
+            self.recordFunction.__enter__()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> None:
+        # GPU kernels are asynchronous, without waiting for them their time would be charged to the next copy to the host
+        if self.profiler.synchronize is not None:
+            self.profiler.synchronize()
+        duration = time.perf_counter_ns() - self.start
+        if self.recordFunction is not None:
+            self.recordFunction.__exit__(excType, excValue, traceback)
+        self.profiler.record(self.stage, self.name, self.case, self.start, duration)
+
+
+class ImageAugmenterProfiler():
+    """Collects the time spent by every case in each stage of the pipeline (see PROFILE_STAGES) and by every transformation.
+    Timings are off by default: stage() then returns a shared no-op context, so the instrumented code runs at full speed.
+    Every process has its own profiler, the worker processes send their events back with the results of their cases (see addEvents).
+    The opt-in hook (cProfile or torch.profiler) runs around the processing of each case, see profileCall.
+    """
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self.hook: str = PROFILE_HOOK_NONE
+        self.outputPath: str = ""
+        self.device: str = "cpu"
+        self.synchronize: Optional[Callable[[], None]] = None
+        self.events: List[ImageAugmenterTimingEvent] = []
+        self.current: threading.local = threading.local()
+        self.cProfiler = None
+
+    def configure(self, enabled: bool = False, hook: str = PROFILE_HOOK_NONE, outputPath: str = "", device: str = "cpu") -> None:
+        """Starts a new run, dropping the collected events. The hook outputs are written to outputPath"""
+        if hook not in PROFILE_HOOKS:
+            raise ValueError(f"Profiler must be one of {', '.join(PROFILE_HOOKS)}")
+
+        self.enabled = enabled
+        self.hook = hook
+        self.outputPath = outputPath
+        self.device = device
+        self.synchronize = None
+        if enabled and device.startswith("cuda"):
+            import torch
+            self.synchronize = torch.cuda.synchronize
+        self.events = []
+        self.cProfiler = None
+
+    def getSettings(self) -> Dict:
+        """Arguments of configure for the worker processes"""
+        return {"enabled": self.enabled, "hook": self.hook, "outputPath": self.outputPath, "device": self.device}
+
+    def setCase(self, case: str) -> None:
+        """Case of the stages timed next by this thread"""
+        self.current.case = case
+
+    def getCase(self) -> str:
+        return getattr(self.current, "case", "")
+
+    def stage(self, stage: str, name: str = "", case: Optional[str] = None):
+        """Context manager timing a stage, of the current case of the thread unless case is given"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return ImageAugmenterStageTimer(self, stage, name, self.getCase() if case is None else case)
+
+    def record(self, stage: str, name: str, case: str, start: int, duration: int) -> None:
+        # list.append is atomic, the writer threads can record without a lock
+        self.events.append(ImageAugmenterTimingEvent(stage, name, case, start, duration, os.getpid(), threading.get_ident()))
+
+    def drainEvents(self) -> List[ImageAugmenterTimingEvent]:
+        events, self.events = self.events, []
+        return events
+
+    def addEvents(self, events: List[ImageAugmenterTimingEvent]) -> None:
+        self.events.extend(events)
+
+    def profileCall(self, name: str, function: Callable, *args, **kwargs):
+        """Calls function(*args, **kwargs) under the opt-in hook, name identifies the call (e.g. the case) in the outputs.
+        cProfile statistics accumulate over the calls of the process, in imageaugmenter_cprofile_<pid>.prof,
+        torch.profiler writes a Chrome trace of every call, in imageaugmenter_torch_<name>.json.
+        """
+        if self.hook == PROFILE_HOOK_CPROFILE:
+            import cProfile
+
+            if self.cProfiler is None:
+                self.cProfiler = cProfile.Profile()
+            self.cProfiler.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.cProfiler.disable()
+                # workers have no end of the run, the statistics are saved after every call
+                self.cProfiler.dump_stats(self.getOutputFilePath(f"imageaugmenter_cprofile_{os.getpid()}.prof"))
+
+        if self.hook == PROFILE_HOOK_TORCH:
+            import torch
+
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.device.startswith("cuda"):
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            with torch.profiler.profile(activities=activities) as torchProfiler:
+                result = function(*args, **kwargs)
+            torchProfiler.export_chrome_trace(self.getOutputFilePath(f"imageaugmenter_torch_{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.json"))
+            return result
+
+        return function(*args, **kwargs)
+
+    def getOutputFilePath(self, fileName: str) -> str:
+        os.makedirs(self.outputPath or ".", exist_ok=True)
+        return os.path.join(self.outputPath, fileName)
+
+    def getSummary(self) -> List[Dict]:
+        """Rows of the timings table: one per stage, followed by one per transformation, with calls, total seconds,
+        mean milliseconds and share of the timed time
+        """
+        totals = {}
+        for event in self.events:
+            for key in ((event.stage, ""), (event.stage, event.name)) if event.stage == STAGE_TRANSFORM else ((event.stage, ""),):
+                calls, duration = totals.get(key, (0, 0))
+                totals[key] = (calls + 1, duration + event.duration)
+
+        timedTime = sum(duration for (stage, name), (calls, duration) in totals.items() if not name) or 1
+        rows = []
+        for stage, name in sorted(totals, key=lambda key: (key[1] != "", PROFILE_STAGES.index(key[0]) if key[0] in PROFILE_STAGES else len(PROFILE_STAGES), key[1])):
+            calls, duration = totals[(stage, name)]
+            rows.append({"stage": stage,
+                         "name": name,
+                         "calls": calls,
+                         "seconds": duration / 1e9,
+                         "meanMs": duration / calls / 1e6,
+                         "share": duration / timedTime})
+        return rows
+
+    def getCaseSummary(self) -> Dict[str, Dict[str, float]]:
+        """Seconds spent by every case in each stage"""
+        cases = {}
+        for event in self.events:
+            stages = cases.setdefault(event.case, {})
+            stages[event.stage] = stages.get(event.stage, 0.0) + event.duration / 1e9
+        return cases
+
+    def logSummary(self) -> None:
+        if not self.enabled or not self.events:
+            return
+
+        lines = [f"{'Stage':<14}{'Transformation':<28}{'Calls':>8}{'Total (s)':>12}{'Mean (ms)':>12}{'Share':>8}"]
+        for row in self.getSummary():
+            lines.append(f"{row['stage']:<14}{row['name']:<28}{row['calls']:>8}{row['seconds']:>12.3f}{row['meanMs']:>12.2f}{row['share']:>8.1%}")
+        logging.info("Stage timings:\n" + "\n".join(lines))
+
+        for case, stages in self.getCaseSummary().items():
+            logging.debug(f"Timings of {case}: " + ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in stages.items()))
+
+        if self.cProfiler is not None:
+            import io
+            import pstats
+
+            stats = io.StringIO()
+            pstats.Stats(self.cProfiler, stream=stats).sort_stats("cumulative").print_stats(PROFILE_LOG_ROWS)
+            logging.info(f"cProfile statistics of the main process:\n{stats.getvalue()}")
+
+    def exportTrace(self, tracePath: str) -> None:
+        """Writes the events in the Chrome trace format (chrome://tracing, Perfetto), the summaries are stored in otherData"""
+        startTime = min((event.start for event in self.events), default=0)
+        traceEvents = [{"name": event.name or event.stage,
+                        "cat": event.stage,
+                        "ph": "X",
+                        "ts": (event.start - startTime) / 1e3,
+                        "dur": event.duration / 1e3,
+                        "pid": event.pid,
+                        "tid": event.threadId,
+                        "args": {"case": event.case}} for event in self.events]
+        trace = {"traceEvents": traceEvents,
+                 "displayTimeUnit": "ms",
+                 "otherData": {"summary": self.getSummary(), "cases": self.getCaseSummary()}}
+
+        tmpPath = f"{tracePath}.tmp"
+        with open(tmpPath, "w") as traceFile:
+            json.dump(trace, traceFile)
+        os.replace(tmpPath, tracePath)
+
+
+profiler = ImageAugmenterProfiler()
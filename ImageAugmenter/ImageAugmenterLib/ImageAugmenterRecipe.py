@@ -0,0 +1,88 @@
+import copy
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+RECIPE_VERSION = 1
+MAX_COMPILED_RECIPES = 8
+
+# recipe hash -> (recipe entry names, compiled MONAI transformations), most recently used last
+_compiledRecipes: "OrderedDict[str, Tuple[List[str], List[object]]]" = OrderedDict()
+
+
+def createRecipe(transformations: Dict[str, Dict]) -> Dict:
+    """A recipe is the transformations dictionary of the controllers (see getTransformations) with a format version"""
+    return {"version": RECIPE_VERSION, "transformations": transformations}
+
+
+def getRecipeHash(recipe: Dict) -> str:
+    # tuples and lists give the same hash, like after a save and load
+    canonicalRecipe = json.dumps(recipe, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonicalRecipe.encode()).hexdigest()
+
+
+def validateRecipe(recipe: Dict) -> None:
+    if not isinstance(recipe, dict) or not isinstance(recipe.get("transformations"), dict):
+        raise ValueError("The recipe is invalid, it must contain a 'transformations' dictionary")
+    if recipe.get("version") != RECIPE_VERSION:
+        raise ValueError(f"Recipe version {recipe.get('version')} is not supported, expected version {RECIPE_VERSION}")
+
+
+def saveRecipe(recipe: Dict, recipePath: str) -> None:
+    validateRecipe(recipe)
+    tmpPath = f"{recipePath}.tmp"
+    with open(tmpPath, "w") as recipeFile:
+        json.dump(recipe, recipeFile, indent=2)
+    os.replace(tmpPath, recipePath)
+
+
+def loadRecipe(recipePath: str) -> Dict:
+    with open(recipePath) as recipeFile:
+        try:
+            recipe = json.load(recipeFile)
+        except ValueError as e:
+            raise ValueError(f"{recipePath} is not a valid recipe: {e}")
+
+    validateRecipe(recipe)
+    return recipe
+
+
+def getCompiledRecipe(recipe: Dict) -> Tuple[List[str], List[object]]:
+    """Names of the recipe entries (e.g. "rotate") and MONAI transformations compiled from them, in the same order.
+    The recipe is parsed only when its hash has not been compiled recently. The cached transformations are never used directly,
+    see compileRecipe.
+    """
+    from ImageAugmenterLib.ImageAugmenterTransformationParser import ImageAugmenterTransformationParser
+
+    validateRecipe(recipe)
+    recipeHash = getRecipeHash(recipe)
+
+    if recipeHash in _compiledRecipes:
+        _compiledRecipes.move_to_end(recipeHash)
+    else:
+        parser = ImageAugmenterTransformationParser(transformations=recipe["transformations"])
+        transformations = parser.mapTransformations()
+        _compiledRecipes[recipeHash] = (parser.transformationNames, transformations)
+        if len(_compiledRecipes) > MAX_COMPILED_RECIPES:
+            _compiledRecipes.popitem(last=False)
+
+    return _compiledRecipes[recipeHash]
+
+
+def getTransformationKeys(recipe: Dict) -> List[str]:
+    """Hash of the parameters of the recipe entry each transformation of compileRecipe(recipe) is compiled from, in the same order.
+    Changing one entry changes only the keys of its transformations.
+    """
+    names, _ = getCompiledRecipe(recipe)
+    return [getRecipeHash(createRecipe({name: recipe["transformations"][name]})) for name in names]
+
+
+def compileRecipe(recipe: Dict) -> List[object]:
+    """Returns new MONAI transformations of the recipe, the parsing is cached (see getCompiledRecipe).
+    Every call gets its own copies: the transformations have a state (random state, seeding, lazy resampling flags),
+    a run or a preview must not change the transformations of another one.
+    """
+    _, transformations = getCompiledRecipe(recipe)
+    return copy.deepcopy(transformations)
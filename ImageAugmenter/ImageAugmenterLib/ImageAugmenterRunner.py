@@ -0,0 +1,260 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing.context import BaseContext
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
+from ImageAugmenterLib.ImageAugmenterOutOfCore import DEFAULT_SLAB_SIZE_MB, openRawVolume, writeVolumeInSlabs
+from ImageAugmenterLib.ImageAugmenterProfiler import ImageAugmenterTimingEvent, profiler
+from ImageAugmenterLib.ImageAugmenterUtils import (
+    getCaseId,
+    getCaseName,
+    getOutputFilePath,
+    makeDir,
+    readImageMetadata,
+    save,
+    splitFilenameAndExtension,
+)
+from ImageAugmenterLib.ImageAugmenterValidator import getSizeMismatch
+from ImageAugmenterLib.ImageAugmenterWriter import ImageAugmenterWriter
+
+class ImageAugmenterCaseResult(NamedTuple):
+    caseName: str
+    outputs: Dict[str, List[str]] # transform name -> output files
+    futures: List[Future] # writes still pending when the case processor returned
+    error: Optional[str] = None # why the case has not been processed, e.g. a mask of a different size (see getSizeMismatch)
+
+
+# Case processor and writer of the current worker process, set once by the pool initializer
+_workerCaseProcessor = None
+_workerWriter = None
+
+
+class ImageAugmenterCaseProcessor():
+    """Loads, transforms and saves a single case of the dataset.
+    The object is sent once to every worker process, so it must stay picklable.
+    """
+    def __init__(self,
+                 dataset: ImageAugmenterDataset,
+                 outputPath: str,
+                 imgPrefix: str,
+                 maskPrefix: str,
+                 isImgPrefixRegex: bool,
+                 isMaskPrefixRegex: bool,
+                 filesStructure: str,
+                 outOfCore: bool = False,
+                 slabSize: int = DEFAULT_SLAB_SIZE_MB) -> None:
+        self.dataset: ImageAugmenterDataset = dataset
+        self.outputPath: str = outputPath
+        self.imgPrefix: str = imgPrefix
+        self.maskPrefix: str = maskPrefix
+        self.isImgPrefixRegex: bool = isImgPrefixRegex
+        self.isMaskPrefixRegex: bool = isMaskPrefixRegex
+        self.filesStructure: str = filesStructure
+        # memory-mappable cases are streamed in slabs of about slabSize MB instead of being loaded, see ImageAugmenterOutOfCore
+        self.outOfCore: bool = outOfCore
+        self.slabSize: int = slabSize
+
+    def __call__(self, imgPath: str, maskPath: Optional[str], writer: Optional[ImageAugmenterWriter] = None) -> ImageAugmenterCaseResult:
+        """Returns the name and the output files of the processed case, its files are queued on the writer.
+        The stages of the case are timed under its name, the opt-in profiler hook runs around the whole case.
+        """
+        caseName = getCaseName(imgPath, self.filesStructure)
+        profiler.setCase(caseName)
+        return profiler.profileCall(caseName, self.processCase, imgPath, maskPath, caseName, writer)
+
+    def processCase(self, imgPath: str, maskPath: Optional[str], caseName: str, writer: Optional[ImageAugmenterWriter] = None) -> ImageAugmenterCaseResult:
+        if self.outOfCore:
+            imgVolume = openRawVolume(imgPath)
+            maskVolume = openRawVolume(maskPath) if maskPath else None
+            if imgVolume is not None and (not maskPath or maskVolume is not None):
+                return self.processCaseInSlabs(imgPath, maskPath, caseName, imgVolume, maskVolume)
+            logging.info(f"{caseName} is not a raw NRRD and can't be memory-mapped, it's processed in memory")
+
+        img, mask, imgMetadata, maskMetadata = self.dataset.load_case_paths(imgPath, maskPath)
+        # checked here on the loaded case, the scan doesn't read the headers
+        sizeMismatch = getSizeMismatch(imgPath, imgMetadata.size, maskPath, maskMetadata.size) if imgMetadata and maskMetadata else None
+        if sizeMismatch:
+            return ImageAugmenterCaseResult(caseName=caseName, outputs={}, futures=[], error=sizeMismatch)
+
+        imgName, imgExtension = splitFilenameAndExtension(imgPath, self.imgPrefix, self.isImgPrefixRegex)
+        if maskPath:
+            maskName, maskExtension = splitFilenameAndExtension(maskPath, self.maskPrefix, self.isMaskPrefixRegex)
+
+        result = ImageAugmenterCaseResult(caseName=caseName, outputs={}, futures=[])
+
+        # every output is handed to the writer and released before the next one is computed
+        for transformName, transformedImg, transformedMask in self.dataset.iter_transformed(img, mask, imgMetadata, maskMetadata, getCaseId(imgPath)):
+            currentDir = makeDir(self.outputPath, caseName, transformName)
+            extension = imgExtension if imgExtension else "nrrd"
+            result.outputs[transformName] = [getOutputFilePath(currentDir, imgName, extension)]
+            result.futures.append(save(img=transformedImg, path=currentDir,
+                                       filename=imgName,
+                                       metadata=imgMetadata,
+                                       extension=extension,
+                                       writer=writer))
+
+            if maskMetadata and transformedMask is not None:
+                extension = maskExtension if maskExtension else "nrrd"
+                result.outputs[transformName].append(getOutputFilePath(currentDir, maskName, extension))
+                result.futures.append(save(img=transformedMask, path=currentDir,
+                                           filename=maskName,
+                                           metadata=maskMetadata,
+                                           extension=extension,
+                                           writer=writer))
+
+            del transformedImg, transformedMask
+
+        # synchronous writes have no future
+        result.futures[:] = [future for future in result.futures if future is not None]
+        return result
+
+    def processCaseInSlabs(self, imgPath: str, maskPath: Optional[str], caseName: str, imgVolume, maskVolume) -> ImageAugmenterCaseResult:
+        """Streams the memory-mapped image and mask through every output, the outputs are written slab by slab as NRRD files"""
+        imgMetadata = readImageMetadata(imgPath)
+        maskMetadata = readImageMetadata(maskPath) if maskPath else None
+        sizeMismatch = getSizeMismatch(imgPath, imgMetadata.size, maskPath, maskMetadata.size) if maskMetadata else None
+        if sizeMismatch:
+            return ImageAugmenterCaseResult(caseName=caseName, outputs={}, futures=[], error=sizeMismatch)
+        imgName = splitFilenameAndExtension(imgPath, self.imgPrefix, self.isImgPrefixRegex)[0]
+        if maskPath:
+            maskName = splitFilenameAndExtension(maskPath, self.maskPrefix, self.isMaskPrefixRegex)[0]
+
+        result = ImageAugmenterCaseResult(caseName=caseName, outputs={}, futures=[])
+        for outputName, transformIndices, _ in self.dataset.list_outputs():
+            transforms = [self.dataset.transformations[transformIdx] for transformIdx in transformIndices]
+            currentDir = makeDir(self.outputPath, caseName, outputName)
+            imgFilePath = getOutputFilePath(currentDir, imgName, ".nrrd")
+            writeVolumeInSlabs(self.dataset, transforms, imgVolume, imgMetadata, imgFilePath, self.slabSize)
+            result.outputs[outputName] = [imgFilePath]
+
+            if maskVolume is not None:
+                maskFilePath = getOutputFilePath(currentDir, maskName, ".nrrd")
+                if writeVolumeInSlabs(self.dataset, transforms, maskVolume, maskMetadata, maskFilePath, self.slabSize, is_mask=True):
+                    result.outputs[outputName].append(maskFilePath)
+
+        return result
+
+
+def isSingleThreaded() -> bool:
+    """Whether the process runs a single thread, Python or native (torch and OpenMP pools, Qt), so it can be forked safely.
+    Native threads are counted on Linux only, elsewhere the process is assumed multithreaded.
+    """
+    if threading.current_thread() is not threading.main_thread() or threading.active_count() > 1:
+        return False
+    try:
+        return len(os.listdir("/proc/self/task")) == 1
+    except OSError:
+        return False
+
+
+def getWorkerContext() -> BaseContext:
+    """Worker processes are forked only from a single-threaded process, so they inherit the already imported modules:
+    a child forked from a multithreaded process (e.g. the background job thread of Slicer, see ImageAugmenterJob) can deadlock
+    on the locks other threads held, like the ones of the torch thread pool or of the writer.
+    Otherwise they are started by a fork server (POSIX) or spawned, inside Slicer with PythonSlicer instead of the application executable.
+    """
+    startMethods = multiprocessing.get_all_start_methods()
+    if "fork" in startMethods and isSingleThreaded():
+        return multiprocessing.get_context("fork")
+
+    return getFreshInterpreterContext("forkserver" if "forkserver" in startMethods else "spawn")
+
+
+def getFreshInterpreterContext(startMethod: str = "spawn") -> BaseContext:
+    """Context of workers running in a new interpreter (spawn or forkserver), which imports the modules again.
+    Inside Slicer the interpreter is PythonSlicer, the application executable can't run them.
+    """
+    context = multiprocessing.get_context(startMethod)
+    pythonSlicer = shutil.which("PythonSlicer", path=os.path.dirname(sys.executable))
+    if pythonSlicer:
+        context.set_executable(pythonSlicer)
+    return context
+
+
+def _initWorker(caseProcessor: ImageAugmenterCaseProcessor, numThreads: int, writerThreads: int, maxPendingWrites: int, profilerSettings: Dict) -> None:
+    import torch
+
+    global _workerCaseProcessor, _workerWriter
+    _workerCaseProcessor = caseProcessor
+    _workerWriter = ImageAugmenterWriter(maxWorkers=writerThreads, maxPending=maxPendingWrites)
+    profiler.configure(**profilerSettings)
+    # avoid oversubscribing the CPU, every worker gets its share of the intra-op threads
+    torch.set_num_threads(numThreads)
+
+
+def _runWorkerCase(imgPath: str, maskPath: Optional[str]) -> Tuple[ImageAugmenterCaseResult, int, int, List[ImageAugmenterTimingEvent]]:
+    writtenFiles, writtenBytes = _workerWriter.writtenFiles, _workerWriter.writtenBytes
+    result = _workerCaseProcessor(imgPath, maskPath, _workerWriter)
+    # a case is reported as done only once its files are on disk
+    _workerWriter.flush()
+    # the timings of the case, writes included, are collected by the profiler of the main process
+    return (result._replace(futures=[]), _workerWriter.writtenFiles - writtenFiles, _workerWriter.writtenBytes - writtenBytes,
+            profiler.drainEvents())
+
+
+def runCases(caseProcessor: ImageAugmenterCaseProcessor,
+             cases: Iterable[Tuple[str, Optional[str]]],
+             writer: ImageAugmenterWriter,
+             numWorkers: int = 1,
+             onCaseDone: Optional[Callable[[int, str, Optional[str], ImageAugmenterCaseResult], None]] = None,
+             checkpoint: Optional[Callable[[], None]] = None,
+             context: Optional[BaseContext] = None) -> None:
+    """Runs the case processor on every (imgPath, maskPath) pair, cases can be consumed while they're still being found.
+    onCaseDone(caseIdx, imgPath, maskPath, result) is called for every processed case, its writes may still be pending (result.futures).
+    With more than one worker the cases are processed by a pool of processes and onCaseDone is called in the order the cases finish,
+    once their files are on disk. Every worker writes with its own writer configured like the given one.
+    At most two cases per worker are queued at any time.
+    checkpoint is called before starting each case, it can block (pause) or raise to stop the run (see ImageAugmenterJobControl).
+    The first failing case stops the run and its exception is raised. The caller is responsible for flushing the writer.
+    context is the multiprocessing context of the workers, getWorkerContext by default.
+    """
+    if numWorkers <= 1:
+        for caseIdx, (imgPath, maskPath) in enumerate(cases):
+            if checkpoint:
+                checkpoint()
+            result = caseProcessor(imgPath, maskPath, writer)
+            if onCaseDone:
+                onCaseDone(caseIdx, imgPath, maskPath, result)
+        return
+
+    numThreads = max(1, (os.cpu_count() or 1) // numWorkers)
+    executor = ProcessPoolExecutor(max_workers=numWorkers,
+                                   mp_context=context or getWorkerContext(),
+                                   initializer=_initWorker,
+                                   initargs=(caseProcessor, numThreads, writer.maxWorkers, writer.maxPending, profiler.getSettings()))
+    pending = {}
+
+    def collectDone(returnWhen: str) -> None:
+        done, _ = wait(pending, return_when=returnWhen)
+        for future in done:
+            caseIdx, imgPath, maskPath = pending.pop(future)
+            result, writtenFiles, writtenBytes, timingEvents = future.result()
+            writer.addWritten(writtenFiles, writtenBytes)
+            profiler.addEvents(timingEvents)
+            if onCaseDone:
+                onCaseDone(caseIdx, imgPath, maskPath, result)
+
+    try:
+        for caseIdx, (imgPath, maskPath) in enumerate(cases):
+            if checkpoint:
+                checkpoint()
+            pending[executor.submit(_runWorkerCase, imgPath, maskPath)] = (caseIdx, imgPath, maskPath)
+            if len(pending) >= 2 * numWorkers:
+                collectDone(FIRST_COMPLETED)
+
+        while pending:
+            collectDone(FIRST_COMPLETED)
+    except BaseException:
+        # the cases not started yet are dropped (shutdown has cancel_futures only from Python 3.9)
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        raise
+
+    executor.shutdown(wait=True)
@@ -0,0 +1,278 @@
+import json
+import os
+import re
+from typing import Dict, Iterator, List, Optional, Pattern, Set, Tuple
+
+SCAN_CACHE_VERSION = 1
+MAX_REPORTED_FILES = 20
+CASE_KEY_GROUP = "case" # regex named group holding the case key, e.g. ^CT_(?P<case>\d+)
+
+
+class ImageAugmenterScanCache():
+    """On-disk listing of the input tree, one entry per directory with its mtime, files and subdirectories.
+    A directory is listed again only when its mtime changes (a file or subdirectory was added, removed or renamed),
+    so scanning an unchanged tree costs one stat per directory.
+    """
+    def __init__(self, cachePath: str, rootPath: str) -> None:
+        self.cachePath: str = cachePath
+        self.rootPath: str = os.path.abspath(rootPath)
+        self.directories: Dict[str, Dict] = {}
+        self.visitedDirectories: Dict[str, Dict] = {}
+
+        try:
+            with open(cachePath) as cacheFile:
+                cache = json.load(cacheFile)
+            if cache.get("version") == SCAN_CACHE_VERSION and cache.get("root") == self.rootPath:
+                self.directories = cache["directories"]
+        except (OSError, ValueError, KeyError):
+            # missing or corrupted cache, the tree is listed from scratch
+            self.directories = {}
+
+    def get(self, dirPath: str, mtime: int) -> Optional[Dict]:
+        entry = self.directories.get(dirPath)
+        return entry if entry is not None and entry["mtime"] == mtime else None
+
+    def visit(self, dirPath: str, entry: Dict) -> None:
+        self.visitedDirectories[dirPath] = entry
+
+    def save(self) -> None:
+        """Writes the directories seen by the last scan, removed directories are dropped"""
+        os.makedirs(os.path.dirname(self.cachePath) or ".", exist_ok=True)
+        tmpPath = f"{self.cachePath}.tmp"
+        with open(tmpPath, "w") as cacheFile:
+            json.dump({"version": SCAN_CACHE_VERSION, "root": self.rootPath, "directories": self.visitedDirectories}, cacheFile)
+        os.replace(tmpPath, self.cachePath)
+
+
+def iterDirectories(rootPath: str, cache: Optional[ImageAugmenterScanCache] = None) -> Iterator[Tuple[str, List[str]]]:
+    """Yields (dirPath, fileNames) for every directory of the tree, depth first and in name order, listing them with os.scandir.
+    Hidden files are skipped, symbolic links to directories are not followed (like os.walk).
+    """
+    stack = [rootPath]
+    while stack:
+        dirPath = stack.pop()
+        mtime = os.stat(dirPath).st_mtime_ns
+        entry = cache.get(dirPath, mtime) if cache else None
+
+        if entry is None:
+            files, dirs = [], []
+            with os.scandir(dirPath) as dirEntries:
+                for dirEntry in dirEntries:
+                    if dirEntry.is_dir():
+                        if not dirEntry.is_symlink():
+                            dirs.append(dirEntry.name)
+                    elif not dirEntry.name.startswith("."):
+                        files.append(dirEntry.name)
+            entry = {"mtime": mtime, "files": sorted(files), "dirs": sorted(dirs)}
+
+        if cache:
+            cache.visit(dirPath, entry)
+
+        yield dirPath, entry["files"]
+        stack.extend(os.path.join(dirPath, subDir) for subDir in reversed(entry["dirs"]))
+
+
+class ImageAugmenterPairingIndex():
+    """Pairs images and masks by case key instead of by position.
+    The key of a file is its directory (the case name of the hierarchical structure) plus its name without extension
+    and without the prefix, e.g. img_001.nrrd and mask_001.nii.gz both give "_001".
+    With a regex the named group "case" is the key when the pattern has it, otherwise the matched text is removed.
+    When nothing is left, e.g. img.nrrd with the prefix img, the name without extension is the key.
+    When a directory holds a single image and a single mask they're paired even if their keys differ, as in .../CaseID/img, .../CaseID/mask.
+    Images and masks can also be in separate trees, e.g. imagesTr/labelsTr or images/CaseID, masks/CaseID (see pairSplitDirectory).
+    Files without a counterpart are recorded in unmatchedImages/unmatchedMasks, files sharing a key in ambiguousFiles.
+    """
+    def __init__(self, imgPrefix: str, maskPrefix: str, imgPattern: Optional[Pattern] = None, maskPattern: Optional[Pattern] = None) -> None:
+        self.imgPrefix: str = imgPrefix
+        self.maskPrefix: str = maskPrefix
+        self.imgPattern: Optional[Pattern] = imgPattern
+        self.maskPattern: Optional[Pattern] = maskPattern
+        self.unmatchedImages: List[str] = []
+        self.unmatchedMasks: List[str] = []
+        self.ambiguousFiles: List[str] = []
+        # directories holding only images (index 0) or only masks (index 1) waiting for their counterpart,
+        # dirPath -> (fileNames, caseKeys) and tree key -> dirPaths (dicts keep the listing order)
+        self.pendingDirs: Tuple[Dict[str, Tuple[List[str], Set[str]]], ...] = ({}, {})
+        self.pendingTreeKeys: Tuple[Dict[str, Dict[str, None]], ...] = ({}, {})
+
+    @staticmethod
+    def getCaseKey(fileName: str, prefix: str, pattern: Optional[Pattern] = None) -> str:
+        stem = fileName[:-7] if fileName.endswith(".nii.gz") else os.path.splitext(fileName)[0]
+        extension = fileName[len(stem):]
+        if pattern:
+            match = pattern.search(fileName)
+            if match and match.groupdict().get(CASE_KEY_GROUP):
+                return match.group(CASE_KEY_GROUP)
+            key = fileName[:match.start()] + fileName[match.end():] if match else fileName
+        else:
+            key = fileName.replace(prefix, "", 1)
+
+        if extension and key.endswith(extension):
+            key = key[:-len(extension)]
+        # a prefix or a pattern matching the whole name leaves no key, e.g. ^img\d+\.nrrd$, the name itself is the key then
+        return key or stem
+
+    def indexFiles(self, dirPath: str, fileNames: List[str], prefix: str, pattern: Optional[Pattern]) -> Dict[str, str]:
+        index, ambiguousKeys = {}, {}
+        for fileName in fileNames:
+            key = self.getCaseKey(fileName, prefix, pattern)
+            if key in ambiguousKeys:
+                ambiguousKeys[key].append(os.path.join(dirPath, fileName))
+            elif key in index:
+                ambiguousKeys[key] = [index.pop(key), os.path.join(dirPath, fileName)]
+            else:
+                index[key] = os.path.join(dirPath, fileName)
+
+        # none of the files sharing a key can be paired safely
+        for files in ambiguousKeys.values():
+            self.ambiguousFiles.extend(files)
+        return index
+
+    def pairDirectory(self, dirPath: str, imgNames: List[str], maskNames: List[str], maskDirPath: Optional[str] = None) -> List[Tuple[str, str]]:
+        """Returns the (imgPath, maskPath) pairs of a directory in image name order, hashing keeps it linear in the number of files.
+        The masks are in maskDirPath when it's not the directory of the images.
+        """
+        imgsIndex = self.indexFiles(dirPath, imgNames, self.imgPrefix, self.imgPattern)
+        masksIndex = self.indexFiles(maskDirPath or dirPath, maskNames, self.maskPrefix, self.maskPattern)
+
+        if len(imgsIndex) == 1 and len(masksIndex) == 1:
+            return [(next(iter(imgsIndex.values())), next(iter(masksIndex.values())))]
+
+        pairs = []
+        for key, imgPath in imgsIndex.items():
+            maskPath = masksIndex.pop(key, None)
+            if maskPath is None:
+                self.unmatchedImages.append(imgPath)
+            else:
+                pairs.append((imgPath, maskPath))
+        self.unmatchedMasks.extend(masksIndex.values())
+
+        return pairs
+
+    @staticmethod
+    def getTreeKeys(rootPath: str, dirPath: str) -> List[str]:
+        """The relative path of dirPath with each of its directories left out in turn, one of them being the image or mask root:
+        images/case1 gives ["case1", "images"], imagesTr gives [""]
+        """
+        relativePath = os.path.relpath(dirPath, rootPath)
+        parts = [] if relativePath == os.curdir else relativePath.split(os.sep)
+        if not parts:
+            return [""]
+        return [os.sep.join(parts[:idx] + parts[idx + 1:]) for idx in range(len(parts))]
+
+    def pairSplitDirectory(self, rootPath: str, dirPath: str, fileNames: List[str], isMaskDir: bool) -> List[Tuple[str, str]]:
+        """Pairs a directory holding only images (or only masks) with the directory of the other tree at the same path relative
+        to its root, e.g. imagesTr with labelsTr or images/case1 with masks/case1. Directories that are only told apart
+        by their root (imagesTr, imagesTs, labelsTr) must share a case key, the one sharing the most is used.
+        Returns [] until the counterpart has been listed, the directories still waiting are collected by popPendingFiles.
+        """
+        side, otherSide = int(isMaskDir), int(not isMaskDir)
+        prefix, pattern = (self.maskPrefix, self.maskPattern) if isMaskDir else (self.imgPrefix, self.imgPattern)
+        caseKeys = {self.getCaseKey(fileName, prefix, pattern) for fileName in fileNames}
+        treeKeys = self.getTreeKeys(rootPath, dirPath)
+
+        counterpart, sharedKeys = None, 0
+        for treeKey in treeKeys:
+            for otherDirPath in self.pendingTreeKeys[otherSide].get(treeKey, {}):
+                otherSharedKeys = len(caseKeys & self.pendingDirs[otherSide][otherDirPath][1])
+                # a case directory (case1) identifies the case, a bare root (imagesTr) doesn't
+                if (otherSharedKeys or treeKey) and (counterpart is None or otherSharedKeys > sharedKeys):
+                    counterpart, sharedKeys = otherDirPath, otherSharedKeys
+
+        if counterpart is None:
+            self.pendingDirs[side][dirPath] = (fileNames, caseKeys)
+            for treeKey in treeKeys:
+                self.pendingTreeKeys[side].setdefault(treeKey, {})[dirPath] = None
+            return []
+
+        otherFileNames = self.pendingDirs[otherSide].pop(counterpart)[0]
+        for treeKey in self.getTreeKeys(rootPath, counterpart):
+            del self.pendingTreeKeys[otherSide][treeKey][counterpart]
+        if isMaskDir:
+            return self.pairDirectory(counterpart, otherFileNames, fileNames, maskDirPath=dirPath)
+        return self.pairDirectory(dirPath, fileNames, otherFileNames, maskDirPath=counterpart)
+
+    def popPendingFiles(self, isMaskDir: bool) -> List[str]:
+        """Paths of the files in the directories still waiting for their counterpart, which won't be paired anymore"""
+        pendingDirs = self.pendingDirs[int(isMaskDir)]
+        files = [os.path.join(dirPath, fileName) for dirPath, (fileNames, caseKeys) in pendingDirs.items() for fileName in fileNames]
+        pendingDirs.clear()
+        self.pendingTreeKeys[int(isMaskDir)].clear()
+        return files
+
+    def hasErrors(self) -> bool:
+        return bool(self.unmatchedImages or self.unmatchedMasks or self.ambiguousFiles)
+
+    def getReport(self) -> str:
+        report = []
+        for title, files in (("images without a mask", self.unmatchedImages),
+                             ("masks without an image", self.unmatchedMasks),
+                             ("files with the same case key as another one", self.ambiguousFiles)):
+            if files:
+                report.append(f"{len(files)} {title}:")
+                report.extend(files[:MAX_REPORTED_FILES])
+                if len(files) > MAX_REPORTED_FILES:
+                    report.append(f"... and {len(files) - MAX_REPORTED_FILES} more")
+        return "\n".join(report)
+
+    def getError(self) -> ValueError:
+        return ValueError(f"Some images and masks could not be paired:\n{self.getReport()}\nMake sure you have specified the correct prefixes to avoid inconsistencies.")
+
+
+def getPairingIndex(imgPrefix: str, maskPrefix: str, isImgPrefixRegex: bool, isMaskPrefixRegex: bool) -> ImageAugmenterPairingIndex:
+    # Regex compiled only if the flags are active, otherwise use the prefix
+    imgPattern = re.compile(imgPrefix) if isImgPrefixRegex else None
+    maskPattern = re.compile(maskPrefix) if isMaskPrefixRegex else None
+    return ImageAugmenterPairingIndex(imgPrefix, maskPrefix, imgPattern, maskPattern)
+
+
+def scanImagesAndMasks(imagesInputPath: str,
+                       imgPrefix: str,
+                       maskPrefix: str,
+                       isImgPrefixRegex: bool,
+                       isMaskPrefixRegex: bool,
+                       cachePath: Optional[str] = None,
+                       pairingIndex: Optional[ImageAugmenterPairingIndex] = None) -> Iterator[Tuple[str, Optional[str]]]:
+    """Yields (imgPath, maskPath) as soon as the directory containing them has been listed, maskPath is None when no masks are used.
+    Images and masks are paired by case key (see ImageAugmenterPairingIndex), every directory is paired when it's listed, or once
+    its counterpart is listed when images and masks are in separate trees. The files that can't be paired are never yielded. With a pairingIndex they're left in it, so the caller can process the pairs
+    and report them at the end, otherwise a ValueError lists them all once the scan is over.
+    """
+    raiseErrors = pairingIndex is None
+    pairingIndex = pairingIndex or getPairingIndex(imgPrefix, maskPrefix, isImgPrefixRegex, isMaskPrefixRegex)
+    imgPattern, maskPattern = pairingIndex.imgPattern, pairingIndex.maskPattern
+    cache = ImageAugmenterScanCache(cachePath, imagesInputPath) if cachePath else None
+    # the images of directories without masks are used alone only if there are no masks at all
+    hasMasks = False
+
+    for dirPath, fileNames in iterDirectories(imagesInputPath, cache):
+        dirImgs, dirMasks = [], []
+
+        for file in fileNames:
+            if (imgPattern and imgPattern.search(file)) or (not imgPattern and imgPrefix in file):
+                dirImgs.append(file)
+
+            elif maskPrefix and ((maskPattern and maskPattern.search(file)) or (not maskPattern and maskPrefix in file)):
+                dirMasks.append(file)
+
+        if not maskPrefix:
+            yield from ((os.path.join(dirPath, file), None) for file in dirImgs)
+        elif dirImgs and dirMasks:
+            hasMasks = True
+            yield from pairingIndex.pairDirectory(dirPath, dirImgs, dirMasks)
+        elif dirImgs or dirMasks:
+            hasMasks = hasMasks or bool(dirMasks)
+            yield from pairingIndex.pairSplitDirectory(imagesInputPath, dirPath, dirImgs or dirMasks, isMaskDir=bool(dirMasks))
+
+    if cache:
+        cache.save()
+
+    imagesOnly = pairingIndex.popPendingFiles(isMaskDir=False)
+    if hasMasks:
+        pairingIndex.unmatchedImages.extend(imagesOnly)
+        pairingIndex.unmatchedMasks.extend(pairingIndex.popPendingFiles(isMaskDir=True))
+    else:
+        yield from ((imgPath, None) for imgPath in imagesOnly)
+
+    if raiseErrors and pairingIndex.hasErrors():
+        raise pairingIndex.getError()
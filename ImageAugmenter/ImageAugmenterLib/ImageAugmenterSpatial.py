@@ -1,72 +1,78 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from ImageAugmenterLib.ImageAugmenterTransformControllerInterface import ImageAugmenterTransformControllerInterface
 
 
 class ImageAugmenterSpatialController(ImageAugmenterTransformControllerInterface):
-    def __init__(self, ui, mappedTransformations: List[object], dictKeys: Dict[str, str]) -> None:
+    def __init__(self, ui, mappedTransformations: List[object], dictKeys: Dict[str, str], transformations: Optional[Dict[str, Dict]] = None) -> None:
         
-        from munch import Munch, munchify
+        from munch import Munch
         
         self.ui = ui
-        self.transformations: Munch = munchify(self.getTransformations())
+        self.transformations: Munch = self.loadTransformations(transformations)
         self.mappedTransformations: List[object] = mappedTransformations
+        # recipe name (e.g. "rotate") of each mapped transformation, see addTransformation
+        self.mappedTransformationNames: List[str] = []
         self.dictKeys: Dict[str, str] = dictKeys
 
-    def getTransformations(self) -> Dict[str, Dict]:
+    def getTransformationWidgets(self) -> Dict[str, Dict]:
         return {
             "rotate": {
-                "enabled": self.ui.rotateEnabled.isChecked(),
-                "angle": self.ui.rotateAngle.text,
-                "interpolationMode": self.ui.rotateInterpolationMode.currentText
+                "enabled": self.ui.rotateEnabled,
+                "angle": self.ui.rotateAngle,
+                "interpolationMode": self.ui.rotateInterpolationMode
             },
             "randRotate": {
-                "enabled": self.ui.randomRotateEnabled.isChecked(),
-                "rangeFromX": self.ui.randomRotateFromX.text,
-                "rangeToX": self.ui.randomRotateToX.text,
-                "rangeFromY": self.ui.randomRotateFromY.text,
-                "rangeToY": self.ui.randomRotateToY.text,
-                "rangeFromZ": self.ui.randomRotateFromZ.text,
-                "rangeToZ": self.ui.randomRotateToZ.text,
-                "paddingMode": self.ui.randomRotatePaddingMode.currentText,
-                "interpolationMode": self.ui.randomRotateInterpolationMode.currentText,
-                "alignCorners": self.ui.randomRotateAlignCorners.isChecked(),
+                "enabled": self.ui.randomRotateEnabled,
+                "rangeFromX": self.ui.randomRotateFromX,
+                "rangeToX": self.ui.randomRotateToX,
+                "rangeFromY": self.ui.randomRotateFromY,
+                "rangeToY": self.ui.randomRotateToY,
+                "rangeFromZ": self.ui.randomRotateFromZ,
+                "rangeToZ": self.ui.randomRotateToZ,
+                "paddingMode": self.ui.randomRotatePaddingMode,
+                "interpolationMode": self.ui.randomRotateInterpolationMode,
+                "alignCorners": self.ui.randomRotateAlignCorners,
             },
             "resize": {
-                "enabled": self.ui.resizeEnabled.isChecked(),
-                "spatialSize": (self.ui.resizeC.text, self.ui.resizeW.text, self.ui.resizeH.text),
-                "interpolationMode": self.ui.resizeInterpolationMode.currentText
+                "enabled": self.ui.resizeEnabled,
+                "spatialSize": (self.ui.resizeC, self.ui.resizeW, self.ui.resizeH),
+                "interpolationMode": self.ui.resizeInterpolationMode
             },
             "flip": {
-                "enabled": self.ui.flipEnabled.isChecked(),
-                "axis": self.ui.flipAxis.text,
+                "enabled": self.ui.flipEnabled,
+                "axis": self.ui.flipAxis,
             },
             "randomFlip": {
-                "enabled": self.ui.randomFlipEnabled.isChecked(),
+                "enabled": self.ui.randomFlipEnabled,
             },
             "zoom": {
-                "enabled": self.ui.zoomEnabled.isChecked(),
-                "factor": self.ui.zoomFactor.text,
-                "interpolationMode": self.ui.zoomInterpolationMode.currentText,
-                "paddingMode": self.ui.zoomPaddingMode.currentText,
-                "alignCorners": self.ui.zoomAlignCorners.isChecked(),
+                "enabled": self.ui.zoomEnabled,
+                "factor": self.ui.zoomFactor,
+                "interpolationMode": self.ui.zoomInterpolationMode,
+                "paddingMode": self.ui.zoomPaddingMode,
+                "alignCorners": self.ui.zoomAlignCorners,
             },
             "randomZoom": {
-                "enabled": self.ui.randomZoomEnabled.isChecked(),
-                "factorMin": self.ui.randomZoomFactorMin.text,
-                "factorMax": self.ui.randomZoomFactorMax.text,
-                "interpolationMode": self.ui.randomZoomInterpolationMode.currentText,
-                "paddingMode": self.ui.randomZoomPaddingMode.currentText,
-                "alignCorners": self.ui.randomZoomAlignCorners.isChecked(),
+                "enabled": self.ui.randomZoomEnabled,
+                "factorMin": self.ui.randomZoomFactorMin,
+                "factorMax": self.ui.randomZoomFactorMax,
+                "interpolationMode": self.ui.randomZoomInterpolationMode,
+                "paddingMode": self.ui.randomZoomPaddingMode,
+                "alignCorners": self.ui.randomZoomAlignCorners,
             },
         }
 
+    def getKeyValues(self, imageValue, maskValue) -> List:
+        """Per-key argument of a dictionary transformation: the mask is a label map, resampled with the nearest neighbour"""
+        return [maskValue if key == "mask" else imageValue for key in self.dictKeys]
+
     def mapTransformations(self) -> List[object]:
         from monai.transforms import Rotate, Flip, RandAxisFlipd, Resize, RandRotated, Zoom, RandZoomd
         if (self.transformations.rotate.enabled):
             if (self.transformations.rotate.angle == ""):
                 raise ValueError("The 'Rotate' transformation is enabled but angle is not specified")
 
-            self.mappedTransformations.append(Rotate(angle=float(self.transformations.rotate.angle),
+            self.addTransformation("rotate", Rotate(angle=float(self.transformations.rotate.angle),
                                                      mode=self.transformations.rotate.interpolationMode
                                                      ))
         if (self.transformations.randRotate.enabled):
@@ -82,13 +88,13 @@ class ImageAugmenterSpatialController(ImageAugmenterTransformControllerInterface
                     rangeZ = [float(self.transformations.randRotate.rangeFromZ), float(
                         self.transformations.randRotate.rangeToZ)]
 
-                self.mappedTransformations.append(RandRotated(prob=1,
+                self.addTransformation("randRotate", RandRotated(prob=1,
                                                               keys=self.dictKeys,
                                                               range_x=rangeX,
                                                               range_y=rangeY,
                                                               range_z=rangeZ,
                                                               padding_mode=self.transformations.randRotate.paddingMode,
-                                                              mode=self.transformations.randRotate.interpolationMode,
+                                                              mode=self.getKeyValues(self.transformations.randRotate.interpolationMode, "nearest"),
                                                               keep_size=True,
                                                               align_corners=self.transformations.randRotate.alignCorners,
                                                               allow_missing_keys=True))
@@ -100,7 +106,7 @@ class ImageAugmenterSpatialController(ImageAugmenterTransformControllerInterface
             if(not all(params.spatialSize)): 
                 raise ValueError("The 'Resize' transformation is enabled but spatial size is not specified")
 
-            self.mappedTransformations.append(Resize(spatial_size=(int(self.transformations.resize.spatialSize[0]),
+            self.addTransformation("resize", Resize(spatial_size=(int(self.transformations.resize.spatialSize[0]),
                                                                    int(self.transformations.resize.spatialSize[1]),
                                                                    int(self.transformations.resize.spatialSize[2])),
                                                      mode=self.transformations.resize.interpolationMode
@@ -110,10 +116,10 @@ class ImageAugmenterSpatialController(ImageAugmenterTransformControllerInterface
             if (params.axis == "" or params.axis == None):
                 raise ValueError("The 'Flip' transformation is enabled but axis is not specified")
 
-            self.mappedTransformations.append(Flip(spatial_axis=int(params.axis)))
+            self.addTransformation("flip", Flip(spatial_axis=int(params.axis)))
 
         if (self.transformations.randomFlip.enabled):
-            self.mappedTransformations.append(RandAxisFlipd(prob=1, keys=self.dictKeys, allow_missing_keys=True))
+            self.addTransformation("randomFlip", RandAxisFlipd(prob=1, keys=self.dictKeys, allow_missing_keys=True))
 
         if (self.transformations.zoom.enabled):
             params = self.transformations.zoom
@@ -121,7 +127,7 @@ class ImageAugmenterSpatialController(ImageAugmenterTransformControllerInterface
                 raise ValueError("The 'Zoom' transformation is enabled but factor is not specified")
 
             alignCorners = params.alignCorners if (params.interpolationMode in ["linear", "bilinear", "bicubic", "trilinear"]) else None
-            self.mappedTransformations.append(Zoom(zoom=float(params.factor),
+            self.addTransformation("zoom", Zoom(zoom=float(params.factor),
                                               mode=params.interpolationMode,
                                               padding_mode=params.paddingMode,
                                               align_corners=alignCorners))
@@ -133,12 +139,12 @@ class ImageAugmenterSpatialController(ImageAugmenterTransformControllerInterface
 
             alignCorners = params.alignCorners if (
                 params.interpolationMode in ["linear", "bilinear", "bicubic", "trilinear"]) else None
-            self.mappedTransformations.append(RandZoomd(prob=1,
+            self.addTransformation("randomZoom", RandZoomd(prob=1,
                                               min_zoom=float(params.factorMin),
                                               max_zoom=float(params.factorMax),
-                                              mode=params.interpolationMode,
+                                              mode=self.getKeyValues(params.interpolationMode, "nearest"),
                                               padding_mode=params.paddingMode,
-                                              align_corners=alignCorners,
+                                              align_corners=self.getKeyValues(alignCorners, None),
                                               keep_size=True,
                                               keys=self.dictKeys,
                                               allow_missing_keys=True))
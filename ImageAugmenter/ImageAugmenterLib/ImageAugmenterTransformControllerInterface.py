@@ -1,14 +1,83 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+
+def readWidget(widget):
+    if hasattr(widget, "currentText"):
+        return widget.currentText
+    if hasattr(widget, "isChecked"):
+        return widget.isChecked()
+    return widget.text
+
+
+def writeWidget(widget, value) -> None:
+    if isinstance(widget, tuple):
+        for subWidget, subValue in zip(widget, value):
+            writeWidget(subWidget, subValue)
+    elif hasattr(widget, "currentText"):
+        widget.setCurrentText(str(value))
+    elif hasattr(widget, "isChecked"):
+        widget.setChecked(bool(value))
+    else:
+        widget.setText(str(value))
+
+
+def mapWidgets(widgets, function):
+    """Applies function to every widget of a (nested) dictionary of widgets, keeping its structure"""
+    if isinstance(widgets, dict):
+        return {name: mapWidgets(widget, function) for name, widget in widgets.items()}
+    if isinstance(widgets, tuple):
+        return tuple(function(widget) for widget in widgets)
+    return function(widgets)
+
 
 class ImageAugmenterTransformControllerInterface(ABC):
     @abstractmethod
-    def getTransformations(self) -> Dict[str, Dict]:
+    def getTransformationWidgets(self) -> Dict[str, Dict]:
         """
-        Returns a dictionary representing the configured transformations.
+        Returns a dictionary with the UI widgets holding the parameters of each transformation.
         """
         pass
 
+    def getTransformations(self) -> Dict[str, Dict]:
+        """
+        Returns a dictionary representing the configured transformations, read from the UI widgets.
+        """
+        return mapWidgets(self.getTransformationWidgets(), readWidget)
+
+    def setTransformations(self, transformations: Dict[str, Dict]) -> None:
+        """
+        Sets the UI widgets from a dictionary returned by getTransformations, e.g. a loaded recipe.
+        Transformations missing from the dictionary are disabled.
+        """
+        for name, widgets in self.getTransformationWidgets().items():
+            params = transformations.get(name, {})
+            for paramName, widget in widgets.items():
+                if paramName in params:
+                    writeWidget(widget, params[paramName])
+                elif paramName == "enabled":
+                    writeWidget(widget, False)
+
+    def loadTransformations(self, transformations: Optional[Dict[str, Dict]] = None):
+        """
+        Returns the configured transformations as a Munch, read from the UI or from the given dictionary (e.g. a batch config).
+        A missing transformation is disabled and a missing parameter is empty, like an empty field of the UI.
+        """
+        from munch import DefaultFactoryMunch, DefaultMunch, munchify
+
+        if transformations is None:
+            return munchify(self.getTransformations())
+
+        return DefaultFactoryMunch(lambda: DefaultMunch(""),
+                                   {name: DefaultMunch.fromDict(params, "") for name, params in transformations.items()})
+
+    def addTransformation(self, name: str, transform: object) -> None:
+        """
+        Appends the MONAI transformation mapped from a transformation of the dictionary, recording its name (e.g. "rotate").
+        """
+        self.mappedTransformations.append(transform)
+        self.mappedTransformationNames.append(name)
+
     @abstractmethod
     def mapTransformations(self) -> List[object]:
         """
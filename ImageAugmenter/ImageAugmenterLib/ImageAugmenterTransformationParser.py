@@ -1,29 +1,54 @@
 from ImageAugmenterLib.ImageAugmenterIntensity import ImageAugmenterIntensityController
 from ImageAugmenterLib.ImageAugmenterSpatial import ImageAugmenterSpatialController
 from ImageAugmenterLib.ImageAugmenterCrop import ImageAugmenterCropController
-from typing import List
+from typing import Dict, List, Optional
 
 
 DICT_KEYS = ["img", "mask"]
 
 class ImageAugmenterTransformationParser():
-    def __init__(self, ui):
+    def __init__(self, ui=None, transformations: Optional[Dict[str, Dict]] = None):
+       """Transformations are read from the UI, or from the transformations dictionary when running without it"""
        self.ui = ui
+       self.transformations: Optional[Dict[str, Dict]] = transformations
        self.spatialTransformationController : ImageAugmenterSpatialController = None 
        self.intensityTransformationController : ImageAugmenterIntensityController = None
        self.cropTransformationController : ImageAugmenterCropController = None
+       # name of the dictionary entry (e.g. "rotate") of every mapped transformation, in the same order
+       self.transformationNames: List[str] = []
        
     def mapTransformations(self) -> List[object]:
         mappedTransformations = []
         
-        self.spatialTransformationController = ImageAugmenterSpatialController(ui=self.ui, mappedTransformations=mappedTransformations, dictKeys=DICT_KEYS)
-        self.intensityTransformationController = ImageAugmenterIntensityController(ui=self.ui, mappedTransformations=mappedTransformations, dictKeys=DICT_KEYS)
-        self.cropTransformationController = ImageAugmenterCropController(ui=self.ui, mappedTransformations=mappedTransformations, dictKeys=DICT_KEYS)
+        self.spatialTransformationController = ImageAugmenterSpatialController(ui=self.ui, mappedTransformations=mappedTransformations, dictKeys=DICT_KEYS, transformations=self.transformations)
+        self.intensityTransformationController = ImageAugmenterIntensityController(ui=self.ui, mappedTransformations=mappedTransformations, dictKeys=DICT_KEYS, transformations=self.transformations)
+        self.cropTransformationController = ImageAugmenterCropController(ui=self.ui, mappedTransformations=mappedTransformations, dictKeys=DICT_KEYS, transformations=self.transformations)
 
         mappedTransformations = self.spatialTransformationController.mapTransformations()
         mappedTransformations = self.intensityTransformationController.mapTransformations()
         mappedTransformations = self.cropTransformationController.mapTransformations()
+        self.transformationNames = [name for controller in (self.spatialTransformationController, self.intensityTransformationController, self.cropTransformationController)
+                                    for name in controller.mappedTransformationNames]
 
         if(not mappedTransformations): raise ValueError("Choose at least one transformation to apply")
 
-        return mappedTransformations
\ No newline at end of file
+        return mappedTransformations
+
+    def getControllers(self) -> List[object]:
+        """Controllers reading and writing the UI, without any transformation mapped"""
+        return [controller(ui=self.ui, mappedTransformations=[], dictKeys=DICT_KEYS, transformations={})
+                for controller in (ImageAugmenterSpatialController, ImageAugmenterIntensityController, ImageAugmenterCropController)]
+
+    def getTransformations(self) -> Dict[str, Dict]:
+        transformations = {}
+        for controller in self.getControllers():
+            transformations.update(controller.getTransformations())
+        return transformations
+
+    def setTransformations(self, transformations: Dict[str, Dict]) -> None:
+        for controller in self.getControllers():
+            controller.setTransformations(transformations)
+
+    def getRecipe(self) -> Dict:
+        from ImageAugmenterLib.ImageAugmenterRecipe import createRecipe
+        return createRecipe(self.getTransformations())
\ No newline at end of file
@@ -1,37 +1,99 @@
+import copy
+import functools
+import hashlib
 import os
 import re
-import threading
+from typing import NamedTuple, Tuple
 
 import SimpleITK as sitk
-import sitkUtils
-import slicer
 
 FLAT = "flat"  # .../path/ImgID.extension, .../path/ImgID_label.extension
 HIERARCHICAL = "hierarchical" # .../path/CaseID/img.extension, # .../path/CaseID/mask.extension
 CHANNEL_FIRST_REQUIRED = ["Resize", "SpatialPad", "CenterSpatialCrop"]
+# ScaleIntensityRange replaces ScaleIntensity when a volume is processed in slabs
+INTENSITY_TRANSFORMS = ["ScaleIntensity", "RandScaleIntensityd", "AdjustContrast", "RandAdjustContrastd", "RandGaussianNoised", "ShiftIntensity",
+                        "RandShiftIntensityd", "NormalizeIntensity", "ThresholdIntensity", "MedianSmooth", "GaussianSmooth", "RandGaussianSmoothd",
+                        "ScaleIntensityRange"]
+# transformations interpolating the volume, masks are resampled with the nearest neighbour instead (see getLabelTransform)
+INTERPOLATING_TRANSFORMS = ["Rotate", "Zoom", "Resize"]
+# the first axis of the (D,H,W) arrays is taken as channel, so these compute every slice on its own: no statistics of the whole volume
+# (unlike ScaleIntensity and AdjustContrast) and in-plane kernels. A single slice can be previewed without the rest of the volume
+SLICE_WISE_TRANSFORMS = ["RandScaleIntensityd", "RandGaussianNoised", "ShiftIntensity", "RandShiftIntensityd", "NormalizeIntensity",
+                         "ThresholdIntensity", "MedianSmooth", "GaussianSmooth", "RandGaussianSmoothd"]
+# parameters in voxels that don't scale with a downsampled preview
+SIZE_DEPENDENT_TRANSFORMS = ["Resize", "SpatialPad", "BorderPad", "SpatialCrop", "CenterSpatialCrop"]
+
+DTYPE_FLOAT = "float" # compute and save in float32
+DTYPE_RESTORE = "restore" # compute in float32, save in the input type
+DTYPE_KEEP = "keep" # no conversion, transformations receive the input type
+
+
+class VolumeMetadata(NamedTuple):
+    """Geometry of a volume, enough to write a transformed array back in the same physical space"""
+    size: Tuple[int, ...]
+    spacing: Tuple[float, ...]
+    origin: Tuple[float, ...]
+    direction: Tuple[float, ...]
+    pixelType: str
+
+    def isVolume(self) -> bool:
+        return len(self.size) > 2 and self.size[2] > 0
+
+
+def getVolumeMetadata(img: sitk.Image) -> VolumeMetadata:
+    return VolumeMetadata(size=img.GetSize(),
+                          spacing=img.GetSpacing(),
+                          origin=img.GetOrigin(),
+                          direction=img.GetDirection(),
+                          pixelType=img.GetPixelIDTypeAsString())
+
+
+@functools.lru_cache(maxsize=4096)
+def _readImageMetadata(path: str, mtime: int, fileSize: int) -> VolumeMetadata:
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(path)
+    reader.ReadImageInformation()
+    return VolumeMetadata(size=reader.GetSize(),
+                          spacing=reader.GetSpacing(),
+                          origin=reader.GetOrigin(),
+                          direction=reader.GetDirection(),
+                          pixelType=sitk.GetPixelIDValueAsString(reader.GetPixelID()))
+
+
+def readImageMetadata(path: str) -> VolumeMetadata:
+    """Reads only the header of the image, without decoding the voxels.
+    Results are cached per path, modification time and size, so an updated file is read again.
+    """
+    fileStat = os.stat(path)
+    return _readImageMetadata(path, fileStat.st_mtime_ns, fileStat.st_size)
+
 
+def collectImagesAndMasksList(imagesInputPath, imgPrefix, maskPrefix, isImgPrefixRegex, isMaskPrefixRegex, cachePath=None):
+    """Collects the whole scan in two lists, use ImageAugmenterScanner.scanImagesAndMasks to process the pairs while they're found"""
+    from ImageAugmenterLib.ImageAugmenterScanner import scanImagesAndMasks
 
-def collectImagesAndMasksList(imagesInputPath, imgPrefix, maskPrefix, isImgPrefixRegex, isMaskPrefixRegex):
     imgs, masks = [], []
 
-    # Regex compiled only if the flags are active, otherwise use the prefix
-    imgPattern = re.compile(imgPrefix) if isImgPrefixRegex else None
-    maskPattern = re.compile(maskPrefix) if isMaskPrefixRegex else None
+    for imgPath, maskPath in scanImagesAndMasks(imagesInputPath=imagesInputPath,
+                                                imgPrefix=imgPrefix,
+                                                maskPrefix=maskPrefix,
+                                                isImgPrefixRegex=isImgPrefixRegex,
+                                                isMaskPrefixRegex=isMaskPrefixRegex,
+                                                cachePath=cachePath):
+        imgs.append(imgPath)
+        if maskPath:
+            masks.append(maskPath)
 
-    for root, _, files in os.walk(imagesInputPath):
-        for file in files:
-            if file.startswith("."):
-                continue
-            filePath = os.path.join(root, file)
+    return imgs, masks
 
-            if (imgPattern and imgPattern.search(file)) or (not imgPattern and imgPrefix in file):
-                imgs.append(filePath)
-            
-            elif maskPrefix and ((maskPattern and maskPattern.search(file)) or (not maskPattern and maskPrefix in file)):
-                masks.append(filePath)
 
-    return imgs, masks
+def getScanCachePath(imagesInputPath):
+    """Listing cache of the input tree, one per input path, in the Slicer temporary folder"""
+    # slicer is imported by the functions using it, the worker processes import this module without the application (PythonSlicer)
+    import slicer
 
+    cacheName = hashlib.sha1(os.path.abspath(imagesInputPath).encode()).hexdigest()
+    return os.path.join(slicer.app.temporaryPath, "ImageAugmenter", f"scan_{cacheName}.json")
 
 
 def getFilesStructure(ui):
@@ -43,6 +105,19 @@ def getFilesStructure(ui):
     raise ValueError("File structure not recognized!")
 
 
+def getSeed(ui):
+    # the minimum of the spin box is shown as "Random"
+    return ui.seed.value if ui.seed.value >= 0 else None
+
+def getDtypePolicy(ui):
+    return [DTYPE_FLOAT, DTYPE_RESTORE, DTYPE_KEEP][ui.dtypePolicy.currentIndex]
+
+def getProfileHook(ui):
+    from ImageAugmenterLib.ImageAugmenterProfiler import PROFILE_HOOKS
+    # same order as the items of the combo box
+    return PROFILE_HOOKS[ui.profileHook.currentIndex]
+
+
 def makeDir(outputPath, caseName, transformName):
     currentDir = f"{outputPath}/{caseName}_{transformName}"
     os.makedirs(currentDir, exist_ok=True)
@@ -70,6 +145,39 @@ def getTransformName(transform) -> str:
         return sanitizeTransformName(transform)
 
 
+def getLabelTransform(transform):
+    """The transformation as applied to a mask: label maps are resampled with the nearest neighbour, so labels are never
+    blended into fractional values, and padded with the background (0)
+    """
+    transformName = getTransformName(transform)
+    if transformName in INTERPOLATING_TRANSFORMS:
+        labelTransform = copy.copy(transform)
+        labelTransform.mode = "nearest"
+        if transformName != "Rotate":
+            # torch interpolate accepts align_corners only with the linear modes
+            labelTransform.align_corners = None
+        if transformName == "Resize":
+            labelTransform.anti_aliasing = False
+        return labelTransform
+
+    if transformName in ("SpatialPad", "BorderPad") and transform.kwargs.get("value", 0) != 0:
+        labelTransform = copy.copy(transform)
+        labelTransform.kwargs = {**transform.kwargs, "value": 0}
+        return labelTransform
+
+    return transform
+
+
+def getCaseId(fullImgPath):
+    """Identifies a case independently of where the dataset is stored: parent folder and file name of the image"""
+    parentDir, fileName = os.path.split(os.path.abspath(fullImgPath))
+    return f"{os.path.basename(parentDir)}/{fileName}"
+
+def deriveSeed(seed, caseId, transformIdx, sampleIdx) -> int:
+    """Seed of a single random draw, derived from the global seed with a hash so that close inputs give unrelated streams"""
+    key = f"{seed}:{caseId}:{transformIdx}:{sampleIdx}".encode()
+    return int.from_bytes(hashlib.sha256(key).digest()[:4], "little")
+
 def getCaseName(fullImgPath, filesStructure):
     return fullImgPath.split("/")[-2] if (filesStructure == HIERARCHICAL) else fullImgPath.split("/")[-1]
 
@@ -84,17 +192,17 @@ def splitFilenameAndExtension(filePath, prefix, isRegex):
     return name, ext
     
 def getOriginalCase(fullImgPath, filesStructure):
-    """This function returns the original image and extracts the specific patient/case name/ID.
+    """This function returns the metadata of the original image and extracts the specific patient/case name/ID.
     The extracted name/ID will be used as the title of the folder that will contain the augmented images.
     """
     caseName = getCaseName(fullImgPath, filesStructure)
 
-    originalCaseImg = sitk.ReadImage(fullImgPath)
+    originalCaseMetadata = readImageMetadata(fullImgPath)
 
-    return caseName, originalCaseImg
+    return caseName, originalCaseMetadata
 
 
-def copyInfo(origin, target):
+def copyInfo(metadata: VolumeMetadata, target):
     """Same behaviour as sitk.CopyInformation but sizes don't need to match
 
     Returns
@@ -102,34 +210,48 @@ def copyInfo(origin, target):
         Target volume with new information (sitk.Image)
 
     """
-    target.SetOrigin(origin.GetOrigin())
-    target.SetSpacing(origin.GetSpacing())
-    target.SetDirection(origin.GetDirection())
+    target.SetOrigin(metadata.origin)
+    target.SetSpacing(metadata.spacing)
+    target.SetDirection(metadata.direction)
     return target
 
-def save(img, path, filename, originalCase, extension):
-    img = sitk.GetImageFromArray(img)
-
-    if (originalCase.GetDepth() > 0):
-        copyInfo(originalCase, img)
-
-    saveThread = threading.Thread(target=sitk.WriteImage, args=(img, f"{path}/{filename}{extension}"))
-    saveThread.start()
+def getOutputFilePath(path, filename, extension):
+    return f"{path}/{filename}{extension}"
 
-def showPreview(img, originalCaseImg, originalCaseMask=None, mask=None, imgNodeName="imgNode", maskNodeName="maskNode"):
-    sitkAugmentedImg = sitk.GetImageFromArray(img.cpu())
+def save(img, path, filename, metadata: VolumeMetadata, extension, writer=None):
+    """Writes img with the geometry of the original case.
+    The volume is queued on the writer when given (see ImageAugmenterWriter), otherwise it's written synchronously.
+    A CPU tensor is copied only once, into the SimpleITK image, see ImageAugmenterConversion.
+    """
+    from ImageAugmenterLib.ImageAugmenterConversion import arrayToImage, tensorToArray
+    from ImageAugmenterLib.ImageAugmenterProfiler import STAGE_CONVERSION, STAGE_DEVICE_TO_HOST, STAGE_WRITE, profiler
+
+    with profiler.stage(STAGE_DEVICE_TO_HOST):
+        array = tensorToArray(img)
+    with profiler.stage(STAGE_CONVERSION):
+        img = arrayToImage(array, metadata)
+
+    filePath = getOutputFilePath(path, filename, extension)
+    if writer is None:
+        with profiler.stage(STAGE_WRITE, os.path.basename(filePath)):
+            sitk.WriteImage(img, filePath)
+        return None
+
+    return writer.write(img, filePath)
+
+def showPreview(img, imgMetadata: VolumeMetadata, maskMetadata: VolumeMetadata = None, mask=None, imgNodeName="imgNode", maskNodeName="maskNode",
+                imgNode=None, maskNode=None):
+    """Shows the preview in the scene, the nodes share the memory of the tensors when possible (see ImageAugmenterConversion).
+    When imgNode and maskNode are given their image data is replaced in place, otherwise new nodes are created.
+    """
+    import slicer
 
-    if (originalCaseImg.GetDepth() > 0):
-        copyInfo(originalCaseImg, sitkAugmentedImg)
+    from ImageAugmenterLib.ImageAugmenterConversion import arrayToVolumeNode, tensorToArray
 
-    outputImgNode = sitkUtils.PushVolumeToSlicer(sitkAugmentedImg, name=imgNodeName, className="vtkMRMLScalarVolumeNode")
+    outputImgNode = arrayToVolumeNode(tensorToArray(img), imgMetadata, node=imgNode, name=imgNodeName, className="vtkMRMLScalarVolumeNode")
 
     if (mask != None):
-        sitkAugmentedMask = sitk.GetImageFromArray(mask.cpu())
-        if (originalCaseMask.GetDepth() > 0):
-            copyInfo(originalCaseMask, sitkAugmentedMask)
-
-        outputMaskNode = sitkUtils.PushVolumeToSlicer(sitkAugmentedMask, name=maskNodeName, className="vtkMRMLLabelMapVolumeNode")
+        outputMaskNode = arrayToVolumeNode(tensorToArray(mask), maskMetadata, node=maskNode, name=maskNodeName, className="vtkMRMLLabelMapVolumeNode")
 
         slicer.util.setSliceViewerLayers(background=outputImgNode, label=outputMaskNode, labelOpacity=0.4)
         return outputImgNode, outputMaskNode
@@ -138,7 +260,31 @@ def showPreview(img, originalCaseImg, originalCaseMask=None, mask=None, imgNodeN
         return outputImgNode
 
 
+def getShownSliceIndex(metadata: VolumeMetadata, viewName="Red") -> int:
+    """Index along the third axis of the volume of the slice at the center of a slice view.
+    The middle slice is returned when the view is outside the volume or there is no view, e.g. without the main window.
+    """
+    import numpy as np
+    import slicer
+
+    layoutManager = slicer.app.layoutManager()
+    sliceWidget = layoutManager.sliceWidget(viewName) if layoutManager else None
+    if sliceWidget is None:
+        return metadata.size[2] // 2
+
+    sliceToRAS = sliceWidget.mrmlSliceNode().GetSliceToRAS()
+    ras = [sliceToRAS.GetElement(i, 3) for i in range(3)]
+    # Slicer views are in RAS, sitk geometry is in LPS
+    lps = np.array([-ras[0], -ras[1], ras[2]])
+    indexToPhysical = np.array(metadata.direction).reshape(3, 3) * np.array(metadata.spacing)
+    continuousIndex = np.linalg.solve(indexToPhysical, lps - np.array(metadata.origin))
+    sliceIdx = int(round(continuousIndex[2]))
+
+    return sliceIdx if 0 <= sliceIdx < metadata.size[2] else metadata.size[2] // 2
+
 def clearScene(previewNodesToClear: list):
+    import slicer
+
     scene = slicer.mrmlScene
 
     for oldPreviewNode in previewNodesToClear:
@@ -146,11 +292,17 @@ def clearScene(previewNodesToClear: list):
     
 
 def resetViews():
+    import slicer
+
     slicer.app.layoutManager().resetThreeDViews()
     slicer.util.resetSliceViews()
 
 
 def extractDeviceNumber(gpu_info) -> str:
+    # torch device names, e.g. from a batch config, are used as they are
+    if re.fullmatch(r"cuda:\d+", gpu_info):
+        return gpu_info
+
     match = re.search(r"GPU (\d+) -", gpu_info)
 
     if not match:
@@ -19,9 +19,89 @@ def validateForms(ui):
     validatePrefixes(ui)
 
 
+def validateBatchConfig(config):
+    from ImageAugmenterLib.ImageAugmenterProfiler import PROFILE_HOOKS
+    from ImageAugmenterLib.ImageAugmenterUtils import DTYPE_FLOAT, DTYPE_KEEP, DTYPE_RESTORE, FLAT, HIERARCHICAL
+
+    if not config["imagesInputPath"] or not os.path.isdir(config["imagesInputPath"]):
+        raise ValueError("Images path is not a directory")
+    if not config["outputPath"]:
+        raise ValueError("Output path is invalid")
+    if not config["imgPrefix"]:
+        raise ValueError("Indicate the image prefix")
+    if config["filesStructure"] not in [FLAT, HIERARCHICAL]:
+        raise ValueError(f"Files structure must be '{HIERARCHICAL}' or '{FLAT}'")
+    if config["dtypePolicy"] not in [DTYPE_FLOAT, DTYPE_RESTORE, DTYPE_KEEP]:
+        raise ValueError(f"Output type must be '{DTYPE_FLOAT}', '{DTYPE_RESTORE}' or '{DTYPE_KEEP}'")
+    if int(config["numWorkers"]) < 1 or int(config["samplesPerCase"]) < 1:
+        raise ValueError("Workers and samples per case must be at least 1")
+    if int(config["slabSize"]) < 1:
+        raise ValueError("Slab size must be at least 1 MB")
+    if config["profileHook"] not in PROFILE_HOOKS:
+        raise ValueError(f"Profiler must be one of {', '.join(PROFILE_HOOKS)}")
+
+
 def validateCollectedImagesAndMasks(imgs, masks):
     if (len(imgs) == 0):
         return ValueError(f"No images found with the criteria set, please double check the input data.")
 
     if len(masks) > 0 and (len(masks) != len(imgs)):
         return ValueError(f"Images and masks must have same length. Found:\n{len(imgs)} images\n{len(masks)} masks.\nMake sure you have specified the correct prefixes to avoid inconsistencies.")
+
+
+def getSizeMismatch(imgPath, imgSize, maskPath, maskSize):
+    """Description of a mask whose size differs from the size of its image, None if they match"""
+    if tuple(imgSize) != tuple(maskSize):
+        return f"{imgPath} {tuple(imgSize)} - {maskPath} {tuple(maskSize)}"
+
+
+def getSizeMismatchesError(mismatches):
+    details = "\n".join(mismatches)
+    return ValueError(f"Images and masks must have the same size. Found {len(mismatches)} mismatching pair(s):\n{details}")
+
+
+def validateImagesAndMasksGeometry(imgs, masks):
+    """Checks from the headers only that every mask has the size of its image"""
+    from ImageAugmenterLib.ImageAugmenterUtils import readImageMetadata
+
+    mismatches = []
+    for imgPath, maskPath in zip(imgs, masks):
+        mismatch = getSizeMismatch(imgPath, readImageMetadata(imgPath).size, maskPath, readImageMetadata(maskPath).size)
+        if mismatch:
+            mismatches.append(mismatch)
+
+    if mismatches:
+        return getSizeMismatchesError(mismatches)
+
+
+def validateProcessedInputs(processedCases, pairingIndex, sizeMismatches):
+    """Reported at the end of a run: the files that couldn't be paired while scanning (see scanImagesAndMasks)
+    and the cases whose mask doesn't have the size of the image, found by the workers. The other cases have been processed.
+    """
+    if not pairingIndex.hasErrors() and not sizeMismatches:
+        return None
+
+    errors = [str(error) for error in (pairingIndex.getError() if pairingIndex.hasErrors() else None,
+                                       getSizeMismatchesError(sizeMismatches) if sizeMismatches else None) if error]
+    details = "\n".join(errors)
+    return ValueError(f"{processedCases} case(s) completed, some inputs could not be used:\n{details}")
+
+
+def validateParallelSettings(numWorkers, device):
+    if numWorkers > 1 and device.lower() != "cpu":
+        return ValueError("Parallel processing is only available on CPU, select the CPU device or use a single worker.")
+
+
+def validateOutOfCoreSettings(outOfCore, transformations, chainTransformations):
+    from ImageAugmenterLib.ImageAugmenterOutOfCore import OUT_OF_CORE_TRANSFORMS, SLICE_AXIS_TRANSFORMS
+    from ImageAugmenterLib.ImageAugmenterUtils import getTransformName
+
+    if not outOfCore:
+        return None
+
+    transformNames = [getTransformName(transform) for transform in transformations]
+    unsupported = [transformName for transformName in transformNames if transformName not in OUT_OF_CORE_TRANSFORMS]
+    if unsupported:
+        return ValueError(f"{', '.join(unsupported)} can't be processed in slabs, disable them or the slab processing.")
+    if chainTransformations and len(transformNames) > 1 and any(transformName in SLICE_AXIS_TRANSFORMS for transformName in transformNames):
+        return ValueError("Chained transformations can't crop or pad the slices when processed in slabs, disable the chain or the slab processing.")
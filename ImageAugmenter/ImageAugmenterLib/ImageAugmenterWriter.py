@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+import SimpleITK as sitk
+
+from ImageAugmenterLib.ImageAugmenterProfiler import STAGE_WRITE, profiler
+
+DEFAULT_WRITER_THREADS = 4
+DEFAULT_MAX_PENDING_WRITES = 8
+
+
+class ImageAugmenterWriter():
+    """Writes volumes to disk with a fixed pool of threads.
+    At most maxPending volumes can wait to be written, further writes block the caller until a slot is free,
+    so the transform loop cannot run ahead of the disk and keep an unbounded number of volumes in memory.
+    """
+    def __init__(self, maxWorkers: int = DEFAULT_WRITER_THREADS, maxPending: int = DEFAULT_MAX_PENDING_WRITES) -> None:
+        self.maxWorkers: int = maxWorkers
+        self.maxPending: int = maxPending
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="ImageAugmenterWriter")
+        self.slots: threading.BoundedSemaphore = threading.BoundedSemaphore(maxPending)
+        self.lock: threading.Lock = threading.Lock()
+        self.pending: set = set()
+        self.errors: List[Tuple[str, Exception]] = []
+        self.writtenFiles: int = 0
+        self.writtenBytes: int = 0
+        self.startTime: float = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> None:
+        self.close(raiseErrors=excType is None)
+
+    @property
+    def queueDepth(self) -> int:
+        """Number of volumes submitted and not yet on disk"""
+        with self.lock:
+            return len(self.pending)
+
+    @property
+    def throughput(self) -> float:
+        """Written bytes per second since the writer was created"""
+        elapsed = time.time() - self.startTime
+        return self.writtenBytes / elapsed if elapsed > 0 else 0.0
+
+    def getStats(self) -> Dict[str, float]:
+        return {
+            "queueDepth": self.queueDepth,
+            "writtenFiles": self.writtenFiles,
+            "writtenBytes": self.writtenBytes,
+            "failedFiles": len(self.errors),
+            "bytesPerSecond": self.throughput,
+        }
+
+    def addWritten(self, writtenFiles: int, writtenBytes: int) -> None:
+        """Accounts for files written elsewhere, e.g. by the writers of the worker processes"""
+        with self.lock:
+            self.writtenFiles += writtenFiles
+            self.writtenBytes += writtenBytes
+
+    def write(self, img: sitk.Image, filePath: str) -> Future:
+        """Queues img to be written to filePath, blocking while the queue is full.
+        Errors of the previous writes are raised here, to stop a run as soon as the disk fails.
+        """
+        self.raiseErrors()
+        self.slots.acquire()
+        try:
+            # the write is timed as a stage of the case being processed by the caller
+            future = self.executor.submit(self._write, img, filePath, profiler.getCase())
+        except Exception:
+            self.slots.release()
+            raise
+
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._onWriteDone)
+        return future
+
+    def _write(self, img: sitk.Image, filePath: str, case: str = "") -> str:
+        try:
+            with profiler.stage(STAGE_WRITE, os.path.basename(filePath), case=case):
+                sitk.WriteImage(img, filePath)
+            fileSize = os.path.getsize(filePath)
+            with self.lock:
+                self.writtenFiles += 1
+                self.writtenBytes += fileSize
+            return filePath
+        except Exception as e:
+            logging.error(f"Failed to write {filePath}: {e}")
+            with self.lock:
+                self.errors.append((filePath, e))
+            raise
+
+    def _onWriteDone(self, future: Future) -> None:
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+
+    def raiseErrors(self) -> None:
+        with self.lock:
+            errors, self.errors = self.errors, []
+
+        if errors:
+            details = "\n".join(f"{filePath}: {error}" for filePath, error in errors)
+            raise ValueError(f"{len(errors)} file(s) could not be written:\n{details}")
+
+    def flush(self) -> None:
+        """Waits until every queued volume is on disk, then raises the write errors, if any"""
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending)
+        self.raiseErrors()
+
+    def close(self, raiseErrors: bool = True) -> None:
+        try:
+            if raiseErrors:
+                self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
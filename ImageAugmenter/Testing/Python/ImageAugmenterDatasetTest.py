@@ -0,0 +1,130 @@
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+import torch
+
+
+def getVolume():
+    """int16 image and uint8 mask with label 2, with the geometry and the pixel type of each"""
+    from ImageAugmenterLib.ImageAugmenterUtils import getVolumeMetadata
+
+    img = (np.random.default_rng(0).random((4, 16, 12)) * 1000).astype(np.int16)
+    mask = np.zeros(img.shape, np.uint8)
+    mask[1:3, 4:10, 3:9] = 2
+    return (torch.from_numpy(img), torch.from_numpy(mask),
+            getVolumeMetadata(sitk.GetImageFromArray(img)), getVolumeMetadata(sitk.GetImageFromArray(mask)))
+
+
+class ImageAugmenterDatasetSeedingTest(unittest.TestCase):
+    """With a seed the random outputs depend only on the case, the transformation and the sample, not on the processing order"""
+
+    def getOutputs(self, seed, caseId: str = "case0/img.nrrd", chainTransformations: bool = False, reverse: bool = False):
+        from monai.transforms import RandGaussianNoised, RandRotated
+
+        from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
+
+        img, mask, imgMetadata, maskMetadata = getVolume()
+        transformations = [RandRotated(keys=["img", "mask"], range_x=1.0, prob=1.0, allow_missing_keys=True),
+                           RandGaussianNoised(keys=["img"], prob=1.0, std=10.0, allow_missing_keys=True)]
+        dataset = ImageAugmenterDataset(imgPaths=[], transformations=transformations, device="cpu",
+                                        chainTransformations=chainTransformations, samplesPerCase=2, seed=seed)
+        outputs = {}
+        if reverse:
+            # the second output is computed alone first, then the whole case
+            name = dataset.list_outputs()[-1][0]
+            outputs.update((name, (img, mask)) for name, img, mask in dataset.iter_transformed(img.float(), mask, imgMetadata, maskMetadata, caseId, {name}))
+        for name, transformedImg, transformedMask in dataset.iter_transformed(img.float(), mask, imgMetadata, maskMetadata, caseId):
+            outputs.setdefault(name, (transformedImg, transformedMask))
+        return outputs
+
+    def assertSameOutputs(self, outputs, otherOutputs) -> None:
+        self.assertEqual(outputs.keys(), otherOutputs.keys())
+        for name in outputs:
+            for volume, otherVolume in zip(outputs[name], otherOutputs[name]):
+                torch.testing.assert_close(torch.as_tensor(volume), torch.as_tensor(otherVolume), rtol=0, atol=0)
+
+    def test_same_seed_same_outputs(self) -> None:
+        for chainTransformations in (False, True):
+            outputs = self.getOutputs(42, chainTransformations=chainTransformations)
+            self.assertSameOutputs(outputs, self.getOutputs(42, chainTransformations=chainTransformations))
+            self.assertSameOutputs(outputs, self.getOutputs(42, chainTransformations=chainTransformations, reverse=True))
+
+    def test_outputs_depend_on_seed_case_and_sample(self) -> None:
+        outputs = self.getOutputs(42)
+        self.assertFalse(torch.equal(outputs["RandGaussianNoised_0"][0], outputs["RandGaussianNoised_1"][0]))
+        self.assertFalse(torch.equal(outputs["RandGaussianNoised_0"][0], self.getOutputs(43)["RandGaussianNoised_0"][0]))
+        self.assertFalse(torch.equal(outputs["RandGaussianNoised_0"][0], self.getOutputs(42, caseId="case1/img.nrrd")["RandGaussianNoised_0"][0]))
+
+    def test_derived_seeds(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterUtils import deriveSeed
+
+        self.assertEqual(deriveSeed(42, "case0/img.nrrd", 0, 0), deriveSeed(42, "case0/img.nrrd", 0, 0))
+        seeds = {deriveSeed(42, "case0/img.nrrd", transformIdx, sampleIdx) for transformIdx in range(4) for sampleIdx in range(4)}
+        self.assertEqual(len(seeds), 16)
+        self.assertTrue(all(0 <= seed < 2 ** 32 for seed in seeds))
+
+
+class ImageAugmenterDatasetDtypeTest(unittest.TestCase):
+    """The outputs are saved in the type chosen by the dtype policy, masks keep their labels"""
+
+    def getOutputs(self, dtypePolicy: str, compactMasks: bool = False, transformations=None):
+        from monai.transforms import Flip, Rotate, ShiftIntensity
+
+        from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
+        from ImageAugmenterLib.ImageAugmenterUtils import DTYPE_KEEP
+
+        img, mask, imgMetadata, maskMetadata = getVolume()
+        transformations = transformations or [ShiftIntensity(offset=0.4), Flip(spatial_axis=1), Rotate(angle=0.3, mode="bilinear")]
+        dataset = ImageAugmenterDataset(imgPaths=[], transformations=transformations, device="cpu", dtypePolicy=dtypePolicy, compactMasks=compactMasks)
+        img = img if dtypePolicy == DTYPE_KEEP else img.float()
+        return {name: (transformedImg, transformedMask) for name, transformedImg, transformedMask in dataset.iter_transformed(img, mask, imgMetadata, maskMetadata)}
+
+    def test_float(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterUtils import DTYPE_FLOAT
+
+        for name, (img, mask) in self.getOutputs(DTYPE_FLOAT).items():
+            self.assertEqual(img.dtype, torch.float32, name)
+            self.assertEqual(mask.dtype, torch.float32, name)
+            self.assertTrue(set(torch.unique(mask).tolist()) <= {0, 2}, name)
+
+    def test_restore(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterUtils import DTYPE_RESTORE
+
+        outputs = self.getOutputs(DTYPE_RESTORE)
+        for name, (img, mask) in outputs.items():
+            self.assertEqual(img.dtype, torch.int16, name)
+            self.assertEqual(mask.dtype, torch.uint8, name)
+        # computed in float, rounded when saved
+        img, mask, imgMetadata, maskMetadata = getVolume()
+        torch.testing.assert_close(torch.as_tensor(outputs["ShiftIntensity"][0]), img, rtol=0, atol=0)
+
+    def test_keep(self) -> None:
+        from monai.transforms import Flip
+
+        from ImageAugmenterLib.ImageAugmenterUtils import DTYPE_KEEP
+
+        img, mask, imgMetadata, maskMetadata = getVolume()
+        transformedImg, transformedMask = self.getOutputs(DTYPE_KEEP, transformations=[Flip(spatial_axis=1)])["Flip"]
+        self.assertEqual(transformedImg.dtype, torch.int16)
+        torch.testing.assert_close(torch.as_tensor(transformedImg), img.flip(2), rtol=0, atol=0)
+
+    def test_compact_masks(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterUtils import DTYPE_FLOAT
+
+        for name, (img, mask) in self.getOutputs(DTYPE_FLOAT, compactMasks=True).items():
+            self.assertEqual(img.dtype, torch.float32, name)
+            self.assertEqual(mask.dtype, torch.uint8, name)
+
+    def test_mask_without_labels_is_none(self) -> None:
+        from monai.transforms import SpatialCrop
+
+        from ImageAugmenterLib.ImageAugmenterUtils import DTYPE_FLOAT
+
+        # the crop is outside of the labels
+        outputs = self.getOutputs(DTYPE_FLOAT, transformations=[SpatialCrop(roi_start=(0, 0, 0), roi_end=(4, 3, 3))])
+        self.assertIsNone(outputs["SpatialCrop"][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
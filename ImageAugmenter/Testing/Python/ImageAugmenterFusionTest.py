@@ -0,0 +1,126 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+
+
+def getSmoothVolume(slices: int = 4, size: int = 64) -> torch.Tensor:
+    """Sum of two gaussian blobs, smooth enough for the interpolation of a single or of several resamplings to agree"""
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)
+    blobs = np.exp(-((x - 24) ** 2 + (y - 30) ** 2) / 120) + 0.5 * np.exp(-((x - 42) ** 2 + (y - 36) ** 2) / 60)
+    return torch.from_numpy(np.stack([blobs * (1 + 0.1 * sliceIdx) for sliceIdx in range(slices)]).astype(np.float32))
+
+
+class ImageAugmenterFusedIntensityTest(unittest.TestCase):
+    """A run of point-wise intensity transformations computed in a single pass gives the result of applying them one by one"""
+
+    def setUp(self) -> None:
+        from monai.transforms import NormalizeIntensity, ScaleIntensityRange, ShiftIntensity, ThresholdIntensity
+
+        self.transforms = [ShiftIntensity(offset=10.0), NormalizeIntensity(subtrahend=5.0, divisor=20.0, nonzero=True),
+                           ThresholdIntensity(threshold=0.5, above=True, cval=-1.0), ScaleIntensityRange(a_min=-1.0, a_max=3.0, b_min=0.0, b_max=1.0),
+                           ShiftIntensity(offset=-3.0), NormalizeIntensity(subtrahend=1.0, divisor=2.0)]
+        # larger than a block (see FUSED_BLOCK_BYTES), with zeros for the nonzero normalization and a NaN for the threshold
+        self.img = torch.from_numpy(np.random.default_rng(0).normal(0, 30, (8, 96, 96)).astype(np.float32))
+        self.img[0, :8] = -10.0
+        self.img[1, 0, 0] = float("nan")
+
+    def getSequential(self, img: torch.Tensor) -> torch.Tensor:
+        for transform in self.transforms:
+            img = transform(img)
+        return torch.as_tensor(img)
+
+    def test_fused_matches_sequential(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterFusion import ImageAugmenterFusedIntensity, fuseTransformations
+
+        fused = fuseTransformations(self.transforms)
+        self.assertEqual(len(fused), 1)
+        self.assertIsInstance(fused[0][1], ImageAugmenterFusedIntensity)
+
+        img = self.img.clone()
+        fusedImg = torch.as_tensor(fused[0][1](img))
+        # the input can be shared with other outputs, it's never modified
+        torch.testing.assert_close(img, self.img, equal_nan=True)
+        sequentialImg = self.getSequential(self.img)
+        self.assertEqual(fusedImg.dtype, sequentialImg.dtype)
+        torch.testing.assert_close(fusedImg, sequentialImg, rtol=1e-5, atol=1e-5, equal_nan=True)
+
+    def test_integer_volume(self) -> None:
+        from monai.transforms import ShiftIntensity, ThresholdIntensity
+
+        from ImageAugmenterLib.ImageAugmenterFusion import ImageAugmenterFusedIntensity
+
+        # integer volumes round after every step, like the transformations one by one
+        self.transforms = [ShiftIntensity(offset=10), ThresholdIntensity(threshold=0, above=True, cval=0), ShiftIntensity(offset=-3)]
+        img = self.img.nan_to_num().to(torch.int16)
+        torch.testing.assert_close(torch.as_tensor(ImageAugmenterFusedIntensity(self.transforms)(img)), self.getSequential(img), rtol=0, atol=0)
+
+    def test_statistics_end_a_run(self) -> None:
+        from monai.transforms import ScaleIntensity, ShiftIntensity
+
+        from ImageAugmenterLib.ImageAugmenterFusion import fuseTransformations
+
+        transforms = [ShiftIntensity(offset=1.0), ShiftIntensity(offset=2.0), ScaleIntensity(minv=0.0, maxv=1.0), ShiftIntensity(offset=3.0)]
+        self.assertEqual([transformIdx for transformIdx, transform in fuseTransformations(transforms)], [0, 2, 3])
+
+
+class ImageAugmenterFusedSpatialTest(unittest.TestCase):
+    """A run of spatial transformations resampled once gives the result of applying them one by one"""
+
+    def setUp(self) -> None:
+        from monai.transforms import Flip, Rotate, Zoom
+
+        self.transforms = [Rotate(angle=0.2, mode="bilinear"),
+                           Zoom(zoom=1.2, mode="bilinear", padding_mode="edge", align_corners=None),
+                           Flip(spatial_axis=0)]
+        self.img = getSmoothVolume()
+        # labels 1 and 2 on the two blobs
+        self.mask = ((self.img > 0.3).to(torch.uint8) + (self.img > 0.6).to(torch.uint8))
+        # the borders are filled from the padding of each resampling, the comparison is on the inner region
+        self.inner = (slice(None), slice(12, -12), slice(12, -12))
+
+    def getSequential(self, volume: torch.Tensor, labels: bool = False) -> torch.Tensor:
+        from ImageAugmenterLib.ImageAugmenterUtils import getLabelTransform
+
+        volume = volume.float()
+        for transform in self.transforms:
+            volume = (getLabelTransform(transform) if labels else transform)(volume)
+        return torch.as_tensor(volume)
+
+    def test_fused_matches_sequential(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterFusion import ImageAugmenterFusedSpatial, fuseTransformations, isLazyResamplingAvailable
+
+        if not isLazyResamplingAvailable():
+            self.skipTest("The installed MONAI has no lazy resampling")
+
+        fused = fuseTransformations(self.transforms)
+        self.assertEqual(len(fused), 1)
+        fusedTransform = fused[0][1]
+        self.assertIsInstance(fusedTransform, ImageAugmenterFusedSpatial)
+
+        fusedImg = torch.as_tensor(fusedTransform(self.img))
+        sequentialImg = self.getSequential(self.img)
+        self.assertEqual(fusedImg.shape, sequentialImg.shape)
+        self.assertLess((fusedImg - sequentialImg)[self.inner].abs().max().item(), 0.02)
+
+        fusedMask = torch.as_tensor(fusedTransform(self.mask.float(), labels=True))
+        sequentialMask = self.getSequential(self.mask, labels=True)
+        # nearest neighbour: only labels of the input, and a single resampling may only pick the other neighbour along the label borders
+        self.assertTrue(set(torch.unique(fusedMask).tolist()) <= {0, 1, 2})
+        sequentialMask = sequentialMask.float()[:, None]
+        labelBorders = (torch.nn.functional.max_pool2d(sequentialMask, 3, 1, 1) != -torch.nn.functional.max_pool2d(-sequentialMask, 3, 1, 1))[:, 0]
+        mismatches = fusedMask != sequentialMask[:, 0]
+        self.assertFalse((mismatches & ~labelBorders).any())
+        self.assertLess(mismatches.float().mean().item(), 0.05)
+
+    def test_fallback_without_lazy_resampling(self) -> None:
+        from ImageAugmenterLib import ImageAugmenterFusion
+
+        with mock.patch.object(ImageAugmenterFusion, "isLazyResamplingAvailable", return_value=False):
+            fused = ImageAugmenterFusion.fuseTransformations(self.transforms)
+        self.assertEqual([transform for transformIdx, transform in fused], self.transforms)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ImageAugmenterManifestTest(unittest.TestCase):
+    """A run resumes only the cases that are not completed, with the same settings, inputs and outputs"""
+
+    def setUp(self) -> None:
+        self.tempDir = tempfile.mkdtemp()
+        self.outputPath = os.path.join(self.tempDir, "output")
+        self.imgPath = self.createFile("input/case0/img.nrrd", "img")
+        self.maskPath = self.createFile("input/case0/mask.nrrd", "mask")
+        self.outputs = {"Flip": [self.createFile("output/case0_Flip/img.nrrd", "out"), self.createFile("output/case0_Flip/mask.nrrd", "out")]}
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def createFile(self, relativePath: str, content: str) -> str:
+        filePath = os.path.join(self.tempDir, relativePath)
+        os.makedirs(os.path.dirname(filePath), exist_ok=True)
+        with open(filePath, "w") as file:
+            file.write(content)
+        return filePath
+
+    def getManifest(self, runKey: str = "run"):
+        from ImageAugmenterLib.ImageAugmenterManifest import ImageAugmenterManifest
+        return ImageAugmenterManifest(self.outputPath, runKey, seed=42)
+
+    def test_recorded_case_is_done_after_a_restart(self) -> None:
+        self.getManifest().record(self.imgPath, self.maskPath, self.outputs)
+        # the journal alone, as after a crash
+        self.assertTrue(self.getManifest().isDone(self.imgPath, self.maskPath))
+
+        manifest = self.getManifest()
+        manifest.compact()
+        self.assertFalse(os.path.exists(manifest.journalPath))
+        self.assertTrue(self.getManifest().isDone(self.imgPath, self.maskPath))
+
+    def test_run_key(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterManifest import getRunKey
+
+        self.assertIsNone(getRunKey(""))
+        self.assertEqual(getRunKey("recipe", seed=1, samplesPerCase=2), getRunKey("recipe", samplesPerCase=2, seed=1))
+        self.assertNotEqual(getRunKey("recipe", seed=1), getRunKey("recipe", seed=2))
+
+        self.getManifest(runKey="run").record(self.imgPath, self.maskPath, self.outputs)
+        self.assertFalse(self.getManifest(runKey="other").isDone(self.imgPath, self.maskPath))
+        self.assertFalse(self.getManifest(runKey=None).isDone(self.imgPath, self.maskPath))
+
+    def test_changed_input_is_processed_again(self) -> None:
+        self.getManifest().record(self.imgPath, self.maskPath, self.outputs)
+        with open(self.maskPath, "a") as maskFile:
+            maskFile.write(" changed")
+        self.assertFalse(self.getManifest().isDone(self.imgPath, self.maskPath))
+
+    def test_missing_output_is_processed_again(self) -> None:
+        self.getManifest().record(self.imgPath, self.maskPath, self.outputs)
+        os.remove(self.outputs["Flip"][1])
+        self.assertFalse(self.getManifest().isDone(self.imgPath, self.maskPath))
+
+    def test_invalidated_case_is_processed_again(self) -> None:
+        manifest = self.getManifest()
+        manifest.record(self.imgPath, self.maskPath, self.outputs)
+        manifest.invalidate(self.imgPath)
+        self.assertFalse(self.getManifest().isDone(self.imgPath, self.maskPath))
+
+    def test_incomplete_journal_line_is_ignored(self) -> None:
+        manifest = self.getManifest()
+        manifest.record(self.imgPath, self.maskPath, self.outputs)
+        otherImgPath = self.createFile("input/case1/img.nrrd", "img")
+        with open(manifest.journalPath, "a") as journalFile:
+            journalFile.write('{"img": {"path": "' + otherImgPath)
+
+        manifest = self.getManifest()
+        self.assertTrue(manifest.isDone(self.imgPath, self.maskPath))
+        self.assertFalse(manifest.isDone(otherImgPath, None))
+
+    def test_case_recorded_only_when_written(self) -> None:
+        from concurrent.futures import Future
+
+        from ImageAugmenterLib.ImageAugmenterRunner import ImageAugmenterCaseResult
+
+        future = Future()
+        manifest = self.getManifest()
+        manifest.recordWhenWritten(self.imgPath, self.maskPath, ImageAugmenterCaseResult(caseName="case0", outputs=self.outputs, futures=[future]))
+        self.assertFalse(self.getManifest().isDone(self.imgPath, self.maskPath))
+
+        future.set_result(self.outputs["Flip"][0])
+        manifest.commitWritten()
+        self.assertTrue(self.getManifest().isDone(self.imgPath, self.maskPath))
+
+
+if __name__ == "__main__":
+    unittest.main()
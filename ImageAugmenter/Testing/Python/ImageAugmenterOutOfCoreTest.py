@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import SimpleITK as sitk
+
+
+class ImageAugmenterOutOfCoreTest(unittest.TestCase):
+    """A case streamed in slabs gives the same files of a case processed in memory"""
+
+    def setUp(self) -> None:
+        self.tempDir = tempfile.mkdtemp()
+        caseDir = os.path.join(self.tempDir, "input", "case0")
+        os.makedirs(caseDir)
+        # 40 slices of 64 KB once in float, slabs of 1 MB hold 16 of them
+        img = (np.random.default_rng(0).normal(0, 50, (40, 128, 128)) + 300).astype(np.int16)
+        mask = np.zeros(img.shape, np.uint8)
+        mask[10:30, 40:90, 50:100] = 3
+        imgImage = sitk.GetImageFromArray(img)
+        imgImage.SetSpacing((0.7, 0.8, 1.5))
+        imgImage.SetOrigin((10, -5, 3))
+        imgImage.SetDirection((0, 1, 0, 1, 0, 0, 0, 0, -1))
+        maskImage = sitk.GetImageFromArray(mask)
+        maskImage.CopyInformation(imgImage)
+        self.imgPath = os.path.join(caseDir, "img.nrrd")
+        self.maskPath = os.path.join(caseDir, "mask.nrrd")
+        sitk.WriteImage(imgImage, self.imgPath, useCompression=False)
+        sitk.WriteImage(maskImage, self.maskPath, useCompression=False)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def getTransformations(self):
+        from monai.transforms import (BorderPad, CenterSpatialCrop, Flip, GaussianSmooth, MedianSmooth, NormalizeIntensity,
+                                      ScaleIntensity, ShiftIntensity, SpatialCrop, SpatialPad, ThresholdIntensity)
+
+        return [ScaleIntensity(minv=0.0, maxv=1.0), ShiftIntensity(offset=10), NormalizeIntensity(subtrahend=100, divisor=3),
+                ThresholdIntensity(threshold=300, above=True, cval=0), MedianSmooth(radius=1), GaussianSmooth(sigma=1.0),
+                Flip(spatial_axis=1), SpatialPad(spatial_size=(48, 136, 140), method="symmetric", mode="constant", value=7),
+                BorderPad(spatial_border=3), SpatialCrop(roi_center=(20, 64, 64), roi_size=(20, 80, 90)),
+                CenterSpatialCrop(roi_size=(21, 100, 90))]
+
+    def run_case(self, outputName: str, outOfCore: bool, inSlabs: bool = False, **datasetSettings):
+        """Outputs of the case, inSlabs checks that the case has been streamed instead of loaded"""
+        from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
+        from ImageAugmenterLib.ImageAugmenterRunner import ImageAugmenterCaseProcessor
+        from ImageAugmenterLib.ImageAugmenterUtils import HIERARCHICAL
+
+        outputPath = os.path.join(self.tempDir, outputName)
+        dataset = ImageAugmenterDataset(imgPaths=[], transformations=self.getTransformations(), device="cpu", **datasetSettings)
+        caseProcessor = ImageAugmenterCaseProcessor(dataset=dataset, outputPath=outputPath, imgPrefix="img", maskPrefix="mask",
+                                                    isImgPrefixRegex=False, isMaskPrefixRegex=False, filesStructure=HIERARCHICAL,
+                                                    outOfCore=outOfCore, slabSize=1)
+        with mock.patch.object(ImageAugmenterCaseProcessor, "processCaseInSlabs", autospec=True,
+                               side_effect=ImageAugmenterCaseProcessor.processCaseInSlabs) as processCaseInSlabs:
+            result = caseProcessor(self.imgPath, self.maskPath)
+        self.assertEqual(processCaseInSlabs.called, inSlabs)
+        return {outputName: [sitk.ReadImage(filePath) for filePath in filePaths] for outputName, filePaths in result.outputs.items()}
+
+    def assertSameImages(self, outputs, otherOutputs) -> None:
+        self.assertEqual(outputs.keys(), otherOutputs.keys())
+        for outputName in outputs:
+            self.assertEqual(len(outputs[outputName]), len(otherOutputs[outputName]), outputName)
+            for image, otherImage in zip(outputs[outputName], otherOutputs[outputName]):
+                self.assertEqual(image.GetPixelIDTypeAsString(), otherImage.GetPixelIDTypeAsString(), outputName)
+                self.assertEqual(image.GetSize(), otherImage.GetSize(), outputName)
+                self.assertEqual(image.GetDirection(), otherImage.GetDirection(), outputName)
+                np.testing.assert_allclose(image.GetOrigin(), otherImage.GetOrigin(), err_msg=outputName)
+                np.testing.assert_allclose(image.GetSpacing(), otherImage.GetSpacing(), err_msg=outputName)
+                np.testing.assert_allclose(sitk.GetArrayFromImage(image), sitk.GetArrayFromImage(otherImage), atol=1e-3, err_msg=outputName)
+
+    def test_slabs_match_in_memory(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterOutOfCore import getSlabSlices, openRawVolume
+        from ImageAugmenterLib.ImageAugmenterUtils import DTYPE_RESTORE
+
+        volume = openRawVolume(self.imgPath)
+        self.assertIsNotNone(volume)
+        self.assertLess(getSlabSlices(volume, 1), volume.shape[0])
+
+        self.assertSameImages(self.run_case("memory", outOfCore=False), self.run_case("slabs", outOfCore=True, inSlabs=True))
+        self.assertSameImages(self.run_case("memory_restore", outOfCore=False, dtypePolicy=DTYPE_RESTORE, compactMasks=True),
+                              self.run_case("slabs_restore", outOfCore=True, inSlabs=True, dtypePolicy=DTYPE_RESTORE, compactMasks=True))
+
+    def test_chained_transformations(self) -> None:
+        from monai.transforms import GaussianSmooth, ScaleIntensity, ShiftIntensity
+
+        self.getTransformations = lambda: [ShiftIntensity(offset=10), ScaleIntensity(minv=0.0, maxv=1.0), GaussianSmooth(sigma=1.0)]
+        self.assertSameImages(self.run_case("memory", outOfCore=False, chainTransformations=True),
+                              self.run_case("slabs", outOfCore=True, inSlabs=True, chainTransformations=True))
+
+    def test_compressed_input_is_processed_in_memory(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterOutOfCore import openRawVolume
+
+        sitk.WriteImage(sitk.ReadImage(self.imgPath), self.imgPath, useCompression=True)
+        self.assertIsNone(openRawVolume(self.imgPath))
+        self.assertSameImages(self.run_case("memory", outOfCore=False), self.run_case("slabs", outOfCore=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
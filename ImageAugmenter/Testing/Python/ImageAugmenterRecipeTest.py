@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+TRANSFORMATIONS = {
+    "flip": {"enabled": True, "axis": 1},
+    "rotate": {"enabled": True, "angle": 0.3, "interpolationMode": "bilinear"},
+    "randomGaussianNoise": {"enabled": True, "mean": 0.0, "std": 0.1},
+}
+
+
+class ImageAugmenterRecipeTest(unittest.TestCase):
+    """A recipe is saved, loaded and hashed the same way, every compile gets its own transformations"""
+
+    def setUp(self) -> None:
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def test_save_and_load(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterRecipe import createRecipe, getRecipeHash, loadRecipe, saveRecipe
+
+        recipe = createRecipe({"spatialPad": {"enabled": True, "spatialSize": (8, 16, 16), "method": "symmetric", "mode": "constant"}})
+        recipePath = os.path.join(self.tempDir, "recipe.json")
+        saveRecipe(recipe, recipePath)
+        # the tuple is loaded as a list, the hash doesn't change
+        self.assertEqual(getRecipeHash(loadRecipe(recipePath)), getRecipeHash(recipe))
+
+    def test_hash_ignores_key_order(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterRecipe import createRecipe, getRecipeHash
+
+        reversedTransformations = dict(reversed(list(TRANSFORMATIONS.items())))
+        self.assertEqual(getRecipeHash(createRecipe(TRANSFORMATIONS)), getRecipeHash(createRecipe(reversedTransformations)))
+        changed = {**TRANSFORMATIONS, "flip": {"enabled": True, "axis": 0}}
+        self.assertNotEqual(getRecipeHash(createRecipe(TRANSFORMATIONS)), getRecipeHash(createRecipe(changed)))
+
+    def test_invalid_recipes(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterRecipe import loadRecipe, validateRecipe
+
+        with self.assertRaises(ValueError):
+            validateRecipe({"version": 0, "transformations": {}})
+        with self.assertRaises(ValueError):
+            validateRecipe({"version": 1})
+
+        recipePath = os.path.join(self.tempDir, "recipe.json")
+        with open(recipePath, "w") as recipeFile:
+            recipeFile.write("{")
+        with self.assertRaises(ValueError):
+            loadRecipe(recipePath)
+
+    def test_compile_returns_new_transformations(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterRecipe import compileRecipe, createRecipe
+        from ImageAugmenterLib.ImageAugmenterUtils import getTransformName
+
+        recipe = createRecipe(TRANSFORMATIONS)
+        first, second = compileRecipe(recipe), compileRecipe(recipe)
+        self.assertEqual([getTransformName(transform) for transform in first], [getTransformName(transform) for transform in second])
+        self.assertTrue(all(transform is not otherTransform for transform, otherTransform in zip(first, second)))
+
+    def test_transformation_keys(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterRecipe import compileRecipe, createRecipe, getTransformationKeys
+
+        recipe = createRecipe(TRANSFORMATIONS)
+        keys = getTransformationKeys(recipe)
+        self.assertEqual(len(keys), len(compileRecipe(recipe)))
+        self.assertEqual(len(set(keys)), len(keys))
+
+        changedKeys = getTransformationKeys(createRecipe({**TRANSFORMATIONS, "rotate": {**TRANSFORMATIONS["rotate"], "angle": 0.5}}))
+        self.assertEqual([key == changedKey for key, changedKey in zip(keys, changedKeys)].count(False), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+
+class ImageAugmenterRunnerTest(unittest.TestCase):
+    """Runs cases in worker processes started in a new interpreter, as inside Slicer or from a multithreaded process"""
+
+    def setUp(self) -> None:
+        self.tempDir = tempfile.mkdtemp()
+        self.inputPath = os.path.join(self.tempDir, "input")
+        self.outputPath = os.path.join(self.tempDir, "output")
+        self.cases = []
+        for caseIdx in range(3):
+            caseDir = os.path.join(self.inputPath, f"case{caseIdx}")
+            os.makedirs(caseDir)
+            img = np.random.default_rng(caseIdx).random((4, 8, 6), dtype=np.float32)
+            mask = (img > 0.5).astype(np.uint8)
+            sitk.WriteImage(sitk.GetImageFromArray(img), os.path.join(caseDir, "img.nrrd"))
+            sitk.WriteImage(sitk.GetImageFromArray(mask), os.path.join(caseDir, "mask.nrrd"))
+            self.cases.append((os.path.join(caseDir, "img.nrrd"), os.path.join(caseDir, "mask.nrrd")))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def test_worker_modules_import_without_slicer(self) -> None:
+        moduleDir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+        pythonExecutable = shutil.which("PythonSlicer", path=os.path.dirname(sys.executable)) or sys.executable
+        code = (f"import sys; sys.path.insert(0, {moduleDir!r}); import ImageAugmenterLib.ImageAugmenterRunner; "
+                "print('slicer' in sys.modules)")
+        output = subprocess.run([pythonExecutable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip().splitlines()[-1], "False")
+
+    def test_run_cases_spawn(self) -> None:
+        from monai.transforms import Flip
+
+        from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
+        from ImageAugmenterLib.ImageAugmenterRunner import ImageAugmenterCaseProcessor, getFreshInterpreterContext, runCases
+        from ImageAugmenterLib.ImageAugmenterUtils import HIERARCHICAL
+        from ImageAugmenterLib.ImageAugmenterWriter import ImageAugmenterWriter
+
+        dataset = ImageAugmenterDataset(imgPaths=[], maskPaths=[], transformations=[Flip(spatial_axis=1)], device="cpu")
+        caseProcessor = ImageAugmenterCaseProcessor(dataset=dataset, outputPath=self.outputPath, imgPrefix="img", maskPrefix="mask",
+                                                    isImgPrefixRegex=False, isMaskPrefixRegex=False, filesStructure=HIERARCHICAL)
+        doneCases = []
+        with ImageAugmenterWriter() as writer:
+            runCases(caseProcessor, iter(self.cases), writer=writer, numWorkers=2,
+                     onCaseDone=lambda caseIdx, imgPath, maskPath, result: doneCases.append(result.caseName),
+                     context=getFreshInterpreterContext("spawn"))
+
+        self.assertEqual(sorted(doneCases), ["case0", "case1", "case2"])
+        self.assertEqual(writer.writtenFiles, 6)
+        for imgPath, maskPath in self.cases:
+            caseName = os.path.basename(os.path.dirname(imgPath))
+            for inputPath, name in ((imgPath, "img.nrrd"), (maskPath, "mask.nrrd")):
+                output = sitk.GetArrayFromImage(sitk.ReadImage(os.path.join(self.outputPath, f"{caseName}_Flip", name)))
+                # the first axis of the volume is the channel of MONAI, spatial_axis=1 is the last one
+                expected = np.flip(sitk.GetArrayFromImage(sitk.ReadImage(inputPath)), axis=2)
+                np.testing.assert_array_equal(output, expected)
+
+    def test_mask_of_a_different_size_is_reported(self) -> None:
+        from monai.transforms import Flip
+
+        from ImageAugmenterLib.ImageAugmenterDataset import ImageAugmenterDataset
+        from ImageAugmenterLib.ImageAugmenterRunner import ImageAugmenterCaseProcessor, runCases
+        from ImageAugmenterLib.ImageAugmenterUtils import HIERARCHICAL
+        from ImageAugmenterLib.ImageAugmenterWriter import ImageAugmenterWriter
+
+        badImgPath, badMaskPath = self.cases[1]
+        sitk.WriteImage(sitk.GetImageFromArray(np.zeros((4, 8, 5), dtype=np.uint8)), badMaskPath)
+        dataset = ImageAugmenterDataset(imgPaths=[], maskPaths=[], transformations=[Flip(spatial_axis=1)], device="cpu")
+        caseProcessor = ImageAugmenterCaseProcessor(dataset=dataset, outputPath=self.outputPath, imgPrefix="img", maskPrefix="mask",
+                                                    isImgPrefixRegex=False, isMaskPrefixRegex=False, filesStructure=HIERARCHICAL)
+        results = {}
+        with ImageAugmenterWriter() as writer:
+            runCases(caseProcessor, iter(self.cases), writer=writer,
+                     onCaseDone=lambda caseIdx, imgPath, maskPath, result: results.update({result.caseName: result}))
+
+        # the other cases are still processed, the mismatching one is reported without writing anything
+        self.assertEqual(sorted(results), ["case0", "case1", "case2"])
+        self.assertIn(badMaskPath, results["case1"].error)
+        self.assertIsNone(results["case0"].error)
+        self.assertEqual(writer.writtenFiles, 4)
+        self.assertFalse(os.path.exists(os.path.join(self.outputPath, "case1_Flip")))
+
+
+if __name__ == "__main__":
+    unittest.main()
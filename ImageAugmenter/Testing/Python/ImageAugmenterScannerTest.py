@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ImageAugmenterScannerTest(unittest.TestCase):
+    """Images and masks are paired by case key while the folders are scanned, the files that can't be paired are reported at the end"""
+
+    def setUp(self) -> None:
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def createFiles(self, *relativePaths: str) -> None:
+        for relativePath in relativePaths:
+            filePath = os.path.join(self.tempDir, relativePath)
+            os.makedirs(os.path.dirname(filePath), exist_ok=True)
+            open(filePath, "w").close()
+
+    def scan(self, imgPrefix: str = "img", maskPrefix: str = "mask", isImgPrefixRegex: bool = False, isMaskPrefixRegex: bool = False):
+        from ImageAugmenterLib.ImageAugmenterScanner import scanImagesAndMasks
+
+        pairs = scanImagesAndMasks(self.tempDir, imgPrefix, maskPrefix, isImgPrefixRegex, isMaskPrefixRegex)
+        return sorted((os.path.relpath(imgPath, self.tempDir), maskPath and os.path.relpath(maskPath, self.tempDir)) for imgPath, maskPath in pairs)
+
+    def test_pairs_by_case_key(self) -> None:
+        # listed in a different order, and the mask extension differs
+        self.createFiles("flat/img_002.nrrd", "flat/mask_001.nii.gz", "flat/img_001.nrrd", "flat/mask_002.nrrd")
+        self.assertEqual(self.scan(), [("flat/img_001.nrrd", "flat/mask_001.nii.gz"), ("flat/img_002.nrrd", "flat/mask_002.nrrd")])
+
+    def test_pairs_single_image_and_mask_of_a_case(self) -> None:
+        self.createFiles("case0/img.nrrd", "case0/mask_seg.nrrd", "case1/img.nrrd", "case1/mask.nrrd")
+        self.assertEqual(self.scan(), [("case0/img.nrrd", "case0/mask_seg.nrrd"), ("case1/img.nrrd", "case1/mask.nrrd")])
+
+    def test_regex_case_group(self) -> None:
+        self.createFiles("flat/ct_A1.nrrd", "flat/ct_B2.nrrd", "flat/B2_label.nrrd", "flat/A1_label.nrrd")
+        pairs = self.scan(imgPrefix=r"^ct_(?P<case>\w+)\.nrrd$", maskPrefix=r"^(?P<case>\w+)_label\.nrrd$", isImgPrefixRegex=True, isMaskPrefixRegex=True)
+        self.assertEqual(pairs, [("flat/ct_A1.nrrd", "flat/A1_label.nrrd"), ("flat/ct_B2.nrrd", "flat/B2_label.nrrd")])
+
+    def test_regex_matching_the_whole_name(self) -> None:
+        # nothing is left once the match is removed from the image names, their names are the case keys
+        self.createFiles("flat/img01.nrrd", "flat/img01_mask.nrrd", "flat/img02.nrrd", "flat/img02_mask.nrrd")
+        pairs = self.scan(imgPrefix=r"^img\d+\.nrrd$", maskPrefix="_mask", isImgPrefixRegex=True)
+        self.assertEqual(pairs, [("flat/img01.nrrd", "flat/img01_mask.nrrd"), ("flat/img02.nrrd", "flat/img02_mask.nrrd")])
+        pairs = self.scan(imgPrefix=r"^img\d+\.nrrd$", maskPrefix=r"_mask\.nrrd$", isImgPrefixRegex=True, isMaskPrefixRegex=True)
+        self.assertEqual(pairs, [("flat/img01.nrrd", "flat/img01_mask.nrrd"), ("flat/img02.nrrd", "flat/img02_mask.nrrd")])
+
+    def test_separate_image_and_mask_trees(self) -> None:
+        # the test images have no labels, they're reported
+        self.createFiles("imagesTr/la_003_0000.nii.gz", "imagesTr/la_007_0000.nii.gz", "imagesTs/la_001_0000.nii.gz",
+                         "labelsTr/la_007.nii.gz", "labelsTr/la_003.nii.gz")
+        with self.assertRaises(ValueError) as context:
+            self.scan(imgPrefix=r"_0000\.nii\.gz$", maskPrefix=r"^la_\d+\.nii\.gz$", isImgPrefixRegex=True, isMaskPrefixRegex=True)
+        self.assertIn(os.path.join("imagesTs", "la_001_0000.nii.gz"), str(context.exception))
+        self.assertNotIn("la_003", str(context.exception))
+
+        shutil.rmtree(os.path.join(self.tempDir, "imagesTs"))
+        pairs = self.scan(imgPrefix=r"_0000\.nii\.gz$", maskPrefix=r"^la_\d+\.nii\.gz$", isImgPrefixRegex=True, isMaskPrefixRegex=True)
+        self.assertEqual(pairs, [("imagesTr/la_003_0000.nii.gz", "labelsTr/la_003.nii.gz"), ("imagesTr/la_007_0000.nii.gz", "labelsTr/la_007.nii.gz")])
+
+    def test_separate_hierarchical_trees(self) -> None:
+        self.createFiles("images/case0/img.nrrd", "images/case1/img.nrrd", "masks/case1/mask_seg.nrrd", "masks/case0/mask_seg.nrrd")
+        self.assertEqual(self.scan(), [("images/case0/img.nrrd", "masks/case0/mask_seg.nrrd"), ("images/case1/img.nrrd", "masks/case1/mask_seg.nrrd")])
+
+    def test_cases_missing_the_image_or_the_mask_are_not_paired(self) -> None:
+        self.createFiles("case0/img.nrrd", "case0/mask.nrrd", "case1/img.nrrd", "case2/mask.nrrd")
+        with self.assertRaises(ValueError) as context:
+            self.scan()
+        self.assertIn(os.path.join("case1", "img.nrrd"), str(context.exception))
+        self.assertIn(os.path.join("case2", "mask.nrrd"), str(context.exception))
+
+    def test_images_without_masks(self) -> None:
+        self.createFiles("case0/img.nrrd", "case1/img.nrrd")
+        self.assertEqual(self.scan(), [("case0/img.nrrd", None), ("case1/img.nrrd", None)])
+
+    def test_unmatched_files_are_reported(self) -> None:
+        self.createFiles("flat/img_001.nrrd", "flat/mask_001.nrrd", "flat/img_002.nrrd", "flat/mask_003.nrrd")
+        with self.assertRaises(ValueError) as context:
+            self.scan()
+        self.assertIn("img_002.nrrd", str(context.exception))
+        self.assertIn("mask_003.nrrd", str(context.exception))
+
+    def test_image_of_a_case_without_mask_is_reported(self) -> None:
+        # masks are used, so an image found alone can't be used as a case without mask
+        self.createFiles("case0/img.nrrd", "case0/mask.nrrd", "case1/img.nrrd")
+        with self.assertRaises(ValueError) as context:
+            self.scan()
+        self.assertIn(os.path.join("case1", "img.nrrd"), str(context.exception))
+
+    def test_ambiguous_keys_are_reported(self) -> None:
+        self.createFiles("flat/img_001.nrrd", "flat/img_001.nii.gz", "flat/mask_001.nrrd", "flat/img_002.nrrd", "flat/mask_002.nrrd")
+        with self.assertRaises(ValueError) as context:
+            self.scan()
+        self.assertIn("img_001.nii.gz", str(context.exception))
+
+    def test_pairs_are_streamed_before_unmatched_files_are_reported(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterScanner import getPairingIndex, scanImagesAndMasks
+
+        self.createFiles("case0/img.nrrd", "case0/mask.nrrd", "case1/img_a.nrrd", "case1/img_b.nrrd", "case1/mask.nrrd",
+                         "case2/img.nrrd", "case2/mask.nrrd")
+        pairingIndex = getPairingIndex("img", "mask", False, False)
+        pairs = scanImagesAndMasks(self.tempDir, "img", "mask", False, False, pairingIndex=pairingIndex)
+        firstImgPath, firstMaskPath = next(pairs)
+        self.assertEqual(os.path.relpath(firstImgPath, self.tempDir), os.path.join("case0", "img.nrrd"))
+
+        # the files of case1 can't be paired, they are left in the index instead of stopping the scan
+        self.assertEqual([os.path.relpath(imgPath, self.tempDir) for imgPath, maskPath in pairs], [os.path.join("case2", "img.nrrd")])
+        self.assertTrue(pairingIndex.hasErrors())
+        self.assertIn("img_b.nrrd", str(pairingIndex.getError()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+
+class ImageAugmenterWriterTest(unittest.TestCase):
+    """Volumes are written in the background, with a bounded queue, and write errors stop the run"""
+
+    def setUp(self) -> None:
+        self.tempDir = tempfile.mkdtemp()
+        self.image = sitk.GetImageFromArray(np.arange(4 * 8 * 6, dtype=np.int16).reshape(4, 8, 6))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def test_writes_all_files(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterWriter import ImageAugmenterWriter
+
+        filePaths = [os.path.join(self.tempDir, f"img{fileIdx}.nrrd") for fileIdx in range(5)]
+        with ImageAugmenterWriter(maxWorkers=2, maxPending=2) as writer:
+            futures = [writer.write(self.image, filePath) for filePath in filePaths]
+
+        self.assertEqual([future.result() for future in futures], filePaths)
+        stats = writer.getStats()
+        self.assertEqual(stats["writtenFiles"], 5)
+        self.assertEqual(stats["writtenBytes"], sum(os.path.getsize(filePath) for filePath in filePaths))
+        self.assertEqual(stats["queueDepth"], 0)
+        self.assertEqual(stats["failedFiles"], 0)
+        for filePath in filePaths:
+            np.testing.assert_array_equal(sitk.GetArrayFromImage(sitk.ReadImage(filePath)), sitk.GetArrayFromImage(self.image))
+
+    def test_queue_is_bounded(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterWriter import ImageAugmenterWriter
+
+        writer = ImageAugmenterWriter(maxWorkers=1, maxPending=2)
+        blocked = threading.Event()
+        # the only writer thread waits, so the queued volumes can't be written
+        writer.executor.submit(blocked.wait)
+        writer.write(self.image, os.path.join(self.tempDir, "img0.nrrd"))
+        writer.write(self.image, os.path.join(self.tempDir, "img1.nrrd"))
+
+        thirdWrite = threading.Thread(target=writer.write, args=(self.image, os.path.join(self.tempDir, "img2.nrrd")))
+        thirdWrite.start()
+        thirdWrite.join(timeout=0.5)
+        self.assertTrue(thirdWrite.is_alive())
+        self.assertEqual(writer.queueDepth, 2)
+
+        blocked.set()
+        thirdWrite.join()
+        writer.close()
+        self.assertEqual(writer.writtenFiles, 3)
+
+    def test_write_errors_are_raised(self) -> None:
+        from ImageAugmenterLib.ImageAugmenterWriter import ImageAugmenterWriter
+
+        badPath = os.path.join(self.tempDir, "missing", "img.nrrd")
+        writer = ImageAugmenterWriter(maxWorkers=1)
+        writer.write(self.image, badPath)
+        with self.assertRaises(ValueError) as context:
+            writer.flush()
+        self.assertIn(badPath, str(context.exception))
+
+        # raised once, then the writer can still be used
+        writer.write(self.image, os.path.join(self.tempDir, "img.nrrd"))
+        writer.close()
+        self.assertEqual(writer.writtenFiles, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()